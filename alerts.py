@@ -1,14 +1,62 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, and_, or_
 from database import get_db, Alert
+from pagination import PAGE_DEFAULT_LIMIT, PAGE_MAX_LIMIT, encode_cursor, decode_cursor, not_modified
+from pydantic import BaseModel
+from typing import Optional
+from datetime import date, datetime
 
 router = APIRouter()
 
-@router.get("/{user_id}")
-async def list_alerts(user_id: int, db: AsyncSession = Depends(get_db)):
+class AlertOut(BaseModel):
+    id: int
+    purchase_id: int
+    alert_type: str
+    scheduled_for: date
+    sent_at: Optional[datetime]
+    channel: str
+    status: str
+
+class AlertPage(BaseModel):
+    items: list[AlertOut]
+    next_cursor: Optional[str]
+
+ALERT_COLUMNS = [getattr(Alert, name) for name in AlertOut.model_fields]
+
+@router.get("/{user_id}", response_model=AlertPage)
+async def list_alerts(
+    user_id: int,
+    request: Request,
+    response: Response,
+    status: Optional[list[str]] = Query(None),
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_DEFAULT_LIMIT, ge=1, le=PAGE_MAX_LIMIT),
+    db: AsyncSession = Depends(get_db),
+):
+    """One page of a user's alerts, latest scheduled_for first. Same cursor and ETag scheme as list_purchases."""
+    unchanged = await not_modified(request, response, db, user_id)
+    if unchanged is not None:
+        return unchanged
+    query = select(*ALERT_COLUMNS).where(Alert.user_id == user_id)
+    if status:
+        query = query.where(Alert.status.in_(status))
+    if cursor:
+        before_day, before_id = decode_cursor(cursor)
+        if before_day is None:
+            # scheduled_for is never null, so only a hand-made cursor lacks a date
+            raise HTTPException(status_code=400, detail="invalid cursor")
+        query = query.where(or_(
+            Alert.scheduled_for < before_day,
+            and_(Alert.scheduled_for == before_day, Alert.id < before_id),
+        ))
     result = await db.execute(
-        select(Alert).where(Alert.user_id == user_id).order_by(Alert.scheduled_for.desc())
+        query.order_by(Alert.scheduled_for.desc(), Alert.id.desc()).limit(limit + 1)
     )
-    alerts = result.scalars().all()
-    return [a.__dict__ for a in alerts]
+    rows = result.mappings().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["scheduled_for"], rows[-1]["id"])
+    return {"items": rows, "next_cursor": next_cursor}
@@ -0,0 +1,257 @@
+"""
+Compiled email templates for alert and daily digest emails.
+
+Templates are written once with {label} placeholders for locale strings and
+-field- slots for per-message values. Each (locale, app_url) pair is compiled a
+single time: labels are filled in and the static HTML around the slots is
+split into cached fragments, so a render only fills the slots and joins. The -field-
+syntax doubles as SendGrid substitution tokens, so a compiled template's
+source can be shipped as-is for batch sends.
+"""
+
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+
+DEFAULT_LOCALE = "en"
+
+LOCALE_STRINGS = {
+    "en": {
+        "subject": "-urgency- Return deadline: -merchant_name- — -days_left- -days_unit- left",
+        "urgent": "⚠️ URGENT",
+        "reminder": "🔔",
+        "heading": "Return Deadline Alert",
+        "day_one": "day",
+        "day_other": "days",
+        "left_to_return": "left to return",
+        "order": "Order",
+        "amount": "Amount",
+        "deadline": "Return deadline",
+        "cta": "VIEW IN RETURNRADAR →",
+        "footer": "You're receiving this because a return window is closing.",
+        "manage": "Manage preferences",
+        "your_order": "Your order",
+        "not_available": "N/A",
+        "unknown_amount": "Unknown amount",
+        "unknown": "Unknown",
+        "digest_subject_one": "-urgency- 1 return deadline coming up — -days_left- -days_unit- left",
+        "digest_subject_other": "-urgency- -count- return deadlines coming up — soonest in -days_left- -days_unit-",
+        "digest_heading": "Daily Return Deadline Digest",
+        "digest_footer": "You're receiving this because return windows are closing.",
+        "digest_row": "- -merchant_name-: -days_left- -days_unit- left (deadline -deadline-, -amount-)",
+        "date": "{month} {day:02d}, {year}",
+        "months": ("January", "February", "March", "April", "May", "June", "July",
+                   "August", "September", "October", "November", "December"),
+    },
+    "es": {
+        "subject": "-urgency- Plazo de devolución: -merchant_name- — quedan -days_left- -days_unit-",
+        "urgent": "⚠️ URGENTE",
+        "reminder": "🔔",
+        "heading": "Alerta de plazo de devolución",
+        "day_one": "día",
+        "day_other": "días",
+        "left_to_return": "para devolver",
+        "order": "Pedido",
+        "amount": "Importe",
+        "deadline": "Fecha límite de devolución",
+        "cta": "VER EN RETURNRADAR →",
+        "footer": "Recibes este correo porque un plazo de devolución está por vencer.",
+        "manage": "Gestionar preferencias",
+        "your_order": "Tu pedido",
+        "not_available": "N/D",
+        "unknown_amount": "Importe desconocido",
+        "unknown": "Desconocido",
+        "digest_subject_one": "-urgency- 1 plazo de devolución vence en -days_left- -days_unit-",
+        "digest_subject_other": "-urgency- -count- plazos de devolución por vencer — el primero en -days_left- -days_unit-",
+        "digest_heading": "Resumen diario de plazos de devolución",
+        "digest_footer": "Recibes este correo porque hay plazos de devolución por vencer.",
+        "digest_row": "- -merchant_name-: -days_left- -days_unit- (vence el -deadline-, -amount-)",
+        "date": "{day} de {month} de {year}",
+        "months": ("enero", "febrero", "marzo", "abril", "mayo", "junio", "julio",
+                   "agosto", "septiembre", "octubre", "noviembre", "diciembre"),
+    },
+}
+
+ALERT_FIELDS = (
+    "urgency", "days_left", "days_color", "days_unit", "merchant_name", "items",
+    "order_id", "amount", "deadline_color", "deadline",
+)
+
+ALERT_HTML_SOURCE = """
+    <div style="font-family: monospace; max-width: 520px; margin: 0 auto; background: #080d14; color: #e2e8f0; padding: 32px; border-radius: 12px;">
+      <div style="font-size: 22px; font-weight: 800; margin-bottom: 4px; color: #f1f5f9;">ReturnRadar</div>
+      <div style="font-size: 11px; color: #475569; margin-bottom: 28px; text-transform: uppercase; letter-spacing: 0.1em;">{heading}</div>
+
+      <div style="background: #0c1420; border: 1px solid #1e2d40; border-radius: 10px; padding: 24px; margin-bottom: 20px; text-align: center;">
+        <div style="font-size: 48px; font-weight: 800; color: -days_color-; line-height: 1;">-days_left-</div>
+        <div style="font-size: 12px; color: #475569; text-transform: uppercase; letter-spacing: 0.1em;">-days_unit- {left_to_return}</div>
+      </div>
+
+      <div style="margin-bottom: 20px;">
+        <div style="font-size: 18px; font-weight: 700; color: #f1f5f9;">-merchant_name-</div>
+        <div style="font-size: 13px; color: #64748b; margin-top: 2px;">-items-</div>
+      </div>
+
+      <table style="width: 100%; font-size: 13px; border-collapse: collapse; margin-bottom: 24px;">
+        <tr style="border-bottom: 1px solid #1e2d40;">
+          <td style="padding: 8px 0; color: #475569;">{order}</td>
+          <td style="padding: 8px 0; text-align: right; color: #e2e8f0;">-order_id-</td>
+        </tr>
+        <tr style="border-bottom: 1px solid #1e2d40;">
+          <td style="padding: 8px 0; color: #475569;">{amount}</td>
+          <td style="padding: 8px 0; text-align: right; color: #e2e8f0;">-amount-</td>
+        </tr>
+        <tr>
+          <td style="padding: 8px 0; color: #475569;">{deadline}</td>
+          <td style="padding: 8px 0; text-align: right; color: -deadline_color-; font-weight: 600;">-deadline-</td>
+        </tr>
+      </table>
+
+      <a href="{app_url}" style="display: block; background: linear-gradient(135deg, #22d3ee, #818cf8); color: #0c1420; text-align: center; padding: 14px; border-radius: 8px; text-decoration: none; font-weight: 700; font-size: 13px; letter-spacing: 0.05em;">
+        {cta}
+      </a>
+
+      <div style="margin-top: 20px; font-size: 11px; color: #334155; text-align: center;">
+        {footer}<br>
+        <a href="{app_url}/settings" style="color: #475569;">{manage}</a>
+      </div>
+    </div>
+    """
+
+ALERT_TEXT_SOURCE = """ReturnRadar — {heading}
+
+-days_left- -days_unit- {left_to_return}
+
+-merchant_name-
+-items-
+
+{order}: -order_id-
+{amount}: -amount-
+{deadline}: -deadline-
+
+{cta} {app_url}
+
+{footer}
+{manage}: {app_url}/settings
+"""
+
+
+DIGEST_SUBJECT_FIELDS = ("urgency", "count", "days_left", "days_unit")
+DIGEST_FIELDS = ("rows",)
+
+# One row per alert; rows are rendered with the alert fields
+DIGEST_ROW_HTML_SOURCE = """
+        <tr style="border-bottom: 1px solid #1e2d40;">
+          <td style="padding: 10px 0;">
+            <div style="font-weight: 700; color: #f1f5f9;">-merchant_name-</div>
+            <div style="font-size: 12px; color: #64748b;">-items- · -amount-</div>
+          </td>
+          <td style="padding: 10px 0; text-align: right; white-space: nowrap;">
+            <div style="font-weight: 800; color: -days_color-;">-days_left- -days_unit-</div>
+            <div style="font-size: 12px; color: #475569;">-deadline-</div>
+          </td>
+        </tr>"""
+
+DIGEST_HTML_SOURCE = """
+    <div style="font-family: monospace; max-width: 520px; margin: 0 auto; background: #080d14; color: #e2e8f0; padding: 32px; border-radius: 12px;">
+      <div style="font-size: 22px; font-weight: 800; margin-bottom: 4px; color: #f1f5f9;">ReturnRadar</div>
+      <div style="font-size: 11px; color: #475569; margin-bottom: 28px; text-transform: uppercase; letter-spacing: 0.1em;">{digest_heading}</div>
+
+      <table style="width: 100%; font-size: 13px; border-collapse: collapse; margin-bottom: 24px;">-rows-
+      </table>
+
+      <a href="{app_url}" style="display: block; background: linear-gradient(135deg, #22d3ee, #818cf8); color: #0c1420; text-align: center; padding: 14px; border-radius: 8px; text-decoration: none; font-weight: 700; font-size: 13px; letter-spacing: 0.05em;">
+        {cta}
+      </a>
+
+      <div style="margin-top: 20px; font-size: 11px; color: #334155; text-align: center;">
+        {digest_footer}<br>
+        <a href="{app_url}/settings" style="color: #475569;">{manage}</a>
+      </div>
+    </div>
+    """
+
+DIGEST_TEXT_SOURCE = """ReturnRadar — {digest_heading}
+
+-rows-
+
+{cta} {app_url}
+{manage}: {app_url}/settings
+"""
+
+
+class CompiledTemplate:
+    """A template split once into static fragments and -field- slots."""
+
+    def __init__(self, source: str, fields: tuple[str, ...]):
+        self.source = source
+        self.fields = fields
+        slot = re.compile("-(" + "|".join(re.escape(f) for f in fields) + ")-")
+        # split() alternates static text with captured slot names
+        self._parts = slot.split(source)
+        self._slots = [(i, self._parts[i]) for i in range(1, len(self._parts), 2)]
+
+    def render(self, values: dict) -> str:
+        parts = self._parts.copy()
+        for i, name in self._slots:
+            parts[i] = values[name]
+        return "".join(parts)
+
+
+def supported_locale(locale: str) -> str:
+    """The locale itself if it has strings, else DEFAULT_LOCALE."""
+    return locale if locale in LOCALE_STRINGS else DEFAULT_LOCALE
+
+
+def locale_strings(locale: str) -> dict:
+    return LOCALE_STRINGS[supported_locale(locale)]
+
+
+def format_date(d, locale: str) -> str:
+    """A deadline as the locale writes it, e.g. "March 03, 2026" or "3 de marzo de 2026"."""
+    strings = locale_strings(locale)
+    return strings["date"].format(month=strings["months"][d.month - 1], day=d.day, year=d.year)
+
+
+def alert_templates(locale: str, app_url: str) -> tuple[CompiledTemplate, CompiledTemplate, CompiledTemplate]:
+    """Returns (subject, html, text) templates for a locale, compiled once."""
+    # Users' locales are free-form; cache per supported locale, not per raw value
+    return _alert_templates(supported_locale(locale), app_url)
+
+
+@lru_cache(maxsize=None)
+def _alert_templates(locale: str, app_url: str) -> tuple[CompiledTemplate, CompiledTemplate, CompiledTemplate]:
+    labels = dict(locale_strings(locale), app_url=app_url)
+    return (
+        CompiledTemplate(labels["subject"], ALERT_FIELDS),
+        CompiledTemplate(ALERT_HTML_SOURCE.format(**labels), ALERT_FIELDS),
+        CompiledTemplate(ALERT_TEXT_SOURCE.format(**labels), ALERT_FIELDS),
+    )
+
+
+class DigestTemplates(NamedTuple):
+    subject_one: CompiledTemplate  # a single alert
+    subject_other: CompiledTemplate
+    html: CompiledTemplate
+    row_html: CompiledTemplate
+    text: CompiledTemplate
+    row_text: CompiledTemplate
+
+
+def digest_templates(locale: str, app_url: str) -> DigestTemplates:
+    """The daily digest's templates for a locale, compiled once."""
+    return _digest_templates(supported_locale(locale), app_url)
+
+
+@lru_cache(maxsize=None)
+def _digest_templates(locale: str, app_url: str) -> DigestTemplates:
+    labels = dict(locale_strings(locale), app_url=app_url)
+    return DigestTemplates(
+        subject_one=CompiledTemplate(labels["digest_subject_one"], DIGEST_SUBJECT_FIELDS),
+        subject_other=CompiledTemplate(labels["digest_subject_other"], DIGEST_SUBJECT_FIELDS),
+        html=CompiledTemplate(DIGEST_HTML_SOURCE.format(**labels), DIGEST_FIELDS),
+        row_html=CompiledTemplate(DIGEST_ROW_HTML_SOURCE, ALERT_FIELDS),
+        text=CompiledTemplate(DIGEST_TEXT_SOURCE.format(**labels), DIGEST_FIELDS),
+        row_text=CompiledTemplate(labels["digest_row"], ALERT_FIELDS),
+    )
@@ -0,0 +1,90 @@
+"""
+In-process pub/sub feeding the per-user server-sent events stream
+(GET /api/events/{user_id}), so open dashboards hear about new purchases and
+alert deliveries instead of polling the listings.
+
+Writers publish after their commit:
+  purchase.created    ingest_email stored a Purchase
+  purchase.updated    PATCH /api/purchases/{id}
+  purchase.deleted    DELETE /api/purchases/{id}
+  alert.sent / alert.failed / alert.skipped    run_alerts recorded a delivery
+
+Each subscriber has its own queue of EVENT_QUEUE_SIZE messages. publish never
+waits: a subscriber whose queue is full (a client not reading, or a stalled
+connection) is dropped and its stream ends, and the browser's EventSource
+reconnects and refetches the listings (cheap thanks to the ETags).
+
+The bus is per process: events reach subscribers connected to the process
+that made the write. The ingest workers run inside the API process by
+default; run the scheduler there too (APScheduler, see scheduler.py) for
+alert events, and use a single worker or sticky routing per user when
+running several.
+"""
+
+import asyncio
+import json
+import os
+from typing import Optional
+
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", "64"))
+
+
+class Subscription:
+    __slots__ = ("user_id", "queue", "dropped")
+
+    def __init__(self, user_id: int, queue_size: int):
+        self.user_id = user_id
+        # Items are (event, json data), or None once the subscriber is dropped
+        self.queue: asyncio.Queue[Optional[tuple[str, str]]] = asyncio.Queue(queue_size)
+        self.dropped = False
+
+
+class EventBus:
+    """user_id -> live subscriptions. Call from the event loop only."""
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: dict[int, set[Subscription]] = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.user_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id: int, event: str, data: dict):
+        """Queue an event for the user's subscribers without waiting on any of them."""
+        subscribers = self._subscribers.get(user_id)
+        if not subscribers:
+            return
+        message = (event, json.dumps(data, default=str))  # serialized once for all subscribers
+        self.published += 1
+        for subscription in list(subscribers):
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drop(subscription)
+
+    def _drop(self, subscription: Subscription):
+        self.unsubscribe(subscription)
+        subscription.dropped = True
+        self.dropped += 1
+        # Replace the backlog with the end marker so the stream stops right away
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+event_bus = EventBus()
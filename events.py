@@ -0,0 +1,42 @@
+import asyncio
+import os
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+from event_bus import event_bus, Subscription
+
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get("EVENT_HEARTBEAT_SECONDS", "20"))
+EVENT_RETRY_MS = 5000  # EventSource reconnect delay after the stream ends
+
+router = APIRouter()
+
+async def _stream(user_id: int):
+    subscription: Subscription = event_bus.subscribe(user_id)
+    try:
+        yield f"retry: {EVENT_RETRY_MS}\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), EVENT_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from timing out the idle connection and surfaces dead clients
+                yield ": ping\n\n"
+                continue
+            if message is None:
+                # Dropped for falling behind; the client reconnects and refetches
+                yield "event: dropped\ndata: {}\n\n"
+                return
+            event, data = message
+            yield f"event: {event}\ndata: {data}\n\n"
+    finally:
+        event_bus.unsubscribe(subscription)
+
+@router.get("/{user_id}")
+async def stream_events(user_id: int):
+    """
+    Server-sent events for one user: purchase.created/updated/deleted and
+    alert.sent/failed/skipped, each with a JSON payload. See event_bus.py.
+    """
+    return StreamingResponse(
+        _stream(user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
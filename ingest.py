@@ -0,0 +1,240 @@
+"""
+Background ingestion queue. The inbound webhook only stores the raw Email row
+(parsed_status='pending') and returns; workers here claim pending rows and run
+the parsing pipeline. The queue is the emails table itself, so no broker is needed.
+
+Run workers inside the API process (main.py starts them in its lifespan) or as
+a separate process:
+  python ingest.py
+
+Crash recovery: a claimed row is 'processing' with processing_started_at set.
+If its worker dies, the row becomes claimable again after INGEST_STALE_SECONDS.
+Rows that keep failing are marked 'failed' after INGEST_MAX_ATTEMPTS.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select, update, func, and_, or_
+from database import SessionLocal, Email, init_db, insert_purchases
+from event_bus import event_bus
+from parser import process_email, run_analyze_email, claude_coalescer, PIPELINE_STAGE_SECONDS
+from parse_executor import parse_executor
+from merchant_templates import merchant_templates
+from merchant_policies import policy_index
+from scheduler import schedule_alerts
+
+INGEST_CONCURRENCY = int(os.environ.get("INGEST_CONCURRENCY", "4"))
+INGEST_MAX_PENDING = int(os.environ.get("INGEST_MAX_PENDING", "10000"))
+INGEST_STALE_SECONDS = int(os.environ.get("INGEST_STALE_SECONDS", "300"))
+INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_POLL_SECONDS = float(os.environ.get("INGEST_POLL_SECONDS", "5"))
+
+STAGE_DB_COMMIT = PIPELINE_STAGE_SECONDS.labels("db_commit")
+
+
+async def ingest_email(db, email_record: Email) -> dict:
+    """
+    Classify and parse one stored email and insert its Purchase.
+    Sets email_record.parsed_status and commits. Returns a status dict.
+    """
+    subject = email_record.subject or ""
+    body = email_record.body_html or email_record.body_text or ""
+    from_addr = email_record.from_address or ""
+
+    # Classify (and extract, for receipts) off the event loop
+    from_domain = email_record.from_domain or ""
+    body_text_clean, classification, heuristics = await run_analyze_email(
+        subject, body, bool(email_record.body_html), from_addr, from_domain,
+        await merchant_templates.rules_for(from_domain),
+    )
+    email_record.body_excerpt = body_text_clean[:6000]
+    email_record.classification = classification
+
+    if classification != "receipt":
+        email_record.parsed_status = "skipped"
+        await db.commit()
+        return {"status": "skipped", "classification": classification}
+
+    # Parse
+    purchase_data = await process_email(
+        user_id=email_record.user_id,
+        email_id=email_record.id,
+        subject=subject,
+        body_html=body,
+        from_address=from_addr,
+        received_at=email_record.received_at,
+        body_text=body_text_clean,
+        classification=classification,
+        heuristics=heuristics,
+    )
+
+    if not purchase_data:
+        email_record.parsed_status = "failed"
+        await db.commit()
+        return {"status": "parse_failed"}
+
+    # Dedup purchase by order_id + domain: ON CONFLICT DO NOTHING inserts nothing
+    inserted = await insert_purchases(db, [purchase_data])
+    if not inserted:
+        email_record.parsed_status = "skipped"
+        await db.commit()
+        return {"status": "duplicate_purchase"}
+
+    purchase = inserted[0]
+    email_record.parsed_status = "success"
+    await schedule_alerts(db, [purchase])
+    started = time.perf_counter()
+    await db.commit()
+    STAGE_DB_COMMIT.observe(time.perf_counter() - started)
+    event_bus.publish(purchase.user_id, "purchase.created", {
+        "id": purchase.id,
+        "merchant_name": purchase.merchant_name,
+        "total_amount": purchase.total_amount,
+        "currency": purchase.currency,
+        "return_deadline": purchase.return_deadline,
+        "status": purchase.status,
+    })
+
+    return {
+        "status": "ok",
+        "purchase_id": purchase.id,
+        "merchant": purchase.merchant_name,
+        "deadline": str(purchase.return_deadline),
+        "confidence": purchase.confidence,
+    }
+
+
+async def claim_email(session) -> Optional[int]:
+    """
+    Claim the oldest pending email (or one stuck in 'processing' past
+    INGEST_STALE_SECONDS) and mark it 'processing'. Same claim pattern as the
+    alert scheduler: a guarded UPDATE ... RETURNING, with SKIP LOCKED on Postgres.
+    """
+    now = datetime.utcnow()
+    claimable = or_(
+        Email.parsed_status == "pending",
+        and_(
+            Email.parsed_status == "processing",
+            Email.processing_started_at < now - timedelta(seconds=INGEST_STALE_SECONDS),
+        ),
+    )
+    candidate = select(Email.id).where(claimable).order_by(Email.id).limit(1)
+    if session.bind.dialect.name == "postgresql":
+        candidate = candidate.with_for_update(skip_locked=True)
+
+    result = await session.execute(
+        update(Email)
+        .where(Email.id.in_(candidate.scalar_subquery()), claimable)
+        .values(parsed_status="processing", processing_started_at=now, attempts=Email.attempts + 1)
+        .returning(Email.id)
+        .execution_options(synchronize_session=False)
+    )
+    email_id = result.scalar_one_or_none()
+    await session.commit()
+    return email_id
+
+
+async def process_claimed_email(email_id: int) -> Optional[dict]:
+    async with SessionLocal() as session:
+        email_record = await session.get(Email, email_id)
+        if email_record is None:
+            return None
+        # Read before the try: rollback expires email_record, and lazy-loading an
+        # expired attribute outside a greenlet raises MissingGreenlet
+        attempts = email_record.attempts
+        try:
+            return await ingest_email(session, email_record)
+        except Exception as e:
+            print(f"[Ingest] Error processing email {email_id}: {e}")
+            await session.rollback()
+            retry = attempts < INGEST_MAX_ATTEMPTS
+            await session.execute(
+                update(Email)
+                .where(Email.id == email_id)
+                .values(parsed_status="pending" if retry else "failed", processing_started_at=None)
+            )
+            await session.commit()
+            return None
+
+
+class IngestWorkers:
+    """A pool of asyncio tasks draining the pending-email queue."""
+
+    def __init__(self, concurrency: int = INGEST_CONCURRENCY):
+        self.concurrency = concurrency
+        self._tasks: list[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self._depth = 0
+        self._depth_checked_at = 0.0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """Nudge idle workers after a webhook stores a new email."""
+        self._wake.set()
+
+    async def overloaded(self, db) -> bool:
+        """
+        Backpressure check for the webhook: True when the pending backlog is over
+        INGEST_MAX_PENDING. The count is refreshed at most once a second.
+        """
+        if time.monotonic() - self._depth_checked_at > 1.0:
+            result = await db.execute(select(func.count()).select_from(Email).where(Email.parsed_status == "pending"))
+            self._depth = result.scalar_one()
+            self._depth_checked_at = time.monotonic()
+        return self._depth >= INGEST_MAX_PENDING
+
+    async def _run(self):
+        while True:
+            try:
+                async with SessionLocal() as session:
+                    email_id = await claim_email(session)
+            except Exception as e:
+                print(f"[Ingest] Claim error: {e}")
+                email_id = None
+
+            if email_id is not None:
+                try:
+                    await process_claimed_email(email_id)
+                except Exception as e:
+                    # Never let one email kill the worker; the row goes back to
+                    # the queue once its claim is stale
+                    print(f"[Ingest] Worker error on email {email_id}: {e}")
+                continue
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), INGEST_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+
+ingest_workers = IngestWorkers()
+
+
+async def main():
+    await init_db()
+    await policy_index.refresh(force=True)
+    ingest_workers.start()
+    print(f"[Ingest] {ingest_workers.concurrency} workers running, parsing on {parse_executor.mode} executor")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await merchant_templates.flush()
+        parse_executor.shutdown()
+        await claude_coalescer.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
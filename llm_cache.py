@@ -0,0 +1,164 @@
+"""
+Persistent cache for Claude extraction results, so Mailgun redeliveries and
+byte-identical templated receipts don't pay for a second API call.
+
+Entries live in the llm_cache table, keyed by sha256 of a namespace (model +
+prompt version, supplied by the caller) and the whitespace-normalized excerpt.
+The table is capped at LLM_CACHE_MAX_ENTRIES; the least recently used rows are
+evicted. Neither path touches the whole table per call: a hit refreshes
+last_used_at only once it is LLM_CACHE_TOUCH_SECONDS old, and stores count the
+table and trim it once per LLM_CACHE_TRIM_EVERY inserted rows, so the cap can
+be overshot by that many rows per process between trims.
+
+With LLM_CACHE_NEAR_DUPLICATES=1 each result is also stored under a second key
+computed with order IDs, amounts and dates masked, so the next order from the
+same merchant template hits. A near-duplicate hit carries only the fields a
+template shares (merchant name, currency, return window); the per-order fields
+come back null and stay with the heuristics.
+"""
+
+import hashlib
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects import postgresql, sqlite
+from database import SessionLocal, LLMCacheEntry, engine
+from metrics import Counter
+
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "50000"))
+LLM_CACHE_NEAR_DUPLICATES = os.environ.get("LLM_CACHE_NEAR_DUPLICATES", "0") == "1"
+# LRU recency granularity; hits on a row touched more recently than this are read-only
+LLM_CACHE_TOUCH_SECONDS = float(os.environ.get("LLM_CACHE_TOUCH_SECONDS", "3600"))
+LLM_CACHE_TRIM_EVERY = int(os.environ.get("LLM_CACHE_TRIM_EVERY", "500"))
+
+# Fields that differ between two orders rendered from the same template
+PER_ORDER_FIELDS = ("order_id", "order_date", "total_amount", "items", "confidence")
+
+_WHITESPACE = re.compile(r"\s+")
+_MASK_NUMBERS = re.compile(r"\S*\d\S*")  # order IDs, amounts, numeric dates
+_MASK_MONTHS = re.compile(
+    r"\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?(?=\s|$)", re.IGNORECASE
+)
+
+
+def normalize_excerpt(excerpt: str) -> str:
+    return _WHITESPACE.sub(" ", excerpt).strip()
+
+
+def mask_excerpt(excerpt: str) -> str:
+    """The excerpt with per-order values replaced, for near-duplicate keys."""
+    return _MASK_MONTHS.sub("<month>", _MASK_NUMBERS.sub("<n>", normalize_excerpt(excerpt)))
+
+
+def cache_key(namespace: str, text: str, kind: str = "exact") -> str:
+    return hashlib.sha256(f"{kind}\0{namespace}\0{text}".encode()).hexdigest()
+
+
+class LLMCache:
+    """Cache lookups and stores for one process, with hit/miss counters."""
+
+    def __init__(
+        self,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        near_duplicates: bool = LLM_CACHE_NEAR_DUPLICATES,
+        touch_seconds: float = LLM_CACHE_TOUCH_SECONDS,
+        trim_every: int = LLM_CACHE_TRIM_EVERY,
+    ):
+        self.max_entries = max_entries
+        self.near_duplicates = near_duplicates
+        self.touch_interval = timedelta(seconds=touch_seconds)
+        self.trim_every = max(1, trim_every)
+        # None until the first store, so a fresh process trims on its first insert
+        self._inserted_since_trim: Optional[int] = None
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _keys(self, namespace: str, excerpt: str) -> tuple[str, Optional[str]]:
+        exact = cache_key(namespace, normalize_excerpt(excerpt))
+        near = cache_key(namespace, mask_excerpt(excerpt), "near") if self.near_duplicates else None
+        return exact, near
+
+    async def get(self, namespace: str, excerpt: str) -> Optional[dict]:
+        exact, near = self._keys(namespace, excerpt)
+        keys = [exact] if near is None else [exact, near]
+        try:
+            async with SessionLocal() as session:
+                result = await session.execute(
+                    select(LLMCacheEntry.key, LLMCacheEntry.result, LLMCacheEntry.last_used_at)
+                    .where(LLMCacheEntry.key.in_(keys))
+                )
+                found = {row.key: row for row in result}
+                key = exact if exact in found else near if near in found else None
+                if key is None:
+                    self.misses += 1
+                    return None
+                now = datetime.utcnow()
+                if found[key].last_used_at is None or now - found[key].last_used_at >= self.touch_interval:
+                    await session.execute(
+                        update(LLMCacheEntry).where(LLMCacheEntry.key == key).values(last_used_at=now)
+                    )
+                    await session.commit()
+        except Exception as e:
+            print(f"[LLMCache] Lookup error: {e}")
+            self.misses += 1
+            return None
+
+        if key == exact:
+            self.hits += 1
+        else:
+            self.near_hits += 1
+        return found[key].result
+
+    async def put(self, namespace: str, excerpt: str, result: dict):
+        exact, near = self._keys(namespace, excerpt)
+        now = datetime.utcnow()
+        rows = [{"key": exact, "result": result, "created_at": now, "last_used_at": now}]
+        if near is not None:
+            shared = {k: (None if k in PER_ORDER_FIELDS else v) for k, v in result.items()}
+            rows.append({"key": near, "result": shared, "created_at": now, "last_used_at": now})
+
+        insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+        try:
+            async with SessionLocal() as session:
+                # Two workers can miss on the same email at once; first write wins
+                inserted = await session.execute(
+                    insert(LLMCacheEntry).values(rows).on_conflict_do_nothing(index_elements=["key"])
+                )
+                await session.commit()
+        except Exception as e:
+            print(f"[LLMCache] Store error: {e}")
+            return
+
+        if self._inserted_since_trim is None:
+            self._inserted_since_trim = self.trim_every
+        elif inserted.rowcount and inserted.rowcount > 0:
+            self._inserted_since_trim += inserted.rowcount
+        if self._inserted_since_trim >= self.trim_every:
+            self._inserted_since_trim = 0
+            await self.trim()
+
+    async def trim(self):
+        """Evict the least recently used rows beyond max_entries."""
+        try:
+            async with SessionLocal() as session:
+                count = (await session.execute(select(func.count()).select_from(LLMCacheEntry))).scalar_one()
+                if count > self.max_entries:
+                    oldest = (
+                        select(LLMCacheEntry.key)
+                        .order_by(LLMCacheEntry.last_used_at)
+                        .limit(count - self.max_entries)
+                    )
+                    await session.execute(delete(LLMCacheEntry).where(LLMCacheEntry.key.in_(oldest.scalar_subquery())))
+                    await session.commit()
+        except Exception as e:
+            print(f"[LLMCache] Trim error: {e}")
+
+
+llm_cache = LLMCache()
+Counter(
+    "llm_cache_lookups_total", "Claude extraction cache lookups, by result.", ["result"],
+    callback=lambda: {("hit",): llm_cache.hits, ("near_hit",): llm_cache.near_hits, ("miss",): llm_cache.misses},
+)
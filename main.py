@@ -1,14 +1,27 @@
 from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
 from database import init_db
-from routers import purchases, emails, alerts, users
+from ingest import ingest_workers
+from parse_executor import parse_executor
+from parser import claude_coalescer
+from merchant_policies import policy_index
+from merchant_templates import merchant_templates
+import metrics
+from routers import purchases, emails, alerts, users, merchants, events
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    await policy_index.refresh(force=True)
+    ingest_workers.start()
     yield
+    await ingest_workers.stop()
+    await merchant_templates.flush()
+    parse_executor.shutdown()
+    await claude_coalescer.close()
 
 app = FastAPI(title="ReturnRadar API", version="1.0.0", lifespan=lifespan)
 
@@ -24,10 +37,17 @@ app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(purchases.router, prefix="/api/purchases", tags=["purchases"])
 app.include_router(emails.router, prefix="/api/emails", tags=["emails"])
 app.include_router(alerts.router, prefix="/api/alerts", tags=["alerts"])
+app.include_router(merchants.router, prefix="/api/merchants", tags=["merchants"])
+app.include_router(events.router, prefix="/api/events", tags=["events"])
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text format: pipeline stages, Claude usage, caches, the alert job and the DB pool (see metrics.py)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,93 @@
+"""
+In-process index of the merchant_policies table, so resolve_policy costs no
+queries per receipt.
+
+The whole table is loaded at startup (it is a few hundred rows at most) into a
+dict keyed by merchant_domain. Every POLICY_REFRESH_SECONDS the next lookup
+checks max(last_updated_at) and the row count, and reloads only when they
+changed, so edits made by another process show up within that interval.
+
+Lookups match the sender's domain and then each parent domain, so
+email.nike.com and orders.store.nike.com resolve to nike.com. The last label
+is never tried alone, so a bare TLD can't match.
+"""
+
+import asyncio
+import os
+import time
+from typing import NamedTuple, Optional
+from sqlalchemy import select, func
+from database import SessionLocal, MerchantPolicy
+from metrics import Counter
+
+POLICY_REFRESH_SECONDS = float(os.environ.get("POLICY_REFRESH_SECONDS", "60"))
+
+
+class Policy(NamedTuple):
+    merchant_domain: str
+    merchant_name: str
+    default_return_window_days: int
+
+
+def normalize_domain(domain: str) -> str:
+    return (domain or "").strip().strip(">").rstrip(".").lower()
+
+
+class MerchantPolicyIndex:
+    """merchant_domain -> Policy, reloaded when the table's version changes."""
+
+    def __init__(self, refresh_seconds: float = POLICY_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._policies: dict[str, Policy] = {}
+        self._version = None
+        self._checked_at = float("-inf")
+        self._lock = asyncio.Lock()
+        self.reloads = 0
+
+    def match(self, domain: str) -> Optional[Policy]:
+        """Exact domain first, then each parent domain down to two labels."""
+        domain = normalize_domain(domain)
+        while domain.count(".") >= 1:
+            policy = self._policies.get(domain)
+            if policy is not None:
+                return policy
+            domain = domain.split(".", 1)[1]
+        return None
+
+    async def lookup(self, domain: str) -> Optional[Policy]:
+        if time.monotonic() - self._checked_at > self.refresh_seconds:
+            await self.refresh()
+        return self.match(domain)
+
+    async def refresh(self, force: bool = False):
+        async with self._lock:
+            if not force and time.monotonic() - self._checked_at <= self.refresh_seconds:
+                return
+            try:
+                async with SessionLocal() as session:
+                    result = await session.execute(
+                        select(func.max(MerchantPolicy.last_updated_at), func.count()).select_from(MerchantPolicy)
+                    )
+                    version = tuple(result.one())
+                    if force or version != self._version:
+                        result = await session.execute(
+                            select(
+                                MerchantPolicy.merchant_domain,
+                                MerchantPolicy.merchant_name,
+                                MerchantPolicy.default_return_window_days,
+                            )
+                        )
+                        self._policies = {
+                            normalize_domain(domain): Policy(normalize_domain(domain), name, days)
+                            for domain, name, days in result.all()
+                        }
+                        self._version = version
+                        self.reloads += 1
+            except Exception as e:
+                # Keep serving the last loaded table
+                print(f"[Policies] Load error: {e}")
+            self._checked_at = time.monotonic()
+
+
+policy_index = MerchantPolicyIndex()
+Counter("policy_index_reloads_total", "Times the merchant policy index was reloaded.", callback=lambda: policy_index.reloads)
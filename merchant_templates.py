@@ -0,0 +1,304 @@
+"""
+Learned per-merchant extraction templates, so receipts from a merchant we have
+seen a few times don't fall back to Claude when the generic patterns miss.
+
+After a receipt parses successfully, the text right before the confirmed order
+date and total (e.g. "order placed", "grand total") is recorded as an anchor
+for that merchant_domain in the merchant_templates table, next to
+merchant_policies. An anchor becomes active once it has preceded the confirmed
+value in TEMPLATE_MIN_SAMPLES receipts and in at least TEMPLATE_MIN_AGREEMENT
+of the receipts learned from. parser.extract_heuristics tries active anchors
+before the generic DATE_PATTERNS/TOTAL_PATTERNS.
+
+Active templates are held in memory and reloaded every TEMPLATE_REFRESH_SECONDS.
+Each row also counts receipts parsed and how many needed Claude, which is the
+per-merchant LLM-fallback rate served by GET /api/merchants/fallback-rates.
+Those counts and the learned anchors are buffered and written in batches (see
+MerchantTemplates.record), so they trail the parser by up to
+TEMPLATE_FLUSH_SECONDS.
+"""
+
+import asyncio
+import os
+import time
+from datetime import date, datetime
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from database import SessionLocal, MerchantTemplate, engine
+
+TEMPLATE_MIN_SAMPLES = int(os.environ.get("TEMPLATE_MIN_SAMPLES", "3"))
+TEMPLATE_MIN_AGREEMENT = float(os.environ.get("TEMPLATE_MIN_AGREEMENT", "0.8"))
+TEMPLATE_REFRESH_SECONDS = float(os.environ.get("TEMPLATE_REFRESH_SECONDS", "60"))
+# Buffered receipt counts are written at least this often, or once this many merchants are pending
+TEMPLATE_FLUSH_SECONDS = float(os.environ.get("TEMPLATE_FLUSH_SECONDS", "5"))
+TEMPLATE_FLUSH_DOMAINS = int(os.environ.get("TEMPLATE_FLUSH_DOMAINS", "500"))
+TEMPLATE_MAX_ANCHORS = 8  # per field, the most frequent are kept
+ANCHOR_MAX_WORDS = 3
+ANCHOR_MAX_CHARS = 40
+
+TEMPLATE_FIELDS = ("order_date", "total_amount")
+
+# Skipped between an anchor and its value ("Order Total: $45.00")
+_SEPARATORS = " \t\r\n:$€£¥#-"
+
+
+def anchor_before(text: str, pos: int) -> Optional[str]:
+    """
+    The words right before text[pos] (up to ANCHOR_MAX_WORDS, stopping at a
+    word with a digit or at the end of a sentence), lowercased and exactly as
+    spaced in the text. A currency code right before the value is skipped.
+    None when they hold no letters.
+    """
+    end = pos
+    while end and text[end - 1] in _SEPARATORS:
+        end -= 1
+    if end >= 3 and text[end - 3:end].isupper() and text[end - 3:end].isalpha() and (end == 3 or text[end - 4].isspace()):
+        end -= 3
+        while end and text[end - 1] in _SEPARATORS:
+            end -= 1
+    start = end
+    for _ in range(ANCHOR_MAX_WORDS):
+        i = start
+        while i and text[i - 1].isspace():
+            i -= 1
+        j = i
+        while j and not text[j - 1].isspace():
+            j -= 1
+        word = text[j:i]
+        if not word or any(c.isdigit() for c in word) or end - j > ANCHOR_MAX_CHARS:
+            break
+        if start != end and word[-1] in ".!?":
+            break
+        start = j
+    anchor = text[start:end].lower()
+    return anchor if any(c.isalpha() for c in anchor) else None
+
+
+def _occurrences(text: str, value: str):
+    """Start offsets of value in text that aren't part of a longer number."""
+    i = text.find(value)
+    while i != -1:
+        before = text[i - 1] if i else " "
+        after = text[i + len(value)] if i + len(value) < len(text) else " "
+        if not (before.isdigit() or before in ",.") and not after.isdigit():
+            yield i
+        i = text.find(value, i + 1)
+
+
+def _date_renderings(d: date) -> set[str]:
+    """Ways a receipt may print d that parser.parse_date_string reads back."""
+    month = d.strftime("%B")
+    return {
+        f"{month} {d.day}, {d.year}", f"{month} {d.day:02d}, {d.year}", f"{month} {d.day} {d.year}",
+        f"{d.month}/{d.day}/{d.year}", f"{d.month:02d}/{d.day:02d}/{d.year}",
+        f"{d.month:02d}-{d.day:02d}-{d.year}", d.isoformat(),
+    }
+
+
+def learn_anchors(body_text: str, order_date: Optional[date], total_amount: Optional[float]) -> dict[str, set[str]]:
+    """Anchors preceding the confirmed values in one receipt, per field."""
+    values = {
+        "order_date": _date_renderings(order_date) if order_date else set(),
+        "total_amount": {f"{total_amount:,.2f}", f"{total_amount:.2f}"} if total_amount else set(),
+    }
+    learned = {}
+    for field, renderings in values.items():
+        anchors = {
+            anchor
+            for value in renderings
+            for pos in _occurrences(body_text, value)
+            if (anchor := anchor_before(body_text, pos))
+        }
+        if anchors:
+            learned[field] = anchors
+    return learned
+
+
+def active_rules(rules: dict, samples: int) -> dict[str, list[str]]:
+    """Anchors trusted enough to apply, most frequent first, per field."""
+    threshold = max(TEMPLATE_MIN_SAMPLES, TEMPLATE_MIN_AGREEMENT * samples)
+    active = {}
+    for field in TEMPLATE_FIELDS:
+        counts = rules.get(field) or {}
+        anchors = sorted((a for a, n in counts.items() if n >= threshold), key=lambda a: -counts[a])
+        if anchors:
+            active[field] = anchors
+    return active
+
+
+class MerchantTemplates:
+    """In-memory view of the active templates plus the write path that learns them."""
+
+    def __init__(self, refresh_seconds: float = TEMPLATE_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._rules: dict[str, dict[str, list[str]]] = {}
+        self._loaded_at = float("-inf")
+        self._lock = asyncio.Lock()
+        self._pending: dict[str, _PendingCounts] = {}
+        self._flushed_at = time.monotonic()
+        self._flush_lock = asyncio.Lock()
+
+    async def rules_for(self, merchant_domain: str) -> Optional[dict[str, list[str]]]:
+        """Active anchors for a domain (plain lists, safe to pass to parse workers), or None."""
+        if time.monotonic() - self._loaded_at > self.refresh_seconds:
+            await self.refresh()
+        return self._rules.get(merchant_domain)
+
+    async def refresh(self, force: bool = False):
+        async with self._lock:
+            if not force and time.monotonic() - self._loaded_at <= self.refresh_seconds:
+                return
+            try:
+                async with SessionLocal() as session:
+                    result = await session.execute(
+                        select(MerchantTemplate.merchant_domain, MerchantTemplate.rules, MerchantTemplate.samples)
+                        .where(MerchantTemplate.samples >= TEMPLATE_MIN_SAMPLES)
+                    )
+                    loaded = {domain: active_rules(rules or {}, samples) for domain, rules, samples in result.all()}
+                self._rules = {domain: rules for domain, rules in loaded.items() if rules}
+            except Exception as e:
+                print(f"[Templates] Load error: {e}")
+            # Also after an error, so a broken table isn't queried per email
+            self._loaded_at = time.monotonic()
+
+    async def record(
+        self,
+        merchant_domain: str,
+        body_text: str,
+        order_date: Optional[date],
+        total_amount: Optional[float],
+        used_llm: bool,
+        learn: bool,
+    ):
+        """
+        Count one parsed receipt for the merchant and, when `learn` (the parse
+        is trusted), add the anchors in front of its order date and total.
+
+        Counts are buffered in memory and written by flush(), which runs here
+        once TEMPLATE_FLUSH_SECONDS have passed or TEMPLATE_FLUSH_DOMAINS
+        merchants are pending, so a busy merchant's row is written once per
+        flush instead of once per receipt.
+        """
+        if not merchant_domain:
+            return
+        learned = learn_anchors(body_text, order_date, total_amount) if learn else {}
+        pending = self._pending.get(merchant_domain)
+        if pending is None:
+            pending = self._pending[merchant_domain] = _PendingCounts()
+        pending.emails += 1
+        pending.llm_fallbacks += int(used_llm)
+        if learned:
+            pending.samples += 1
+            for field, anchors in learned.items():
+                counts = pending.anchors.setdefault(field, {})
+                for anchor in anchors:
+                    counts[anchor] = counts.get(anchor, 0) + 1
+        if (
+            len(self._pending) >= TEMPLATE_FLUSH_DOMAINS
+            or time.monotonic() - self._flushed_at >= TEMPLATE_FLUSH_SECONDS
+        ):
+            await self.flush()
+
+    async def flush(self):
+        """
+        Write the buffered counts in one transaction: one multi-row upsert for
+        the counters, then one locked read and write-back of the rows that
+        learned anchors. Call on shutdown so the last counts are kept.
+        """
+        async with self._flush_lock:
+            self._flushed_at = time.monotonic()
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                await self._write(pending)
+            except Exception as e:
+                print(f"[Templates] Store error: {e}")
+                # Fold the batch back in so the next flush retries it
+                for domain, counts in pending.items():
+                    self._pending.setdefault(domain, _PendingCounts()).merge(counts)
+
+    async def _write(self, pending: dict[str, "_PendingCounts"]):
+        now = datetime.utcnow()
+        domains = sorted(pending)  # a fixed lock order across concurrent writers
+        insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+        async with SessionLocal() as session:
+            # Counters are added in SQL so concurrent processes don't lose updates
+            stmt = insert(MerchantTemplate).values([
+                {
+                    "merchant_domain": domain, "rules": {}, "samples": 0, "emails": pending[domain].emails,
+                    "llm_fallbacks": pending[domain].llm_fallbacks, "last_updated_at": now,
+                }
+                for domain in domains
+            ])
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=["merchant_domain"],
+                set_={
+                    "emails": MerchantTemplate.emails + stmt.excluded.emails,
+                    "llm_fallbacks": MerchantTemplate.llm_fallbacks + stmt.excluded.llm_fallbacks,
+                },
+            ))
+
+            learned = [domain for domain in domains if pending[domain].samples]
+            if learned:
+                result = await session.execute(
+                    select(MerchantTemplate)
+                    .where(MerchantTemplate.merchant_domain.in_(learned))
+                    .order_by(MerchantTemplate.merchant_domain)
+                    .with_for_update()
+                )
+                for template in result.scalars():
+                    counts = pending[template.merchant_domain]
+                    rules = {field: dict(anchors) for field, anchors in (template.rules or {}).items()}
+                    for field, anchors in counts.anchors.items():
+                        merged = rules.setdefault(field, {})
+                        for anchor, n in anchors.items():
+                            merged[anchor] = merged.get(anchor, 0) + n
+                        if len(merged) > TEMPLATE_MAX_ANCHORS:
+                            rules[field] = dict(sorted(merged.items(), key=lambda kv: -kv[1])[:TEMPLATE_MAX_ANCHORS])
+                    template.rules = rules
+                    template.samples += counts.samples
+                    template.last_updated_at = now
+            await session.commit()
+
+
+class _PendingCounts:
+    """One merchant's counts since the last flush."""
+    __slots__ = ("emails", "llm_fallbacks", "samples", "anchors")
+
+    def __init__(self):
+        self.emails = 0
+        self.llm_fallbacks = 0
+        self.samples = 0
+        self.anchors: dict[str, dict[str, int]] = {}  # field -> {anchor: receipts}
+
+    def merge(self, other: "_PendingCounts"):
+        self.emails += other.emails
+        self.llm_fallbacks += other.llm_fallbacks
+        self.samples += other.samples
+        for field, anchors in other.anchors.items():
+            counts = self.anchors.setdefault(field, {})
+            for anchor, n in anchors.items():
+                counts[anchor] = counts.get(anchor, 0) + n
+
+
+async def fallback_rates(db, limit: int = 100) -> list[dict]:
+    """Per-merchant LLM-fallback rate, busiest merchants first."""
+    result = await db.execute(
+        select(MerchantTemplate).order_by(MerchantTemplate.emails.desc()).limit(limit)
+    )
+    return [
+        {
+            "merchant_domain": t.merchant_domain,
+            "emails": t.emails,
+            "llm_fallbacks": t.llm_fallbacks,
+            "llm_fallback_rate": round(t.llm_fallbacks / t.emails, 4) if t.emails else None,
+            "samples": t.samples,
+            "active_rules": active_rules(t.rules or {}, t.samples),
+        }
+        for t in result.scalars()
+    ]
+
+
+merchant_templates = MerchantTemplates()
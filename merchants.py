@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from merchant_templates import fallback_rates
+
+router = APIRouter()
+
+@router.get("/fallback-rates")
+async def llm_fallback_rates(limit: int = 100, db: AsyncSession = Depends(get_db)):
+    """Per-merchant share of receipts that needed the Claude fallback, and the anchors learned so far."""
+    return await fallback_rates(db, limit)
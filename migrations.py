@@ -0,0 +1,293 @@
+"""
+Schema migrations — run from database.init_db on startup.
+
+Each migration is (version, description, fn) where fn takes a sync connection.
+Applied versions are recorded in schema_migrations, and every migration is
+written to be safe on a database that already has part of the change (fresh
+databases get the full schema from migration 1, so later column/index steps
+find nothing to do).
+
+To change the schema: update the model in database.py, then append a new
+migration here. Never edit one that has already shipped.
+"""
+
+from datetime import date, datetime
+from sqlalchemy import inspect, text, bindparam, select, func, Table, Column, Integer, String, DateTime, MetaData
+from sqlalchemy.dialects import postgresql, sqlite
+from database import Base, engine
+
+migration_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255)),
+    Column("applied_at", DateTime),
+)
+
+
+def _add_column(conn, table_name: str, column_name: str, default_sql: str = None):
+    """ALTER TABLE ... ADD COLUMN using the model's definition, unless it already exists."""
+    existing = {c["name"] for c in inspect(conn).get_columns(table_name)}
+    if column_name in existing:
+        return
+    column = Base.metadata.tables[table_name].c[column_name]
+    ddl = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column.type.compile(dialect=conn.dialect)}"
+    if default_sql is not None:
+        ddl += f" NOT NULL DEFAULT {default_sql}"
+    conn.execute(text(ddl))
+
+
+def _create_all(conn):
+    Base.metadata.create_all(conn)
+
+
+def _alert_delivery_columns(conn):
+    _add_column(conn, "user_preferences", "alert_digest", "FALSE")
+    _add_column(conn, "user_preferences", "locale", "'en'")
+    _add_column(conn, "alerts", "lease_expires_at")
+    _add_column(conn, "alerts", "claimed_by")
+
+
+# Exactly what migration 3 shipped. The models have moved on since (later
+# migrations widen, replace or drop some of these), so they are spelled out
+# here rather than read from Base.metadata.
+HOT_PATH_INDEXES = [
+    ("ix_purchases_user_deadline", "purchases", "user_id, return_deadline"),  # list_purchases
+    ("ix_purchases_status_deadline", "purchases", "status, return_deadline"),
+    ("ix_purchases_user_order", "purchases", "user_id, order_id, merchant_domain"),  # inbound dedup
+    ("ix_alerts_user_scheduled", "alerts", "user_id, scheduled_for"),  # list_alerts
+    ("ix_alerts_status_scheduled", "alerts", "status, scheduled_for"),  # scheduler claim
+]
+
+
+def _hot_path_indexes(conn):
+    indexes = list(HOT_PATH_INDEXES)
+    # The inbound webhook's LIKE 'local@%' prefix lookup
+    if conn.dialect.name == "postgresql":
+        indexes.append(("ix_users_inbound_prefix", "users", "inbound_address text_pattern_ops"))
+    else:
+        indexes.append(("ix_users_inbound_prefix_nocase", "users", "inbound_address COLLATE NOCASE"))
+    for name, table_name, columns in indexes:
+        # Fresh databases may already have a newer index under the same name from migration 1
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table_name} ({columns})"))
+
+
+def _inbound_local_part(conn):
+    _add_column(conn, "users", "inbound_local_part")
+    users = Base.metadata.tables["users"]
+    rows = conn.execute(
+        users.select().with_only_columns(users.c.id, users.c.inbound_address)
+        .where(users.c.inbound_local_part.is_(None))
+    ).all()
+    if rows:
+        conn.execute(
+            users.update().where(users.c.id == bindparam("user_id")).values(inbound_local_part=bindparam("local_part")),
+            [{"user_id": user_id, "local_part": address.split("@")[0].lower()} for user_id, address in rows],
+        )
+    existing = {ix["name"] for ix in inspect(conn).get_indexes("users")}
+    if "uq_users_inbound_local_part" not in existing and not _has_unique(conn, "users", "inbound_local_part"):
+        conn.execute(text("CREATE UNIQUE INDEX uq_users_inbound_local_part ON users (inbound_local_part)"))
+
+
+def _has_unique(conn, table_name: str, column_name: str) -> bool:
+    inspector = inspect(conn)
+    uniques = inspector.get_unique_constraints(table_name) + [
+        ix for ix in inspector.get_indexes(table_name) if ix.get("unique")
+    ]
+    return any(u["column_names"] == [column_name] for u in uniques)
+
+
+def _ingest_queue(conn):
+    _add_column(conn, "emails", "body_html")
+    _add_column(conn, "emails", "body_text")
+    _add_column(conn, "emails", "processing_started_at")
+    _add_column(conn, "emails", "attempts", "0")
+    for index in Base.metadata.tables["emails"].indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _llm_cache(conn):
+    Base.metadata.tables["llm_cache"].create(conn, checkfirst=True)
+
+
+def _merchant_templates(conn):
+    Base.metadata.tables["merchant_templates"].create(conn, checkfirst=True)
+
+
+def _unique_purchase_order(conn):
+    """
+    Make (user_id, order_id, merchant_domain) unique so inserts can use ON
+    CONFLICT DO NOTHING. Duplicates that slipped past the old SELECT-then-insert
+    dedup (two workers racing) are removed first: the oldest purchase is kept,
+    like the dedup would have done, and the later copies' alerts go with them.
+    """
+    purchases = Base.metadata.tables["purchases"]
+    alerts = Base.metadata.tables["alerts"]
+    emails = Base.metadata.tables["emails"]
+    keep = (
+        select(func.min(purchases.c.id))
+        .where(purchases.c.order_id.is_not(None), purchases.c.merchant_domain.is_not(None))
+        .group_by(purchases.c.user_id, purchases.c.order_id, purchases.c.merchant_domain)
+    )
+    duplicates = conn.execute(
+        select(purchases.c.id, purchases.c.source_email_id).where(
+            purchases.c.order_id.is_not(None),
+            purchases.c.merchant_domain.is_not(None),
+            purchases.c.id.not_in(keep),
+        )
+    ).all()
+    if duplicates:
+        ids = [purchase_id for purchase_id, _ in duplicates]
+        conn.execute(alerts.delete().where(alerts.c.purchase_id.in_(ids)))
+        conn.execute(purchases.delete().where(purchases.c.id.in_(ids)))
+        conn.execute(
+            emails.update()
+            .where(emails.c.id.in_([email_id for _, email_id in duplicates if email_id]))
+            .values(parsed_status="skipped")
+        )
+    existing = {ix["name"] for ix in inspect(conn).get_indexes("purchases")}
+    if "ix_purchases_user_order" in existing:
+        conn.execute(text("DROP INDEX ix_purchases_user_order"))
+    for index in purchases.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _keyset_indexes(conn):
+    """Listing indexes gain a trailing id, so keyset pages are pure index range scans."""
+    for table_name, index_name in (("purchases", "ix_purchases_user_deadline"), ("alerts", "ix_alerts_user_scheduled")):
+        index = next(ix for ix in Base.metadata.tables[table_name].indexes if ix.name == index_name)
+        existing = {ix["name"]: ix["column_names"] for ix in inspect(conn).get_indexes(table_name)}
+        if existing.get(index_name) == [c.name for c in index.columns]:
+            continue
+        if index_name in existing:
+            conn.execute(text(f"DROP INDEX {index_name}"))
+        index.create(conn)
+
+
+def _purchase_stats(conn):
+    """Aggregate tables behind the purchase summary, filled from existing purchases."""
+    purchases = Base.metadata.tables["purchases"]
+    active = purchases.c.status == "active"
+    amount = func.coalesce(func.sum(purchases.c.total_amount), 0.0)
+    for table_name in ("purchase_stats", "purchase_deadline_buckets"):
+        Base.metadata.tables[table_name].create(conn, checkfirst=True)
+        conn.execute(Base.metadata.tables[table_name].delete())
+    conn.execute(Base.metadata.tables["purchase_stats"].insert().from_select(
+        ["user_id", "active_count", "active_amount"],
+        select(purchases.c.user_id, func.count(), amount).where(active).group_by(purchases.c.user_id),
+    ))
+    conn.execute(Base.metadata.tables["purchase_deadline_buckets"].insert().from_select(
+        ["user_id", "day", "count", "amount"],
+        select(purchases.c.user_id, purchases.c.return_deadline, func.count(), amount)
+        .where(active, purchases.c.return_deadline.is_not(None))
+        .group_by(purchases.c.user_id, purchases.c.return_deadline),
+    ))
+
+
+def _user_versions(conn):
+    Base.metadata.tables["user_versions"].create(conn, checkfirst=True)
+
+
+def _alert_schedule(conn):
+    """
+    Pending alerts for purchases stored before alerts were scheduled at write
+    time; without them an upgraded database would stop alerting. Alerts already
+    recorded (sent under the old run-time scheduling) are kept by the
+    (purchase_id, alert_type) conflict target.
+    """
+    from scheduler import DEFAULT_ALERT_OFFSETS, ALERT_WRITE_BATCH, alert_schedule
+
+    purchases = Base.metadata.tables["purchases"]
+    preferences = Base.metadata.tables["user_preferences"]
+    alerts = Base.metadata.tables["alerts"]
+    insert = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+    today = date.today()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(purchases, preferences.c.alert_offsets_days, preferences.c.min_purchase_amount)
+            .outerjoin(preferences, preferences.c.user_id == purchases.c.user_id)
+            .where(purchases.c.status == "active", purchases.c.return_deadline.is_not(None), purchases.c.id > last_id)
+            .order_by(purchases.c.id)
+            .limit(ALERT_WRITE_BATCH)
+        ).all()
+        if not rows:
+            break
+        values = [
+            {
+                "purchase_id": row.id,
+                "user_id": row.user_id,
+                "alert_type": alert_type,
+                "scheduled_for": scheduled_for,
+                "channel": "email",
+                "status": "pending",
+            }
+            for row in rows
+            for alert_type, scheduled_for in alert_schedule(
+                row,
+                DEFAULT_ALERT_OFFSETS if row.alert_offsets_days is None else row.alert_offsets_days,
+                row.min_purchase_amount,
+            )
+            if scheduled_for >= today
+        ]
+        if values:
+            conn.execute(insert(alerts).values(values).on_conflict_do_nothing(index_elements=["purchase_id", "alert_type"]))
+        last_id = rows[-1].id
+
+
+def _drop_inbound_prefix_indexes(conn):
+    """Recipients are resolved by inbound_local_part equality (migration 4), so nothing reads these."""
+    for name in ("ix_users_inbound_prefix", "ix_users_inbound_prefix_nocase"):
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+MIGRATIONS = [
+    (1, "initial schema", _create_all),
+    (2, "alert digest/locale preferences and alert leases", _alert_delivery_columns),
+    (3, "indexes for purchase listing, inbound dedup, alert listing and scheduling", _hot_path_indexes),
+    (4, "users.inbound_local_part with unique index for recipient lookup", _inbound_local_part),
+    (5, "emails raw body and claim columns for the ingest queue", _ingest_queue),
+    (6, "llm_cache table for Claude extraction results", _llm_cache),
+    (7, "merchant_templates table for learned extraction anchors", _merchant_templates),
+    (8, "unique (user_id, order_id, merchant_domain) on purchases for ON CONFLICT dedup", _unique_purchase_order),
+    (9, "trailing id on purchase/alert listing indexes for keyset pagination", _keyset_indexes),
+    (10, "purchase_stats and purchase_deadline_buckets aggregates for the purchase summary", _purchase_stats),
+    (11, "user_versions change counter for listing ETags", _user_versions),
+    (12, "pending alerts for purchases stored before write-time scheduling", _alert_schedule),
+    (13, "drop the inbound_address prefix indexes left from the LIKE recipient lookup", _drop_inbound_prefix_indexes),
+]
+
+
+def _lock(conn):
+    """Serialize concurrent migrators (e.g. sharded scheduler workers starting together)."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(7347213)"))
+    else:
+        # Any write takes SQLite's database-wide write lock until commit
+        conn.execute(schema_migrations.delete().where(schema_migrations.c.version < 0))
+
+
+def _migrate(conn) -> list[int]:
+    migration_metadata.create_all(conn)
+    _lock(conn)
+    applied = set(conn.execute(schema_migrations.select().with_only_columns(schema_migrations.c.version)).scalars())
+    ran = []
+    for version, description, fn in MIGRATIONS:
+        if version in applied:
+            continue
+        fn(conn)
+        conn.execute(schema_migrations.insert().values(
+            version=version, description=description, applied_at=datetime.utcnow(),
+        ))
+        ran.append(version)
+    return ran
+
+
+async def run_migrations() -> list[int]:
+    """Apply pending migrations in one transaction. Returns the versions applied."""
+    async with engine.begin() as conn:
+        ran = await conn.run_sync(_migrate)
+    if ran:
+        print(f"[DB] Applied migrations: {ran}")
+    return ran
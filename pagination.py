@@ -0,0 +1,65 @@
+"""
+Keyset (cursor) pagination and conditional GET helpers for the listing endpoints.
+
+A cursor is the sort key of the last row on the previous page, base64url
+encoded so clients treat it as opaque. The next page starts strictly after
+it, so each page is an index range scan however deep the client pages,
+and rows inserted meanwhile don't shift pages the way OFFSET does.
+
+Listings also carry an ETag and Last-Modified built from the user's row in
+user_versions, which every write to their purchases or alerts bumps
+(database.bump_user_versions). A poll that sends the ETag back in
+If-None-Match costs one primary-key lookup and gets a 304 when nothing
+changed. The version is read before the listing query, so a write landing
+in between can only make the ETag older than the body (the next poll
+refetches), never newer.
+"""
+
+import base64
+from datetime import date, timezone
+from email.utils import format_datetime
+from typing import Optional
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import select
+from database import UserVersion
+
+PAGE_DEFAULT_LIMIT = 100
+PAGE_MAX_LIMIT = 500
+
+
+def encode_cursor(day: Optional[date], row_id: int) -> str:
+    raw = f"{day.isoformat() if day else ''}:{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[Optional[date], int]:
+    """(date or None, id) from encode_cursor; 400 if it was tampered with."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        day, row_id = raw.split(":")
+        return (date.fromisoformat(day) if day else None), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
+async def not_modified(request: Request, response: Response, db, user_id: int) -> Optional[Response]:
+    """
+    A 304 response when the request's If-None-Match matches the user's
+    current version, else None after setting ETag/Last-Modified on `response`.
+    """
+    result = await db.execute(
+        select(UserVersion.version, UserVersion.changed_at).where(UserVersion.user_id == user_id)
+    )
+    version, changed_at = result.one_or_none() or (0, None)
+    headers = {"ETag": f'W/"{user_id}-{version}"', "Cache-Control": "no-cache"}
+    if changed_at:
+        headers["Last-Modified"] = format_datetime(changed_at.replace(tzinfo=timezone.utc), usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or headers["ETag"].removeprefix("W/") in tags:
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
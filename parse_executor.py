@@ -0,0 +1,60 @@
+"""
+Executor for the CPU-bound parsing stages (HTML to text, classification,
+heuristic extraction), so a large receipt doesn't stall the event loop.
+
+PARSE_EXECUTOR picks the backend:
+  inline   run on the event loop (the old behaviour; handy for debugging)
+  thread   a thread pool; keeps the loop responsive, but the GIL caps it at one core
+  process  a process pool (default); scales with PARSE_WORKERS cores
+
+Work is sent as plain strings and comes back as plain tuples/dicts, so the
+per-call pickling cost stays small.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+PARSE_EXECUTOR = os.environ.get("PARSE_EXECUTOR", "process")
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 1)))
+
+
+class ParseExecutor:
+    """Runs a picklable top-level function on the configured backend."""
+
+    def __init__(self, mode: str = PARSE_EXECUTOR, workers: int = PARSE_WORKERS):
+        if mode not in ("inline", "thread", "process"):
+            raise ValueError(f"PARSE_EXECUTOR must be inline, thread or process, not {mode!r}")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.mode == "thread":
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="parse")
+            else:
+                # spawn, not fork: the parent has event-loop and DB driver threads running
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def run(self, fn, *args):
+        if self.mode == "inline":
+            return fn(*args)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_pool(), fn, *args)
+        except BrokenProcessPool:
+            # A worker died (OOM, signal). Start a fresh pool next call; the
+            # ingest queue retries this email.
+            self._pool = None
+            raise
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+parse_executor = ParseExecutor()
@@ -9,13 +9,36 @@ Receipt parsing pipeline:
 import re
 import os
 import json
+import time
+import asyncio
+import hashlib
 import httpx
 from datetime import date, timedelta
 from email import message_from_string
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
 from typing import Optional
-from database import SessionLocal, MerchantPolicy
-from sqlalchemy import select
+from parse_executor import parse_executor
+from llm_cache import llm_cache
+from merchant_templates import merchant_templates
+from merchant_policies import policy_index
+from metrics import Counter, Gauge, Histogram
+
+# Instrumentation, served at /metrics. Children are looked up once, not per email.
+PIPELINE_STAGE_SECONDS = Histogram("pipeline_stage_seconds", "Time spent in each receipt pipeline stage.", ["stage"])
+STAGE_CLASSIFY = PIPELINE_STAGE_SECONDS.labels("classify")
+STAGE_HTML_TO_TEXT = PIPELINE_STAGE_SECONDS.labels("html_to_text")
+STAGE_HEURISTICS = PIPELINE_STAGE_SECONDS.labels("heuristics")
+STAGE_EXTRACT_WITH_CLAUDE = PIPELINE_STAGE_SECONDS.labels("extract_with_claude")
+STAGE_RESOLVE_POLICY = PIPELINE_STAGE_SECONDS.labels("resolve_policy")
+RECEIPTS_PARSED = Counter("receipts_parsed_total", "Receipts that went through extraction.")
+LLM_FALLBACKS = Counter("llm_fallbacks_total", "Receipts whose heuristics fell short and were sent to Claude.")
+Gauge(
+    "llm_fallback_ratio", "Share of parsed receipts that fell back to Claude since start.",
+    callback=lambda: LLM_FALLBACKS.labels().value / max(RECEIPTS_PARSED.labels().value, 1),
+)
+LLM_REQUESTS = Counter("llm_requests_total", "Claude Messages API requests by outcome.", ["outcome"])
+LLM_TOKENS = Counter("llm_tokens_total", "Claude tokens billed, by direction.", ["direction"])
+POLICY_SOURCES = Counter("policy_resolutions_total", "Return windows resolved, by source.", ["source"])
 
 
 # ---------------------------------------------------------------------------
@@ -41,23 +64,38 @@ SHIPPING_SUBJECT_KEYWORDS = [
 ]
 
 
+def _keyword_re(keywords: list[str]) -> re.Pattern:
+    return re.compile("|".join(re.escape(kw) for kw in keywords))
+
+
+# One alternation per keyword list, compiled at import. No two keywords in a
+# list can match at the same position, so stepping one char past each hit
+# enumerates every occurrence even when keywords overlap.
+_SHIPPING_SUBJECT_RE = _keyword_re(SHIPPING_SUBJECT_KEYWORDS)
+_RECEIPT_SUBJECT_RE = _keyword_re(RECEIPT_SUBJECT_KEYWORDS)
+_RECEIPT_BODY_RE = _keyword_re(RECEIPT_BODY_KEYWORDS)
+
+
 def classify_email(subject: str, body_text: str, from_domain: str) -> str:
     """Returns: 'receipt' | 'shipping' | 'other'"""
     subject_lower = subject.lower() if subject else ""
-    body_lower = body_text.lower()[:3000] if body_text else ""
+    # lower() never shortens text, so this equals body_text.lower()[:3000]
+    body_lower = body_text[:3000].lower()[:3000] if body_text else ""
 
-    for kw in SHIPPING_SUBJECT_KEYWORDS:
-        if kw in subject_lower:
-            return "shipping"
+    if _SHIPPING_SUBJECT_RE.search(subject_lower):
+        return "shipping"
 
-    for kw in RECEIPT_SUBJECT_KEYWORDS:
-        if kw in subject_lower:
-            return "receipt"
-
-    body_hits = sum(1 for kw in RECEIPT_BODY_KEYWORDS if kw in body_lower)
-    if body_hits >= 2:
+    if _RECEIPT_SUBJECT_RE.search(subject_lower):
         return "receipt"
 
+    seen = set()
+    m = _RECEIPT_BODY_RE.search(body_lower)
+    while m:
+        seen.add(m.group())
+        if len(seen) >= 2:
+            return "receipt"
+        m = _RECEIPT_BODY_RE.search(body_lower, m.start() + 1)
+
     return "other"
 
 
@@ -90,17 +128,188 @@ RETURN_WINDOW_PATTERNS = [
 CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "¥": "JPY"}
 
 
-def html_to_text(html: str) -> str:
+# Every downstream consumer reads at most the first 6000 chars of body text
+# (classifier 3000, heuristics 6000, Claude 5000, stored excerpt 6000).
+TEXT_LIMIT = 6000
+
+
+class _TextExtractor(HTMLParser):
+    """Collects visible text like BeautifulSoup's get_text(" ", strip=True), minus script/style/head."""
+
+    SKIP_TAGS = {"script", "style", "head"}
+
+    def __init__(self, limit: Optional[int]):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self.size = 0
+        self.limit = limit
+        self.skip_depth = 0
+        self.done = False
+        # A text node can arrive in pieces when it spans a feed() chunk
+        self._pending: list[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        self.flush()
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+
+    def handle_endtag(self, tag):
+        self.flush()
+        if tag in self.SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_comment(self, data):
+        self.flush()
+
+    def handle_data(self, data):
+        if not self.skip_depth and not self.done:
+            self._pending.append(data)
+
+    def flush(self):
+        if not self._pending:
+            return
+        data = "".join(self._pending).strip()
+        self._pending = []
+        if data:
+            self.parts.append(data)
+            self.size += len(data) + 1
+            if self.limit and self.size > self.limit:
+                self.done = True
+
+
+def html_to_text(html: str, limit: Optional[int] = TEXT_LIMIT) -> str:
+    """
+    Streaming HTML-to-text. Feeds the document in chunks and stops once `limit`
+    characters of text have been collected, so the long tail of a newsletter-
+    style receipt is never parsed. Pass limit=None for the whole document.
+    """
     try:
-        soup = BeautifulSoup(html, "html.parser")
-        for tag in soup(["script", "style", "head"]):
-            tag.decompose()
-        return soup.get_text(separator=" ", strip=True)
+        extractor = _TextExtractor(limit)
+        for i in range(0, len(html), 8192):
+            extractor.feed(html[i:i + 8192])
+            if extractor.done:
+                break
+        else:
+            extractor.close()
+        extractor.flush()
+        return " ".join(extractor.parts)
     except Exception:
         return html
 
 
-def extract_heuristics(subject: str, body: str, from_address: str) -> dict:
+# Compiled extraction table: field -> patterns in priority order, each with
+# the lowercase literals it must start with. Patterns only run where one of
+# their anchors occurs, so a field that isn't in the email costs a few
+# substring searches instead of a full regex scan. _DAY_NUMBER marks patterns
+# that start with a number ending just before "day".
+_DAY_NUMBER = ("day",)
+_MONTHS = tuple(m.lower() for m in re.findall(r"[A-Z][a-z]+", DATE_PATTERNS[2]))
+_ORDER_DATE_ANCHORS = ("order", "placed", "date")
+
+_FIELD_PATTERNS = {
+    "order_date": list(zip(
+        [re.compile(p, re.IGNORECASE) for p in DATE_PATTERNS],
+        [_ORDER_DATE_ANCHORS, _ORDER_DATE_ANCHORS, _MONTHS],
+    )),
+    "total_amount": list(zip(
+        [re.compile(p, re.IGNORECASE) for p in TOTAL_PATTERNS],
+        [("order", "total"), ("$",)],
+    )),
+    "order_id": list(zip(
+        [re.compile(p, re.IGNORECASE) for p in ORDER_ID_PATTERNS],
+        [("order",), ("#",)],
+    )),
+    "return_window_days": list(zip(
+        [re.compile(p, re.IGNORECASE) for p in RETURN_WINDOW_PATTERNS],
+        [_DAY_NUMBER, ("return",), _DAY_NUMBER],
+    )),
+}
+
+
+# The value right after a learned merchant anchor (merchant_templates.py),
+# past separators and an optional currency code or sign.
+_TEMPLATE_VALUES = {
+    "order_date": re.compile(r"[:\s#-]*([A-Z][a-z]+ \d{1,2},? \d{4}|\d{1,2}[/-]\d{1,2}[/-]\d{4}|\d{4}-\d{2}-\d{2})"),
+    "total_amount": re.compile(r"[:\s#-]*(?:[A-Z]{3}\s*)?[$€£¥]?\s*([\d,]+\.\d{2})(?!\d)"),
+}
+
+
+class _Anchors:
+    """Positions of anchor literals in one lowercased text, found on demand."""
+
+    def __init__(self, text: str):
+        self.text = text
+        lowered = text.lower()
+        # Anchor positions are only valid when IGNORECASE matching and lower()
+        # agree char-for-char: same length, and none of the two extra case
+        # equivalences re applies to ASCII letters (dotless i, long s).
+        self.lowered = lowered if len(lowered) == len(text) and "ı" not in text and "ſ" not in text else None
+        self._positions: dict[str, list[int]] = {}
+
+    def positions(self, anchor: str) -> list[int]:
+        found = self._positions.get(anchor)
+        if found is None:
+            found = []
+            i = self.lowered.find(anchor)
+            while i != -1:
+                found.append(i)
+                i = self.lowered.find(anchor, i + 1)
+            self._positions[anchor] = found
+        return found
+
+    def first_match(self, pattern: re.Pattern, anchors: tuple[str, ...]) -> Optional[re.Match]:
+        """Same result as pattern.search(text)."""
+        if self.lowered is None:
+            return pattern.search(self.text)
+        if anchors is _DAY_NUMBER:
+            return self._first_day_number_match(pattern)
+        if len(anchors) == 1:
+            sites = self.positions(anchors[0])
+        else:
+            sites = sorted(p for anchor in anchors for p in self.positions(anchor))
+        for pos in sites:
+            m = pattern.match(self.text, pos)
+            if m:
+                return m
+        return None
+
+    def template_match(self, pattern: re.Pattern, anchors: list[str], valid=None) -> Optional[re.Match]:
+        """The first value after a whole-word occurrence of a learned anchor, trying anchors in order."""
+        if self.lowered is None:
+            return None
+        for anchor in anchors:
+            for pos in self.positions(anchor):
+                if pos and self.lowered[pos - 1].isalnum():
+                    continue
+                m = pattern.match(self.text, pos + len(anchor))
+                if m and (valid is None or valid(m.group(1))):
+                    return m
+        return None
+
+    def _first_day_number_match(self, pattern: re.Pattern) -> Optional[re.Match]:
+        # Walk back from each "day" over separators and then digits to where
+        # the number starts; that is the only place a match can begin.
+        text = self.text
+        for pos in self.positions("day"):
+            i = pos
+            while i and (text[i - 1].isspace() or text[i - 1] == "-"):
+                i -= 1
+            start = i
+            while start and text[start - 1].isdecimal():
+                start -= 1
+            if start < i:
+                m = pattern.match(text, start)
+                if m:
+                    return m
+        return None
+
+
+def extract_heuristics(subject: str, body: str, from_address: str, template: Optional[dict] = None) -> dict:
+    """
+    Regex pass over the first 6000 chars. `template` holds the merchant's
+    learned anchors (merchant_templates.rules_for), tried before the generic
+    patterns.
+    """
     result = {
         "merchant_name": None,
         "merchant_domain": None,
@@ -119,38 +328,58 @@ def extract_heuristics(subject: str, body: str, from_address: str) -> dict:
         result["merchant_domain"] = domain
         result["merchant_name"] = domain.split(".")[0].capitalize()
 
-    text = body[:6000]
+    anchors = _Anchors(body[:6000])
 
-    # Order date
-    for pat in DATE_PATTERNS:
-        m = re.search(pat, text, re.IGNORECASE)
+    # Learned merchant anchors. A template date counts toward confidence since
+    # the anchor has already been confirmed on this merchant's receipts.
+    if template:
+        m = anchors.template_match(
+            _TEMPLATE_VALUES["order_date"], template.get("order_date", []),
+            lambda s: parse_date_string(s) is not None,
+        )
         if m:
-            result["order_date"] = m.group(1).strip()
-            break
-
-    # Total
-    for pat in TOTAL_PATTERNS:
-        m = re.search(pat, text, re.IGNORECASE)
+            result["order_date"] = m.group(1)
+            result["confidence"] = min(result["confidence"] + 0.1, 1.0)
+        m = anchors.template_match(
+            _TEMPLATE_VALUES["total_amount"], template.get("total_amount", []),
+            lambda s: s.replace(",", "").replace(".", "", 1).isdigit(),
+        )
         if m:
-            amt = m.group(1).replace(",", "")
-            try:
-                result["total_amount"] = float(amt)
-                result["confidence"] = min(result["confidence"] + 0.15, 1.0)
+            result["total_amount"] = float(m.group(1).replace(",", ""))
+            result["confidence"] = min(result["confidence"] + 0.15, 1.0)
+
+    # Order date
+    if not result["order_date"]:
+        for pat, pat_anchors in _FIELD_PATTERNS["order_date"]:
+            m = anchors.first_match(pat, pat_anchors)
+            if m:
+                result["order_date"] = m.group(1).strip()
                 break
-            except ValueError:
-                pass
+
+    # Total
+    if not result["total_amount"]:
+        for pat, pat_anchors in _FIELD_PATTERNS["total_amount"]:
+            m = anchors.first_match(pat, pat_anchors)
+            if m:
+                amt = m.group(1).replace(",", "")
+                try:
+                    result["total_amount"] = float(amt)
+                    result["confidence"] = min(result["confidence"] + 0.15, 1.0)
+                    break
+                except ValueError:
+                    pass
 
     # Order ID
-    for pat in ORDER_ID_PATTERNS:
-        m = re.search(pat, text, re.IGNORECASE)
+    for pat, pat_anchors in _FIELD_PATTERNS["order_id"]:
+        m = anchors.first_match(pat, pat_anchors)
         if m:
             result["order_id"] = m.group(1).strip()
             result["confidence"] = min(result["confidence"] + 0.1, 1.0)
             break
 
     # Return window
-    for pat in RETURN_WINDOW_PATTERNS:
-        m = re.search(pat, text, re.IGNORECASE)
+    for pat, pat_anchors in _FIELD_PATTERNS["return_window_days"]:
+        m = anchors.first_match(pat, pat_anchors)
         if m:
             try:
                 result["return_window_days"] = int(m.group(1))
@@ -168,12 +397,18 @@ def extract_heuristics(subject: str, body: str, from_address: str) -> dict:
 # ---------------------------------------------------------------------------
 
 CLAUDE_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
+CLAUDE_API_URL = os.environ.get("ANTHROPIC_API_URL", "https://api.anthropic.com/v1/messages")
 CLAUDE_MODEL = "claude-sonnet-4-6"
 
-EXTRACT_PROMPT = """You are a receipt parser. Extract purchase information from the email below.
+# Fallback extractions arriving within LLM_BATCH_WINDOW_MS of each other are
+# sent as one multi-email request of up to LLM_BATCH_SIZE emails.
+LLM_BATCH_SIZE = int(os.environ.get("LLM_BATCH_SIZE", "8"))
+LLM_BATCH_WINDOW_MS = int(os.environ.get("LLM_BATCH_WINDOW_MS", "50"))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "4"))
+LLM_REQUESTS_PER_MINUTE = float(os.environ.get("LLM_REQUESTS_PER_MINUTE", "50"))
+LLM_BATCH_POLL_SECONDS = float(os.environ.get("LLM_BATCH_POLL_SECONDS", "60"))
 
-Return ONLY valid JSON matching this exact schema:
-{
+_EXTRACT_SCHEMA = """{
   "merchant_name": string or null,
   "order_date": "YYYY-MM-DD" or null,
   "total_amount": number or null,
@@ -182,50 +417,307 @@ Return ONLY valid JSON matching this exact schema:
   "return_window_days": integer or null (ONLY if explicitly stated in the email — do NOT infer or guess),
   "items": string description of items or null,
   "confidence": float between 0.0 and 1.0
-}
+}"""
 
-Rules:
+_EXTRACT_RULES = """Rules:
 - return_window_days must be null unless the email explicitly mentions a return period in days
 - Do not invent or infer return_window_days from typical policies
-- confidence reflects how certain you are about the extracted fields (0.5 = uncertain, 0.9 = high confidence)
+- confidence reflects how certain you are about the extracted fields (0.5 = uncertain, 0.9 = high confidence)"""
+
+EXTRACT_PROMPT = f"""You are a receipt parser. Extract purchase information from the email below.
+
+Return ONLY valid JSON matching this exact schema:
+{_EXTRACT_SCHEMA}
+
+{_EXTRACT_RULES}
 - Return only the JSON object, no other text
 
 Email:
 """
 
+EXTRACT_BATCH_PROMPT = f"""You are a receipt parser. Extract purchase information from each of the emails below independently. Each email starts with a line "=== EMAIL n ===".
 
-async def extract_with_claude(body_excerpt: str) -> Optional[dict]:
-    if not CLAUDE_API_KEY:
+Return ONLY a valid JSON array with exactly one object per email, each matching this exact schema plus an "email" field:
+{_EXTRACT_SCHEMA}
+
+{_EXTRACT_RULES}
+- "email" is the number n from that email's "=== EMAIL n ===" line; never combine emails into one object
+- Return only the JSON array, no other text
+
+"""
+
+# Cached extractions are only reused for the same model and prompt text
+LLM_CACHE_NAMESPACE = f"{CLAUDE_MODEL}:{hashlib.sha256((EXTRACT_PROMPT + EXTRACT_BATCH_PROMPT).encode()).hexdigest()[:16]}"
+
+
+def _claude_params(prompt: str, max_tokens: int = 500) -> dict:
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": max_tokens,
+        "messages": [{"role": "user", "content": prompt}],
+    }
+
+
+def _count_usage(message: dict):
+    usage = message.get("usage") or {}
+    LLM_TOKENS.labels("input").inc(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels("output").inc(usage.get("output_tokens", 0))
+
+
+def _parse_claude_json(message: dict):
+    content = message["content"][0]["text"].strip()
+    # Strip markdown fences if present
+    content = re.sub(r"^```(?:json)?\n?", "", content)
+    content = re.sub(r"\n?```$", "", content)
+    return json.loads(content)
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _match_batch_reply(reply, count: int) -> Optional[list[dict]]:
+    """
+    A batched reply's objects in email order, using the "email" number each one
+    echoes; None unless every email 1..count is answered by exactly one object.
+    Results go to different users' purchases and into llm_cache under each
+    excerpt's hash, so array position alone is never trusted.
+    """
+    if not isinstance(reply, list) or len(reply) != count:
         return None
-    try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            resp = await client.post(
-                "https://api.anthropic.com/v1/messages",
+    by_email: dict[int, dict] = {}
+    for item in reply:
+        if not isinstance(item, dict):
+            return None
+        n = item.get("email")
+        if not isinstance(n, int) or isinstance(n, bool) or not 1 <= n <= count or n in by_email:
+            return None
+        by_email[n] = {k: v for k, v in item.items() if k != "email"}
+    return [by_email[n] for n in range(1, count + 1)]
+
+
+class ClaudeCoalescer:
+    """
+    Queues extraction jobs and sends them as multi-email requests over a
+    pooled client, fanning the results back out. A batch is formed only once
+    there is capacity to send it (LLM_MAX_CONCURRENCY requests in flight,
+    LLM_REQUESTS_PER_MINUTE via a token bucket), waiting up to
+    LLM_BATCH_WINDOW_MS for a quiet trickle to fill it, so batches grow to
+    LLM_BATCH_SIZE exactly when we are rate-limited. Each object in a batched
+    reply must echo its email's number; if the reply doesn't account for every
+    email exactly once, each email is retried on its own.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = LLM_BATCH_SIZE,
+        window_ms: int = LLM_BATCH_WINDOW_MS,
+        concurrency: int = LLM_MAX_CONCURRENCY,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.window = window_ms / 1000
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(requests_per_minute / 60, capacity=max(1, concurrency))
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._work = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._tasks: set[asyncio.Task] = set()
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        self.jobs = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
                 headers={
                     "x-api-key": CLAUDE_API_KEY,
                     "anthropic-version": "2023-06-01",
                     "content-type": "application/json",
                 },
-                json={
-                    "model": CLAUDE_MODEL,
-                    "max_tokens": 500,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": EXTRACT_PROMPT + body_excerpt[:5000],
-                        }
-                    ],
-                },
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                timeout=60,
             )
+        return self._client
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def extract(self, excerpt: str) -> Optional[dict]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((excerpt, future))
+        self.jobs += 1
+        self._work.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        return await future
+
+    async def _dispatch(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            await self._work.wait()
+            await slots.acquire()
+            await self.bucket.acquire()
+            if len(self._pending) < self.batch_size:
+                await asyncio.sleep(self.window)
+            jobs, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            if not self._pending:
+                self._work.clear()
+            task = asyncio.create_task(self._send(jobs))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def _send(self, jobs: list[tuple[str, asyncio.Future]]):
+        # Identical excerpts in one batch (e.g. a redelivery) go out once
+        excerpts = list(dict.fromkeys(excerpt for excerpt, _ in jobs))
+        try:
+            results = dict(zip(excerpts, await self._extract_batch(excerpts)))
+        except Exception as e:
+            print(f"Claude extraction error: {e}")
+            results = {}
+        for excerpt, future in jobs:
+            if not future.done():
+                future.set_result(results.get(excerpt))
+
+    async def _post(self, params: dict) -> dict:
+        self.requests += 1
+        try:
+            resp = await self.client.post(CLAUDE_API_URL, json=params)
             resp.raise_for_status()
-            content = resp.json()["content"][0]["text"].strip()
-            # Strip markdown fences if present
-            content = re.sub(r"^```(?:json)?\n?", "", content)
-            content = re.sub(r"\n?```$", "", content)
-            return json.loads(content)
-    except Exception as e:
-        print(f"Claude extraction error: {e}")
+        except Exception:
+            LLM_REQUESTS.labels("error").inc()
+            raise
+        LLM_REQUESTS.labels("ok").inc()
+        message = resp.json()
+        _count_usage(message)
+        return message
+
+    async def _extract_one(self, excerpt: str) -> Optional[dict]:
+        try:
+            result = _parse_claude_json(await self._post(_claude_params(EXTRACT_PROMPT + excerpt)))
+            return result if isinstance(result, dict) else None
+        except Exception as e:
+            print(f"Claude extraction error: {e}")
+            return None
+
+    async def _extract_batch(self, excerpts: list[str]) -> list[Optional[dict]]:
+        """Runs inside one concurrency slot; the dispatcher already took a rate token."""
+        if len(excerpts) == 1:
+            return [await self._extract_one(excerpts[0])]
+        prompt = EXTRACT_BATCH_PROMPT + "\n\n".join(
+            f"=== EMAIL {i} ===\n{excerpt}" for i, excerpt in enumerate(excerpts, 1)
+        )
+        try:
+            results = _match_batch_reply(
+                _parse_claude_json(await self._post(_claude_params(prompt, 500 * len(excerpts)))), len(excerpts)
+            )
+            if results is not None:
+                return results
+            print(f"Claude batch reply didn't map one object to each of {len(excerpts)} emails; retrying singly")
+        except Exception as e:
+            print(f"Claude batch extraction error: {e}; retrying singly")
+        results = []
+        for excerpt in excerpts:
+            await self.bucket.acquire()
+            results.append(await self._extract_one(excerpt))
+        return results
+
+
+claude_coalescer = ClaudeCoalescer()
+Counter("llm_jobs_total", "Extractions queued on the Claude coalescer.", callback=lambda: claude_coalescer.jobs)
+
+
+async def extract_with_claude(body_excerpt: str) -> Optional[dict]:
+    if not CLAUDE_API_KEY:
         return None
+    excerpt = body_excerpt[:5000]
+    cached = await llm_cache.get(LLM_CACHE_NAMESPACE, excerpt)
+    if cached is not None:
+        return cached
+    result = await claude_coalescer.extract(excerpt)
+    if isinstance(result, dict):
+        await llm_cache.put(LLM_CACHE_NAMESPACE, excerpt, result)
+    return result
+
+
+async def extract_many_with_claude(body_excerpts: list[str]) -> list[Optional[dict]]:
+    """
+    Backlog path: submits every uncached excerpt as one Message Batches API
+    job and polls until it ends (minutes to hours, at half the per-token
+    price). Returns results in input order, and caches them so a following
+    extract_with_claude for the same excerpt is a cache hit (backfill.py
+    --llm-batch relies on that). Use extract_with_claude for live mail.
+    """
+    if not CLAUDE_API_KEY:
+        return [None] * len(body_excerpts)
+    excerpts = [b[:5000] for b in body_excerpts]
+    results: list[Optional[dict]] = [await llm_cache.get(LLM_CACHE_NAMESPACE, e) for e in excerpts]
+    missing = list(dict.fromkeys(e for e, r in zip(excerpts, results) if r is None))
+    if not missing:
+        return results
+
+    batch_url = CLAUDE_API_URL.rstrip("/") + "/batches"
+    extracted: dict[str, dict] = {}
+    client = claude_coalescer.client
+    try:
+        resp = await client.post(batch_url, json={"requests": [
+            {"custom_id": str(i), "params": _claude_params(EXTRACT_PROMPT + e)} for i, e in enumerate(missing)
+        ]})
+        resp.raise_for_status()
+        batch = resp.json()
+        while batch["processing_status"] != "ended":
+            await asyncio.sleep(LLM_BATCH_POLL_SECONDS)
+            resp = await client.get(f"{batch_url}/{batch['id']}")
+            resp.raise_for_status()
+            batch = resp.json()
+        resp = await client.get(batch["results_url"])
+        resp.raise_for_status()
+        for line in resp.text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if item["result"]["type"] != "succeeded":
+                continue
+            _count_usage(item["result"]["message"])
+            try:
+                result = _parse_claude_json(item["result"]["message"])
+            except (ValueError, KeyError, IndexError):
+                continue
+            if isinstance(result, dict):
+                extracted[missing[int(item["custom_id"])]] = result
+    except Exception as e:
+        print(f"Claude batch job error: {e}")
+
+    for excerpt, result in extracted.items():
+        await llm_cache.put(LLM_CACHE_NAMESPACE, excerpt, result)
+    return [r if r is not None else extracted.get(e) for e, r in zip(excerpts, results)]
 
 
 # ---------------------------------------------------------------------------
@@ -248,22 +740,21 @@ def parse_date_string(s: str) -> Optional[date]:
 async def resolve_policy(merchant_domain: str, return_window_days: Optional[int]) -> dict:
     """Returns {return_window_days, policy_source, confidence_boost}"""
     if return_window_days is not None:
+        POLICY_SOURCES.labels("email").inc()
         return {"return_window_days": return_window_days, "policy_source": "email", "confidence_boost": 0.1}
 
-    # Check merchant table
-    async with SessionLocal() as session:
-        result = await session.execute(
-            select(MerchantPolicy).where(MerchantPolicy.merchant_domain == merchant_domain)
-        )
-        policy = result.scalar_one_or_none()
-        if policy:
-            return {
-                "return_window_days": policy.default_return_window_days,
-                "policy_source": "merchant_table",
-                "confidence_boost": 0.0,
-            }
+    # Check merchant table (in-memory index; email.nike.com matches nike.com)
+    policy = await policy_index.lookup(merchant_domain)
+    if policy:
+        POLICY_SOURCES.labels("merchant_table").inc()
+        return {
+            "return_window_days": policy.default_return_window_days,
+            "policy_source": "merchant_table",
+            "confidence_boost": 0.0,
+        }
 
     # Generic fallback
+    POLICY_SOURCES.labels("fallback").inc()
     return {"return_window_days": 30, "policy_source": "fallback", "confidence_boost": -0.2}
 
 
@@ -278,6 +769,54 @@ def compute_deadline(order_date: Optional[date], delivery_date: Optional[date],
 # Main pipeline entry point
 # ---------------------------------------------------------------------------
 
+def analyze_email_timed(
+    subject: str, body: str, is_html: bool, from_address: str, from_domain: str, template: Optional[dict] = None,
+) -> tuple[tuple[str, str, Optional[dict]], tuple[float, float, Optional[float]]]:
+    """
+    The CPU-bound steps: text extraction, classification and (for receipts)
+    heuristic extraction. Runs in a parse_executor worker, so it takes and
+    returns plain values: ((body_text, classification, heuristics),
+    (html_to_text, classify, heuristics seconds)). The timings are recorded
+    by the caller, since a process-pool worker's metrics never reach /metrics.
+    """
+    started = time.perf_counter()
+    body_text = (html_to_text(body) if is_html else body)[:TEXT_LIMIT]
+    extracted = time.perf_counter()
+    classification = classify_email(subject, body_text, from_domain)
+    classified = time.perf_counter()
+    heuristics = extract_heuristics(subject, body_text, from_address, template) if classification == "receipt" else None
+    finished = time.perf_counter()
+    timings = (extracted - started, classified - extracted, finished - classified if heuristics is not None else None)
+    return (body_text, classification, heuristics), timings
+
+
+def analyze_email(
+    subject: str, body: str, is_html: bool, from_address: str, from_domain: str, template: Optional[dict] = None,
+) -> tuple[str, str, Optional[dict]]:
+    """analyze_email_timed without the timings. Returns (body_text, classification, heuristics)."""
+    return analyze_email_timed(subject, body, is_html, from_address, from_domain, template)[0]
+
+
+async def run_analyze_email(
+    subject: str, body: str, is_html: bool, from_address: str, from_domain: str, template: Optional[dict] = None,
+) -> tuple[str, str, Optional[dict]]:
+    """analyze_email on parse_executor, recording its stage timings."""
+    result, (html_seconds, classify_seconds, heuristics_seconds) = await parse_executor.run(
+        analyze_email_timed, subject, body, is_html, from_address, from_domain, template,
+    )
+    if is_html:
+        STAGE_HTML_TO_TEXT.observe(html_seconds)
+    STAGE_CLASSIFY.observe(classify_seconds)
+    if heuristics_seconds is not None:
+        STAGE_HEURISTICS.observe(heuristics_seconds)
+    return result
+
+
+def claude_needed(heuristics: dict) -> bool:
+    """Whether process_email falls back to Claude for these heuristics."""
+    return heuristics["confidence"] < 0.7 or not heuristics["order_date"] or not heuristics["total_amount"]
+
+
 async def process_email(
     user_id: int,
     email_id: int,
@@ -285,31 +824,43 @@ async def process_email(
     body_html: str,
     from_address: str,
     received_at,
+    body_text: Optional[str] = None,
+    classification: Optional[str] = None,
+    heuristics: Optional[dict] = None,
 ) -> Optional[dict]:
     """
     Full pipeline. Returns a dict suitable for creating a Purchase, or None if not a receipt.
+    Callers that already ran run_analyze_email pass body_text/classification/heuristics
+    so none of it runs twice.
     """
-    body_text = html_to_text(body_html)
+    from_domain = from_address.split("@")[-1].strip(">").lower() if "@" in from_address else ""
 
     # 1. Classify
-    from_domain = from_address.split("@")[-1].strip(">").lower() if "@" in from_address else ""
-    classification = classify_email(subject, body_text, from_domain)
+    if classification is None:
+        body_text, classification, heuristics = await run_analyze_email(
+            subject, body_html if body_text is None else body_text,
+            body_text is None, from_address, from_domain, await merchant_templates.rules_for(from_domain),
+        )
 
     if classification != "receipt":
         return None
 
     # 2. Heuristic extraction
-    heuristics = extract_heuristics(subject, body_text, from_address)
+    if heuristics is None:
+        template = await merchant_templates.rules_for(from_domain)
+        started = time.perf_counter()
+        heuristics = await parse_executor.run(extract_heuristics, subject, body_text, from_address, template)
+        STAGE_HEURISTICS.observe(time.perf_counter() - started)
 
     # 3. Claude fallback if confidence is low or missing key fields
-    needs_claude = (
-        heuristics["confidence"] < 0.7
-        or not heuristics["order_date"]
-        or not heuristics["total_amount"]
-    )
+    needs_claude = claude_needed(heuristics)
 
+    RECEIPTS_PARSED.inc()
     if needs_claude:
+        LLM_FALLBACKS.inc()
+        started = time.perf_counter()
         claude_result = await extract_with_claude(body_text)
+        STAGE_EXTRACT_WITH_CLAUDE.observe(time.perf_counter() - started)
         if claude_result:
             # Merge: Claude fills gaps, but don't override what heuristics found confidently
             for field in ["merchant_name", "order_date", "total_amount", "currency",
@@ -320,13 +871,24 @@ async def process_email(
                 heuristics["confidence"] = max(heuristics["confidence"], claude_result["confidence"])
 
     # 4. Resolve policy + compute deadline
+    confidence_before_policy = heuristics["confidence"]
     merchant_domain = heuristics.get("merchant_domain") or from_domain
+    started = time.perf_counter()
     policy = await resolve_policy(merchant_domain, heuristics.get("return_window_days"))
+    STAGE_RESOLVE_POLICY.observe(time.perf_counter() - started)
     heuristics["return_window_days"] = policy["return_window_days"]
     heuristics["policy_source"] = policy["policy_source"]
     heuristics["confidence"] = min(1.0, heuristics["confidence"] + policy["confidence_boost"])
 
     order_date = parse_date_string(str(heuristics["order_date"])) if heuristics["order_date"] else received_at.date() if received_at else None
+
+    # Learn this merchant's anchors from parses we trust, and count the fallback
+    confirmed = heuristics["order_date"] and order_date and heuristics.get("total_amount")
+    await merchant_templates.record(
+        merchant_domain, body_text,
+        order_date if confirmed else None, heuristics.get("total_amount") if confirmed else None,
+        used_llm=needs_claude, learn=bool(confirmed) and confidence_before_policy >= 0.7,
+    )
     deadline = compute_deadline(order_date, None, heuristics["return_window_days"]) if heuristics["return_window_days"] else None
 
     return {
@@ -0,0 +1,88 @@
+"""
+Per-user purchase aggregates behind GET /api/purchases/{user_id}/summary, so
+the dashboard totals don't need the whole purchase list.
+
+Two tables, counting only status='active' purchases:
+  purchase_stats             user_id -> active count and amount
+  purchase_deadline_buckets  (user_id, return_deadline day) -> count and amount
+
+They are updated incrementally in the same transaction as the purchase write
+by database.apply_purchase_changes, which adds the difference between
+snapshots taken before and after the change with atomic
+INSERT ... ON CONFLICT DO UPDATE increments. database.insert_purchases (the
+webhook ingest and backfill paths) calls it itself; routers that edit or
+delete a purchase snapshot it first. The summary then reads one stats
+row and the buckets from today forward, so its cost depends on how far out
+deadlines go, not on how many purchases a user has.
+
+Drift (a write path that forgot to call in, float rounding) is corrected by
+reconcile_purchase_stats, which rebuilds both tables from purchases. Run it
+daily:
+  python purchase_stats.py
+"""
+
+import asyncio
+from datetime import date, timedelta
+from typing import Optional
+from sqlalchemy import select, insert, delete, func
+from database import SessionLocal, Purchase, PurchaseStats, PurchaseDeadlineBucket, init_db
+
+SUMMARY_WINDOWS = (3, 7, 30)
+
+
+async def purchase_summary(session, user_id: int, today: Optional[date] = None) -> dict:
+    today = today or date.today()
+    stats = await session.get(PurchaseStats, user_id)
+    result = await session.execute(
+        select(PurchaseDeadlineBucket.day, PurchaseDeadlineBucket.count, PurchaseDeadlineBucket.amount)
+        .where(PurchaseDeadlineBucket.user_id == user_id, PurchaseDeadlineBucket.day >= today)
+    )
+    upcoming = result.all()
+    summary = {
+        "active_count": stats.active_count if stats else 0,
+        "active_amount": round(stats.active_amount, 2) if stats else 0.0,
+        # Still inside the return window
+        "money_at_risk": round(sum(amount for _, _, amount in upcoming), 2),
+        "as_of": today,
+    }
+    for days in SUMMARY_WINDOWS:
+        last = today + timedelta(days=days)
+        summary[f"expiring_{days}d"] = sum(count for day, count, _ in upcoming if day <= last)
+    return summary
+
+
+async def reconcile_purchase_stats(session, user_id: Optional[int] = None):
+    """Rebuild the aggregates from purchases, for one user or everyone. Does not commit."""
+    stats_scope = [PurchaseStats.user_id == user_id] if user_id is not None else []
+    bucket_scope = [PurchaseDeadlineBucket.user_id == user_id] if user_id is not None else []
+    active = [Purchase.status == "active"] + ([Purchase.user_id == user_id] if user_id is not None else [])
+    amount = func.coalesce(func.sum(Purchase.total_amount), 0.0)
+
+    await session.execute(delete(PurchaseStats).where(*stats_scope))
+    await session.execute(delete(PurchaseDeadlineBucket).where(*bucket_scope))
+    await session.execute(
+        insert(PurchaseStats).from_select(
+            ["user_id", "active_count", "active_amount"],
+            select(Purchase.user_id, func.count(), amount).where(*active).group_by(Purchase.user_id),
+        )
+    )
+    await session.execute(
+        insert(PurchaseDeadlineBucket).from_select(
+            ["user_id", "day", "count", "amount"],
+            select(Purchase.user_id, Purchase.return_deadline, func.count(), amount)
+            .where(*active, Purchase.return_deadline.is_not(None))
+            .group_by(Purchase.user_id, Purchase.return_deadline),
+        )
+    )
+
+
+async def main():
+    await init_db()
+    async with SessionLocal() as session:
+        await reconcile_purchase_stats(session)
+        await session.commit()
+    print("[Stats] Reconciled purchase aggregates")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
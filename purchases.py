@@ -1,7 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from database import get_db, Purchase
+from sqlalchemy import select, delete, and_, or_
+from database import get_db, Purchase, Alert, apply_purchase_changes, bump_user_versions, purchase_snapshot
+from purchase_stats import purchase_summary
+from event_bus import event_bus
+from scheduler import schedule_alerts
+from pagination import PAGE_DEFAULT_LIMIT, PAGE_MAX_LIMIT, encode_cursor, decode_cursor, not_modified
 from pydantic import BaseModel
 from typing import Optional
 from datetime import date
@@ -13,15 +17,97 @@ class PurchaseUpdate(BaseModel):
     return_window_days: Optional[int] = None
     policy_source: Optional[str] = "user_override"
 
-@router.get("/{user_id}")
-async def list_purchases(user_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(Purchase)
-        .where(Purchase.user_id == user_id)
-        .order_by(Purchase.return_deadline.asc().nullslast())
-    )
-    purchases = result.scalars().all()
-    return [p.__dict__ for p in purchases]
+class PurchaseOut(BaseModel):
+    id: int
+    merchant_name: Optional[str]
+    merchant_domain: Optional[str]
+    order_id: Optional[str]
+    order_date: Optional[date]
+    delivery_date: Optional[date]
+    total_amount: Optional[float]
+    currency: Optional[str]
+    return_window_days: Optional[int]
+    return_deadline: Optional[date]
+    policy_source: Optional[str]
+    confidence: Optional[float]
+    status: str
+    items: Optional[str]
+
+class PurchasePage(BaseModel):
+    items: list[PurchaseOut]
+    next_cursor: Optional[str]
+
+class PurchaseSummary(BaseModel):
+    active_count: int
+    active_amount: float
+    money_at_risk: float  # active purchases whose return window is still open
+    expiring_3d: int
+    expiring_7d: int
+    expiring_30d: int
+    as_of: date
+
+# Only the columns PurchaseOut serializes are selected; rows never become ORM objects
+PURCHASE_COLUMNS = [getattr(Purchase, name) for name in PurchaseOut.model_fields]
+
+@router.get("/{user_id}", response_model=PurchasePage)
+async def list_purchases(
+    user_id: int,
+    request: Request,
+    response: Response,
+    status: Optional[list[str]] = Query(None),
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_DEFAULT_LIMIT, ge=1, le=PAGE_MAX_LIMIT),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    One page of a user's purchases, soonest return_deadline first (purchases
+    without a deadline last), ties by id. Pass the previous page's next_cursor
+    to continue; next_cursor is null on the last page. ?status= may repeat.
+    Answers If-None-Match with 304 while the user's data is unchanged.
+    """
+    unchanged = await not_modified(request, response, db, user_id)
+    if unchanged is not None:
+        return unchanged
+    after_day, after_id = decode_cursor(cursor) if cursor else (None, 0)
+    base = select(*PURCHASE_COLUMNS).where(Purchase.user_id == user_id)
+    if status:
+        base = base.where(Purchase.status.in_(status))
+
+    # Dated purchases, then undated ones, each an index range on
+    # (user_id, return_deadline, id). A cursor without a date is in the second part.
+    rows = []
+    if after_day is not None or not cursor:
+        query = base.where(Purchase.return_deadline.is_not(None))
+        if after_day is not None:
+            query = query.where(or_(
+                Purchase.return_deadline > after_day,
+                and_(Purchase.return_deadline == after_day, Purchase.id > after_id),
+            ))
+        result = await db.execute(query.order_by(Purchase.return_deadline, Purchase.id).limit(limit + 1))
+        rows = result.mappings().all()
+        after_id = 0
+    if len(rows) <= limit:
+        result = await db.execute(
+            base.where(Purchase.return_deadline.is_(None), Purchase.id > after_id)
+            .order_by(Purchase.id)
+            .limit(limit + 1 - len(rows))
+        )
+        rows += result.mappings().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["return_deadline"], rows[-1]["id"])
+    return {"items": rows, "next_cursor": next_cursor}
+
+@router.get("/{user_id}/summary", response_model=PurchaseSummary)
+async def get_purchase_summary(user_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Dashboard totals from the per-user aggregates in purchase_stats.py: one
+    row plus the open deadline buckets, however many purchases the user has.
+    Expiring counts include deadlines from today through today + N days.
+    """
+    return await purchase_summary(db, user_id)
 
 @router.patch("/{purchase_id}")
 async def update_purchase(
@@ -29,10 +115,11 @@ async def update_purchase(
     body: PurchaseUpdate,
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(select(Purchase).where(Purchase.id == purchase_id))
+    result = await db.execute(select(Purchase).where(Purchase.id == purchase_id).with_for_update())
     purchase = result.scalar_one_or_none()
     if not purchase:
         raise HTTPException(status_code=404, detail="Purchase not found")
+    before = purchase_snapshot(purchase)
 
     if body.status:
         purchase.status = body.status
@@ -44,15 +131,29 @@ async def update_purchase(
         if base:
             purchase.return_deadline = base + timedelta(days=body.return_window_days)
 
+    await apply_purchase_changes(db, [before], [purchase_snapshot(purchase)])
+    await schedule_alerts(db, [purchase])
     await db.commit()
+    event_bus.publish(purchase.user_id, "purchase.updated", {
+        "id": purchase_id,
+        "status": purchase.status,
+        "previous_status": before.status,
+        "return_window_days": purchase.return_window_days,
+        "return_deadline": purchase.return_deadline,
+    })
     return {"status": "ok", "id": purchase_id}
 
 @router.delete("/{purchase_id}")
 async def delete_purchase(purchase_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Purchase).where(Purchase.id == purchase_id))
+    result = await db.execute(select(Purchase).where(Purchase.id == purchase_id).with_for_update())
     purchase = result.scalar_one_or_none()
     if not purchase:
         raise HTTPException(status_code=404, detail="Not found")
+    await apply_purchase_changes(db, [purchase_snapshot(purchase)], [])
+    await bump_user_versions(db, [purchase.user_id])
+    # Every alert goes with it: sent/failed/skipped rows still reference the purchase
+    await db.execute(delete(Alert).where(Alert.purchase_id == purchase_id))
     await db.delete(purchase)
     await db.commit()
+    event_bus.publish(purchase.user_id, "purchase.deleted", {"id": purchase_id})
     return {"status": "deleted"}
@@ -0,0 +1,89 @@
+"""
+Inbound recipient resolution — maps the local part of a webhook recipient
+(e.g. "john8f2a91c4" from john8f2a91c4@inbox.returnradar.app) to a user_id.
+
+Lookups go through an in-process LRU cache with a TTL, so a repeat sender
+costs no queries. Misses are cached too (with a shorter TTL) so spam to unknown
+addresses doesn't hit the database on every delivery; create_user invalidates
+the new local part so a fresh signup is picked up immediately in this process.
+Other processes see it once their negative entry expires.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from email.utils import parseaddr
+from typing import Optional
+from sqlalchemy import select
+from database import User
+from metrics import Counter
+
+RECIPIENT_CACHE_SIZE = int(os.environ.get("RECIPIENT_CACHE_SIZE", "100000"))
+RECIPIENT_CACHE_TTL = float(os.environ.get("RECIPIENT_CACHE_TTL", "300"))
+RECIPIENT_CACHE_MISS_TTL = float(os.environ.get("RECIPIENT_CACHE_MISS_TTL", "30"))
+
+
+class LRUTTLCache:
+    """Small LRU cache whose entries also expire after a per-entry TTL."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl: float):
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+_MISSING = object()
+recipient_cache = LRUTTLCache(RECIPIENT_CACHE_SIZE)
+Counter(
+    "recipient_cache_lookups_total", "Recipient address lookups served by the in-process cache, by result.", ["result"],
+    callback=lambda: {("hit",): recipient_cache.hits, ("miss",): recipient_cache.misses},
+)
+
+
+def local_part_of(recipient: str) -> str:
+    address = parseaddr(recipient)[1] or recipient
+    return address.split("@")[0].strip().lower() if "@" in address else ""
+
+
+async def resolve_recipient(db, recipient: str) -> Optional[int]:
+    """Returns the user_id for an inbound recipient address, or None."""
+    local_part = local_part_of(recipient)
+    if not local_part:
+        return None
+
+    user_id = recipient_cache.get(local_part, _MISSING)
+    if user_id is not _MISSING:
+        return user_id
+
+    result = await db.execute(select(User.id).where(User.inbound_local_part == local_part))
+    user_id = result.scalar_one_or_none()
+    recipient_cache.set(local_part, user_id, RECIPIENT_CACHE_TTL if user_id else RECIPIENT_CACHE_MISS_TTL)
+    return user_id
+
+
+def invalidate_recipient(local_part: str):
+    recipient_cache.invalidate(local_part.lower())
@@ -3,6 +3,16 @@ Alert scheduler — run this as a daily cron job or APScheduler task.
 
 Usage:
   python scheduler.py
+  python scheduler.py --shard 3/8   # one of 8 workers, split by user_id
+
+  python scheduler.py --rebuild-schedule   # re-materialize pending alerts for all active purchases
+
+Alerts are materialized as pending Alert rows when purchases are written (see
+schedule_alerts), so a run only claims rows with scheduled_for <= today.
+Sharded workers can run side by side: a run claims about ALERT_WRITE_BATCH
+alerts at a time by flipping them to 'sending' under a lease, delivers them,
+then claims the next chunk, and only records results for rows it still owns,
+so no alert is sent twice.
 
 Or add to main.py startup with APScheduler:
   from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -10,186 +20,632 @@ Or add to main.py startup with APScheduler:
   scheduler.add_job(run_alerts, 'cron', hour=9)  # 9am UTC daily
 """
 
+import argparse
 import asyncio
 import os
-from datetime import date, datetime
-from typing import Optional
+import random
+import socket
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import NamedTuple, Optional
 import httpx
-from sqlalchemy import select, and_
-from database import SessionLocal, Purchase, Alert, User, UserPreferences, init_db
+from sqlalchemy import select, update, delete, and_, or_, case, true
+from database import SessionLocal, Purchase, Alert, User, UserPreferences, init_db, bump_user_versions, _insert_for
+from event_bus import event_bus
+from metrics import Counter, Gauge, Histogram
+from email_templates import DEFAULT_LOCALE, ALERT_FIELDS, alert_templates, digest_templates, format_date, locale_strings
 
 SENDGRID_API_KEY = os.environ.get("SENDGRID_API_KEY", "")
 FROM_EMAIL = os.environ.get("FROM_EMAIL", "alerts@returnradar.app")
 APP_URL = os.environ.get("APP_URL", "https://returnradar.app")
-
-
-async def send_email_alert(to_email: str, subject: str, html_body: str):
-    """Send via SendGrid."""
+SENDGRID_URL = os.environ.get("SENDGRID_URL", "https://api.sendgrid.com/v3/mail/send")
+
+# Delivery tuning
+ALERT_SEND_CONCURRENCY = int(os.environ.get("ALERT_SEND_CONCURRENCY", "20"))
+ALERT_WRITE_BATCH = int(os.environ.get("ALERT_WRITE_BATCH", "500"))
+SENDGRID_MAX_RETRIES = int(os.environ.get("SENDGRID_MAX_RETRIES", "4"))
+ALERT_DELIVERY_MODE = os.environ.get("ALERT_DELIVERY_MODE", "single")  # single|batch
+SENDGRID_BATCH_SIZE = min(int(os.environ.get("SENDGRID_BATCH_SIZE", "1000")), 1000)  # SendGrid caps personalizations at 1000
+ALERT_LEASE_SECONDS = int(os.environ.get("ALERT_LEASE_SECONDS", "900"))
+SENDGRID_BACKOFF_BASE = 0.5
+SENDGRID_BACKOFF_CAP = 30.0
+
+# Run counters, served at /metrics when the job runs in the API process
+ALERTS_PROCESSED = Counter("alerts_processed_total", "Claimed alerts by outcome.", ["result"])
+ALERT_BATCH_FALLBACKS = Counter("alert_batch_fallbacks_total", "SendGrid batches that fell back to per-recipient sends.")
+ALERT_RUNS = Counter("alert_runs_total", "Completed alert job runs.")
+ALERT_RUN_SECONDS = Histogram(
+    "alert_run_seconds", "Duration of an alert job run.", buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
+ALERT_LAST_RUN = Gauge("alert_last_run_timestamp_seconds", "Unix time the last alert job run finished.")
+
+
+async def post_sendgrid(client: httpx.AsyncClient, payload: dict) -> bool:
+    """
+    POST one /v3/mail/send payload, retrying 429s, 5xx and transport errors
+    with full-jitter exponential backoff. Honors Retry-After when SendGrid sends it.
+    """
+    for attempt in range(SENDGRID_MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            resp = await client.post(SENDGRID_URL, json=payload)
+            if resp.status_code in (200, 202):
+                return True
+            if resp.status_code != 429 and resp.status_code < 500:
+                print(f"Email send rejected: {resp.status_code} {resp.text[:200]}")
+                return False
+            retry_after = resp.headers.get("retry-after")
+        except httpx.TransportError as e:
+            print(f"Email send error: {e}")
+
+        if attempt == SENDGRID_MAX_RETRIES:
+            break
+        delay = random.uniform(0, min(SENDGRID_BACKOFF_CAP, SENDGRID_BACKOFF_BASE * 2 ** attempt))
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        await asyncio.sleep(delay)
+    return False
+
+
+def make_sendgrid_client() -> httpx.AsyncClient:
+    """One keep-alive client sized to the delivery concurrency, shared by a whole run."""
+    return httpx.AsyncClient(
+        headers={"Authorization": f"Bearer {SENDGRID_API_KEY}"},
+        limits=httpx.Limits(
+            max_connections=ALERT_SEND_CONCURRENCY,
+            max_keepalive_connections=ALERT_SEND_CONCURRENCY,
+        ),
+        timeout=15,
+    )
+
+
+async def send_email_alert(
+    to_email: str,
+    subject: str,
+    html_body: str,
+    client: Optional[httpx.AsyncClient] = None,
+    text_body: Optional[str] = None,
+):
+    """Send via SendGrid. Pass a shared client to reuse pooled connections."""
     if not SENDGRID_API_KEY:
         print(f"[MOCK EMAIL] To: {to_email} | Subject: {subject}")
         return True
+    content = [{"type": "text/html", "value": html_body}]
+    if text_body:
+        # SendGrid requires text/plain to come before text/html
+        content.insert(0, {"type": "text/plain", "value": text_body})
+    payload = {
+        "personalizations": [{"to": [{"email": to_email}]}],
+        "from": {"email": FROM_EMAIL, "name": "ReturnRadar"},
+        "subject": subject,
+        "content": content,
+    }
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                "https://api.sendgrid.com/v3/mail/send",
-                headers={"Authorization": f"Bearer {SENDGRID_API_KEY}"},
-                json={
-                    "personalizations": [{"to": [{"email": to_email}]}],
-                    "from": {"email": FROM_EMAIL, "name": "ReturnRadar"},
-                    "subject": subject,
-                    "content": [{"type": "text/html", "value": html_body}],
-                },
-                timeout=15,
-            )
-            return resp.status_code in (200, 202)
+        if client is not None:
+            return await post_sendgrid(client, payload)
+        async with make_sendgrid_client() as own_client:
+            return await post_sendgrid(own_client, payload)
     except Exception as e:
         print(f"Email send error: {e}")
         return False
 
 
-def build_alert_email(purchase: Purchase, days_left: int) -> tuple[str, str]:
-    """Returns (subject, html_body)"""
-    urgency = "⚠️ URGENT" if days_left <= 1 else "🔔"
-    subject = f"{urgency} Return deadline: {purchase.merchant_name} — {days_left} day{'s' if days_left != 1 else ''} left"
-
-    deadline_str = purchase.return_deadline.strftime("%B %d, %Y") if purchase.return_deadline else "Unknown"
-    amount_str = f"${purchase.total_amount:,.2f}" if purchase.total_amount else "Unknown amount"
-    items_str = purchase.items or "Your order"
-
-    html = f"""
-    <div style="font-family: monospace; max-width: 520px; margin: 0 auto; background: #080d14; color: #e2e8f0; padding: 32px; border-radius: 12px;">
-      <div style="font-size: 22px; font-weight: 800; margin-bottom: 4px; color: #f1f5f9;">ReturnRadar</div>
-      <div style="font-size: 11px; color: #475569; margin-bottom: 28px; text-transform: uppercase; letter-spacing: 0.1em;">Return Deadline Alert</div>
-
-      <div style="background: #0c1420; border: 1px solid #1e2d40; border-radius: 10px; padding: 24px; margin-bottom: 20px; text-align: center;">
-        <div style="font-size: 48px; font-weight: 800; color: {'#ef4444' if days_left <= 3 else '#f59e0b'}; line-height: 1;">{days_left}</div>
-        <div style="font-size: 12px; color: #475569; text-transform: uppercase; letter-spacing: 0.1em;">day{'s' if days_left != 1 else ''} left to return</div>
-      </div>
-
-      <div style="margin-bottom: 20px;">
-        <div style="font-size: 18px; font-weight: 700; color: #f1f5f9;">{purchase.merchant_name}</div>
-        <div style="font-size: 13px; color: #64748b; margin-top: 2px;">{items_str}</div>
-      </div>
-
-      <table style="width: 100%; font-size: 13px; border-collapse: collapse; margin-bottom: 24px;">
-        <tr style="border-bottom: 1px solid #1e2d40;">
-          <td style="padding: 8px 0; color: #475569;">Order</td>
-          <td style="padding: 8px 0; text-align: right; color: #e2e8f0;">{purchase.order_id or 'N/A'}</td>
-        </tr>
-        <tr style="border-bottom: 1px solid #1e2d40;">
-          <td style="padding: 8px 0; color: #475569;">Amount</td>
-          <td style="padding: 8px 0; text-align: right; color: #e2e8f0;">{amount_str}</td>
-        </tr>
-        <tr>
-          <td style="padding: 8px 0; color: #475569;">Return deadline</td>
-          <td style="padding: 8px 0; text-align: right; color: {'#ef4444' if days_left <= 3 else '#fcd34d'}; font-weight: 600;">{deadline_str}</td>
-        </tr>
-      </table>
-
-      <a href="{APP_URL}" style="display: block; background: linear-gradient(135deg, #22d3ee, #818cf8); color: #0c1420; text-align: center; padding: 14px; border-radius: 8px; text-decoration: none; font-weight: 700; font-size: 13px; letter-spacing: 0.05em;">
-        VIEW IN RETURNRADAR →
-      </a>
-
-      <div style="margin-top: 20px; font-size: 11px; color: #334155; text-align: center;">
-        You're receiving this because a return window is closing.<br>
-        <a href="{APP_URL}/settings" style="color: #475569;">Manage preferences</a>
-      </div>
-    </div>
+@lru_cache(maxsize=1024)
+def _deadline_str(deadline: date, locale: str) -> str:
+    # A day's alerts share a handful of deadlines, so formatting is worth caching
+    return format_date(deadline, locale)
+
+
+def alert_email_fields(purchase: Purchase, days_left: int, locale: str = DEFAULT_LOCALE) -> dict:
+    """Per-alert slot values for the compiled alert templates."""
+    strings = locale_strings(locale)
+    return {
+        "urgency": strings["urgent"] if days_left <= 1 else strings["reminder"],
+        "days_left": str(days_left),
+        "days_color": "#ef4444" if days_left <= 3 else "#f59e0b",
+        "days_unit": strings["day_one"] if days_left == 1 else strings["day_other"],
+        "merchant_name": str(purchase.merchant_name),
+        "items": purchase.items or strings["your_order"],
+        "order_id": purchase.order_id or strings["not_available"],
+        "amount": f"${purchase.total_amount:,.2f}" if purchase.total_amount else strings["unknown_amount"],
+        "deadline_color": "#ef4444" if days_left <= 3 else "#fcd34d",
+        "deadline": _deadline_str(purchase.return_deadline, locale) if purchase.return_deadline else strings["unknown"],
+    }
+
+
+def build_alert_email(purchase: Purchase, days_left: int, locale: str = DEFAULT_LOCALE) -> tuple[str, str, str]:
+    """Returns (subject, html_body, text_body)"""
+    subject_tpl, html_tpl, text_tpl = alert_templates(locale, APP_URL)
+    fields = alert_email_fields(purchase, days_left, locale)
+    return subject_tpl.render(fields), html_tpl.render(fields), text_tpl.render(fields)
+
+
+def build_digest_email(due: list["DueAlert"], locale: str = DEFAULT_LOCALE) -> tuple[str, str, str]:
+    """Returns (subject, html_body, text_body) combining one user's alerts for the day."""
+    templates = digest_templates(locale, APP_URL)
+    due = sorted(due, key=lambda d: d.days_left)
+    rows = [alert_email_fields(item.purchase, max(0, item.days_left), locale) for item in due]
+    soonest = rows[0]
+    subject_tpl = templates.subject_one if len(rows) == 1 else templates.subject_other
+    subject = subject_tpl.render({
+        "urgency": soonest["urgency"],
+        "count": str(len(rows)),
+        "days_left": soonest["days_left"],
+        "days_unit": soonest["days_unit"],
+    })
+    html = templates.html.render({"rows": "".join(templates.row_html.render(row) for row in rows)})
+    text = templates.text.render({"rows": "\n".join(templates.row_text.render(row) for row in rows)})
+    return subject, html, text
+
+
+DEFAULT_ALERT_OFFSETS = [10, 3, 1]
+
+
+class DueAlert(NamedTuple):
+    purchase: Purchase
+    user_email: str
+    alert_type: str
+    days_left: int
+    digest: bool = False
+    locale: str = DEFAULT_LOCALE
+    alert_id: Optional[int] = None
+
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _shard_filter(column, shard: Optional[tuple[int, int]]):
+    """SQL predicate selecting one shard's users; shard is (index, count), 1-based."""
+    if not shard:
+        return true()
+    index, count = shard
+    return column % count == index - 1
+
+
+async def send_alert_batch(client: httpx.AsyncClient, batch: list[DueAlert], locale: str = DEFAULT_LOCALE) -> bool:
     """
-    return subject, html
+    Send a group of same-locale alerts as one /v3/mail/send request: the shared
+    template goes out once and each alert becomes a personalization with its own
+    subject and substitutions. custom_args carry (purchase_id, alert_type) so
+    SendGrid event webhooks can be mapped back to Alert rows.
+    """
+    try:
+        subject_tpl, html_tpl, text_tpl = alert_templates(locale, APP_URL)
+        personalizations = []
+        for item in batch:
+            fields = alert_email_fields(item.purchase, max(0, item.days_left), locale)
+            personalizations.append({
+                "to": [{"email": item.user_email}],
+                "subject": subject_tpl.render(fields),
+                "substitutions": {f"-{name}-": fields[name] for name in ALERT_FIELDS},
+                "custom_args": {"purchase_id": str(item.purchase.id), "alert_type": item.alert_type},
+            })
+        if not SENDGRID_API_KEY:
+            print(f"[MOCK EMAIL] Batch of {len(personalizations)} alerts")
+            return True
+        return await post_sendgrid(client, {
+            "personalizations": personalizations,
+            "from": {"email": FROM_EMAIL, "name": "ReturnRadar"},
+            "content": [
+                {"type": "text/plain", "value": text_tpl.source},
+                {"type": "text/html", "value": html_tpl.source},
+            ],
+        })
+    except Exception as e:
+        print(f"Batch send error: {e}")
+        return False
 
 
-async def run_alerts():
-    """Main daily alert job."""
-    today = date.today()
-    print(f"[Scheduler] Running alerts for {today}")
-    sent_count = 0
-    skipped_count = 0
+def _deadline_offset(alert_type: str) -> Optional[int]:
+    """10 for 'deadline_10d'; None for 'expired' and other non-reminder types."""
+    if alert_type.startswith("deadline_") and alert_type.endswith("d"):
+        try:
+            return int(alert_type[len("deadline_"):-1])
+        except ValueError:
+            return None
+    return None
+
+
+def alert_schedule(purchase: Purchase, offsets: list[int], min_amount: Optional[float]) -> list[tuple[str, date]]:
+    """[(alert_type, scheduled_for), ...] a purchase should get, given its user's preferences."""
+    if purchase.status != "active" or not purchase.return_deadline:
+        return []
+    # Amount threshold check
+    if min_amount and purchase.total_amount and purchase.total_amount < min_amount:
+        return []
+    deadline = purchase.return_deadline
+    schedule = [
+        (f"deadline_{offset}d", deadline - timedelta(days=offset))
+        for offset in dict.fromkeys(offsets)
+        if isinstance(offset, int) and offset >= 0
+    ]
+    schedule.append(("expired", deadline + timedelta(days=1)))
+    return schedule
+
+
+async def schedule_alerts(session, purchases: list[Purchase], today: Optional[date] = None):
+    """
+    (Re)build the pending Alert rows for some purchases. Call after inserting a
+    purchase or changing its deadline/status, or after a user's offsets change.
 
-    async with SessionLocal() as session:
-        # Get all active purchases with upcoming deadlines
-        result = await session.execute(
-            select(Purchase).where(
-                and_(
-                    Purchase.status == "active",
-                    Purchase.return_deadline.isnot(None),
-                )
-            )
+    Pending rows are replaced; rows already sending/sent/failed are kept, and the
+    (purchase_id, alert_type) constraint stops them being scheduled again.
+    Alerts whose day has already passed are not scheduled. Does not commit.
+    """
+    if not purchases:
+        return
+    today = today or date.today()
+    purchase_ids = [p.id for p in purchases]
+    user_ids = {p.user_id for p in purchases}
+
+    result = await session.execute(
+        select(UserPreferences.user_id, UserPreferences.alert_offsets_days, UserPreferences.min_purchase_amount)
+        .where(UserPreferences.user_id.in_(user_ids))
+    )
+    prefs = {user_id: (offsets, min_amount) for user_id, offsets, min_amount in result.all()}
+
+    await session.execute(
+        delete(Alert).where(Alert.purchase_id.in_(purchase_ids), Alert.status == "pending")
+    )
+
+    rows = []
+    for purchase in purchases:
+        offsets, min_amount = prefs.get(purchase.user_id, (None, None))
+        # An explicit [] means no deadline reminders; only a missing preference gets the defaults
+        offsets = DEFAULT_ALERT_OFFSETS if offsets is None else offsets
+        for alert_type, scheduled_for in alert_schedule(purchase, offsets, min_amount):
+            if scheduled_for >= today:
+                rows.append({
+                    "purchase_id": purchase.id,
+                    "user_id": purchase.user_id,
+                    "alert_type": alert_type,
+                    "scheduled_for": scheduled_for,
+                    "channel": "email",
+                    "status": "pending",
+                })
+
+    insert = _insert_for(session)
+    for i in range(0, len(rows), ALERT_WRITE_BATCH):
+        await session.execute(
+            insert(Alert)
+            .values(rows[i:i + ALERT_WRITE_BATCH])
+            .on_conflict_do_nothing(index_elements=["purchase_id", "alert_type"])
         )
-        purchases = result.scalars().all()
+    await bump_user_versions(session, user_ids)
+
+
+async def rebuild_alert_schedule(session, user_id: Optional[int] = None):
+    """Re-materialize pending alerts for every active purchase (or one user's), in chunks."""
+    last_id = 0
+    while True:
+        query = (
+            select(Purchase)
+            .where(Purchase.status == "active", Purchase.id > last_id)
+            .order_by(Purchase.id)
+            .limit(ALERT_WRITE_BATCH)
+        )
+        if user_id is not None:
+            query = query.where(Purchase.user_id == user_id)
+        purchases = (await session.execute(query)).scalars().all()
+        if not purchases:
+            break
+        await schedule_alerts(session, purchases)
+        await session.commit()
+        last_id = purchases[-1].id
 
-        for purchase in purchases:
-            days_left = (purchase.return_deadline - today).days
 
-            # Get user + preferences
-            user_result = await session.execute(select(User).where(User.id == purchase.user_id))
-            user = user_result.scalar_one_or_none()
-            if not user:
-                continue
+async def claim_due_alerts(
+    session,
+    today: date,
+    shard: Optional[tuple[int, int]] = None,
+    after_user_id: int = 0,
+    worker_id: str = WORKER_ID,
+) -> tuple[list[DueAlert], int, Optional[int]]:
+    """
+    Claim the next chunk of today's work: pending alerts with scheduled_for <=
+    today, plus alerts left 'sending' by a worker whose lease has expired. This
+    is a range scan on the schedule rather than a pass over every purchase.
+
+    A chunk is every claimable alert of the users after `after_user_id`, up to
+    the user holding the ALERT_WRITE_BATCH-th claimable alert, so it is about
+    ALERT_WRITE_BATCH alerts and never splits a user's digest. run_alerts
+    delivers each chunk before claiming the next, so a lease only has to cover
+    one chunk's sends however large the backlog is.
+
+    The claim is one UPDATE ... WHERE id IN (SELECT ...) RETURNING that flips
+    rows to 'sending' under a lease owned by `worker_id`. On Postgres the inner
+    SELECT uses FOR UPDATE SKIP LOCKED so concurrent workers split the rows
+    instead of queueing; on SQLite the single writer lock plus the guard in the
+    WHERE clause gives the same exactly-once claim.
+
+    Returns ([DueAlert, ...], skipped_count, last_user_id); pass last_user_id
+    as after_user_id for the next chunk, and stop when it is None. Claimed
+    alerts are marked skipped rather than sent when their purchase is no longer
+    active, and, for deadline reminders claimed late (after an outage or a
+    missed run), when the deadline has passed or a nearer reminder for the same
+    purchase is due too.
+    """
+    now = datetime.utcnow()
+    claimable = or_(
+        and_(Alert.status == "pending", Alert.scheduled_for <= today),
+        and_(Alert.status == "sending", Alert.lease_expires_at < now),
+    )
+    in_range = and_(Alert.user_id > after_user_id, _shard_filter(Alert.user_id, shard))
+    last_user_id = (await session.execute(
+        select(Alert.user_id)
+        .where(claimable, in_range)
+        .order_by(Alert.user_id)
+        .offset(ALERT_WRITE_BATCH - 1)
+        .limit(1)
+    )).scalar_one_or_none()
+    if last_user_id is not None:
+        in_range = and_(in_range, Alert.user_id <= last_user_id)
+
+    candidates = select(Alert.id).where(claimable, in_range)
+    if session.bind.dialect.name == "postgresql":
+        candidates = candidates.with_for_update(skip_locked=True)
+
+    result = await session.execute(
+        update(Alert)
+        .where(Alert.id.in_(candidates.scalar_subquery()), claimable)
+        .values(
+            status="sending",
+            lease_expires_at=now + timedelta(seconds=ALERT_LEASE_SECONDS),
+            claimed_by=worker_id,
+        )
+        .returning(Alert.id, Alert.user_id)
+        .execution_options(synchronize_session=False)
+    )
+    claimed = result.all()
+    claimed_ids = [alert_id for alert_id, _ in claimed]
+    await bump_user_versions(session, [user_id for _, user_id in claimed])
+    await session.commit()
+
+    rows = []
+    for i in range(0, len(claimed_ids), ALERT_WRITE_BATCH):
+        result = await session.execute(
+            select(Alert.id, Alert.alert_type, Purchase, User.email, UserPreferences.alert_digest, UserPreferences.locale)
+            .join(Purchase, Purchase.id == Alert.purchase_id)
+            .join(User, User.id == Alert.user_id)
+            .outerjoin(UserPreferences, UserPreferences.user_id == Alert.user_id)
+            .where(Alert.id.in_(claimed_ids[i:i + ALERT_WRITE_BATCH]))
+        )
+        rows.extend(result.all())
+
+    # After a missed run several offsets of one purchase come due together; only
+    # the nearest one (smallest offset) is still worth sending
+    nearest: dict[int, int] = {}
+    for _, alert_type, purchase, *_ in rows:
+        offset = _deadline_offset(alert_type)
+        if offset is not None:
+            nearest[purchase.id] = min(offset, nearest.get(purchase.id, offset))
+
+    due = []
+    skipped = []
+    skipped_events = []
+    for alert_id, alert_type, purchase, user_email, digest, locale in rows:
+        offset = _deadline_offset(alert_type)
+        days_left = (purchase.return_deadline - today).days if purchase.return_deadline else None
+        if (
+            purchase.status != "active"
+            or days_left is None
+            or (offset is not None and (days_left < 0 or offset > nearest[purchase.id]))
+        ):
+            skipped.append({"id": alert_id, "status": "skipped", "lease_expires_at": None})
+            skipped_events.append((purchase.user_id, {"id": alert_id, "purchase_id": purchase.id, "alert_type": alert_type}))
+            continue
+        due.append(DueAlert(purchase, user_email, alert_type, days_left,
+                            bool(digest), locale or DEFAULT_LOCALE, alert_id))
+
+    if skipped:
+        await session.execute(update(Alert), skipped)
+        await bump_user_versions(session, [user_id for user_id, _ in skipped_events])
+        await session.commit()
+        for user_id, data in skipped_events:
+            event_bus.publish(user_id, "alert.skipped", dict(data, status="skipped"))
+    return due, len(skipped), last_user_id
 
-            pref_result = await session.execute(
-                select(UserPreferences).where(UserPreferences.user_id == purchase.user_id)
-            )
-            prefs = pref_result.scalar_one_or_none()
-            offsets = prefs.alert_offsets_days if prefs else [10, 3, 1]
-            min_amount = prefs.min_purchase_amount if prefs else None
 
-            # Amount threshold check
-            if min_amount and purchase.total_amount and purchase.total_amount < min_amount:
-                skipped_count += 1
-                continue
+def _publish_alert_results(alerts: list[dict], due_by_id: dict[int, DueAlert]):
+    for alert in alerts:
+        item = due_by_id[alert["id"]]
+        event_bus.publish(item.purchase.user_id, f"alert.{alert['status']}", {
+            "id": alert["id"],
+            "purchase_id": item.purchase.id,
+            "alert_type": item.alert_type,
+            "status": alert["status"],
+            "sent_at": alert["sent_at"],
+        })
 
-            # Check if today matches any offset
-            matched_offset = None
-            for offset in offsets:
-                if days_left == offset:
-                    matched_offset = offset
-                    break
-
-            # Also handle expired (days_left == -1)
-            alert_type = None
-            if matched_offset is not None:
-                alert_type = f"deadline_{matched_offset}d"
-            elif days_left == -1:
-                alert_type = "expired"
-
-            if not alert_type:
-                continue
 
-            # Check if already sent
-            existing_alert = await session.execute(
-                select(Alert).where(
-                    and_(
-                        Alert.purchase_id == purchase.id,
-                        Alert.alert_type == alert_type,
-                    )
-                )
-            )
-            if existing_alert.scalar_one_or_none():
-                skipped_count += 1
-                continue
+async def _record_results(session, results: list[dict], due_by_id: dict[int, DueAlert], worker_id: str) -> list[dict]:
+    """
+    Write a batch of sent/failed results and commit. Each row is only updated
+    while it is still 'sending' under worker_id's claim: if the lease ran out
+    and another worker reclaimed the alert, that worker owns the outcome and
+    the result is dropped here. Returns the results actually recorded.
+    """
+    recorded_ids = set()
+    for status in ("sent", "failed"):
+        group = [r for r in results if r["status"] == status]
+        if not group:
+            continue
+        ids = [r["id"] for r in group]
+        sent_at = case({r["id"]: r["sent_at"] for r in group}, value=Alert.id) if status == "sent" else None
+        result = await session.execute(
+            update(Alert)
+            .where(Alert.id.in_(ids), Alert.status == "sending", Alert.claimed_by == worker_id)
+            .values(status=status, sent_at=sent_at, lease_expires_at=None)
+            .returning(Alert.id)
+            .execution_options(synchronize_session=False)
+        )
+        recorded_ids.update(result.scalars().all())
+    recorded = [r for r in results if r["id"] in recorded_ids]
+    if len(recorded) < len(results):
+        print(f"[Scheduler] {len(results) - len(recorded)} alerts lost their claim before being recorded")
+    await bump_user_versions(session, [due_by_id[r["id"]].purchase.user_id for r in recorded])
+    await session.commit()
+    _publish_alert_results(recorded, due_by_id)
+    return recorded
+
+
+def _alert_result(item: DueAlert, success: bool) -> dict:
+    return {
+        "id": item.alert_id,
+        "sent_at": datetime.utcnow() if success else None,
+        "status": "sent" if success else "failed",
+        "lease_expires_at": None,
+    }
+
+
+async def deliver_alerts(session, due: list[DueAlert], worker_id: str = WORKER_ID) -> tuple[int, int]:
+    """
+    Send claimed alerts with at most ALERT_SEND_CONCURRENCY requests in flight
+    over one pooled client. Alert rows are updated to sent/failed in batches of
+    ALERT_WRITE_BATCH as sends finish, guarded by worker_id's claim (see
+    _record_results). Returns (sent_count, failed_count) of the recorded results.
 
-            # Send it
-            subject, html_body = build_alert_email(purchase, max(0, days_left))
-            success = await send_email_alert(user.email, subject, html_body)
-
-            alert = Alert(
-                purchase_id=purchase.id,
-                user_id=purchase.user_id,
-                alert_type=alert_type,
-                scheduled_for=today,
-                sent_at=datetime.utcnow() if success else None,
-                channel="email",
-                status="sent" if success else "failed",
-            )
-            session.add(alert)
-            sent_count += 1
+    In batch mode (ALERT_DELIVERY_MODE=batch) alerts go out SENDGRID_BATCH_SIZE
+    personalizations per request. A batch SendGrid rejects is requeued as
+    per-recipient sends, so every alert still gets its own sent/failed row.
 
-        await session.commit()
+    Users with alert_digest set get all of the day's alerts in one email; each
+    underlying alert is still recorded so dedup keeps working.
+    """
+    if not due:
+        return 0, 0
+
+    jobs: asyncio.Queue = asyncio.Queue()
+    digests: dict[int, list[DueAlert]] = {}
+    singles: list[DueAlert] = []
+    for item in due:
+        if item.digest:
+            digests.setdefault(item.purchase.user_id, []).append(item)
+        else:
+            singles.append(item)
+    for group in digests.values():
+        jobs.put_nowait(("digest", group))
+    if ALERT_DELIVERY_MODE == "batch":
+        by_locale: dict[str, list[DueAlert]] = {}
+        for item in singles:
+            by_locale.setdefault(item.locale, []).append(item)
+        for group in by_locale.values():
+            for i in range(0, len(group), SENDGRID_BATCH_SIZE):
+                jobs.put_nowait(("batch", group[i:i + SENDGRID_BATCH_SIZE]))
+    else:
+        for item in singles:
+            jobs.put_nowait(("single", [item]))
+    finished: asyncio.Queue = asyncio.Queue()
+
+    async def worker(client: httpx.AsyncClient):
+        while True:
+            kind, job = await jobs.get()
+            if kind == "batch" and len(job) > 1:
+                if await send_alert_batch(client, job, job[0].locale):
+                    for item in job:
+                        finished.put_nowait(_alert_result(item, True))
+                else:
+                    ALERT_BATCH_FALLBACKS.inc()
+                    for item in job:
+                        jobs.put_nowait(("single", [item]))
+                continue
 
-    print(f"[Scheduler] Done. Sent: {sent_count}, Skipped: {skipped_count}")
+            try:
+                if kind == "digest":
+                    subject, html_body, text_body = build_digest_email(job, job[0].locale)
+                else:
+                    subject, html_body, text_body = build_alert_email(
+                        job[0].purchase, max(0, job[0].days_left), job[0].locale
+                    )
+                success = await send_email_alert(job[0].user_email, subject, html_body, client=client, text_body=text_body)
+            except Exception as e:
+                print(f"Alert delivery error for purchase {job[0].purchase.id}: {e}")
+                success = False
+            for item in job:
+                finished.put_nowait(_alert_result(item, success))
+
+    sent_count = failed_count = 0
+    batch: list[dict] = []
+    due_by_id = {item.alert_id: item for item in due}
+    async with make_sendgrid_client() as client:
+        workers = [asyncio.create_task(worker(client)) for _ in range(min(ALERT_SEND_CONCURRENCY, len(due)))]
+        try:
+            for _ in range(len(due)):
+                batch.append(await finished.get())
+                if len(batch) >= ALERT_WRITE_BATCH:
+                    recorded = await _record_results(session, batch, due_by_id, worker_id)
+                    sent_count += sum(r["status"] == "sent" for r in recorded)
+                    failed_count += sum(r["status"] == "failed" for r in recorded)
+                    batch.clear()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    if batch:
+        recorded = await _record_results(session, batch, due_by_id, worker_id)
+        sent_count += sum(r["status"] == "sent" for r in recorded)
+        failed_count += sum(r["status"] == "failed" for r in recorded)
+    return sent_count, failed_count
+
+
+async def run_alerts(shard: Optional[tuple[int, int]] = None) -> dict:
+    """
+    Main daily alert job. Pass shard=(index, count) to run one slice of users.
+    Returns the run's counts, which are also added to the scheduler metrics.
+    """
+    started = time.perf_counter()
+    today = date.today()
+    worker_id = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"  # per run, so overlapping runs in one process stay apart
+    sent_count = failed_count = skipped_count = 0
+    after_user_id = 0
+    async with SessionLocal() as session:
+        while True:
+            due, skipped, last_user_id = await claim_due_alerts(session, today, shard, after_user_id, worker_id)
+            sent, failed = await deliver_alerts(session, due, worker_id)
+            sent_count += sent
+            failed_count += failed
+            skipped_count += skipped
+            if last_user_id is None:
+                break
+            after_user_id = last_user_id
+            session.expunge_all()  # the delivered chunk's purchases are no longer needed
+    elapsed = time.perf_counter() - started
+
+    ALERTS_PROCESSED.labels("sent").inc(sent_count)
+    ALERTS_PROCESSED.labels("failed").inc(failed_count)
+    ALERTS_PROCESSED.labels("skipped").inc(skipped_count)
+    ALERT_RUNS.inc()
+    ALERT_RUN_SECONDS.observe(elapsed)
+    ALERT_LAST_RUN.set(time.time())
+    return {"sent": sent_count, "failed": failed_count, "skipped": skipped_count, "seconds": round(elapsed, 2)}
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """'3/8' -> (3, 8): the third of eight shards."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must look like INDEX/COUNT, e.g. 3/8")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("shard index must be between 1 and COUNT")
+    return index, count
 
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Run the daily alert job.")
+    arg_parser.add_argument("--shard", type=parse_shard, help="run one slice of users, e.g. 3/8")
+    arg_parser.add_argument("--rebuild-schedule", action="store_true",
+                            help="re-materialize pending alerts for all active purchases, then exit")
+    args = arg_parser.parse_args()
     asyncio.run(init_db())
-    asyncio.run(run_alerts())
+    if args.rebuild_schedule:
+        async def rebuild():
+            async with SessionLocal() as session:
+                await rebuild_alert_schedule(session)
+        asyncio.run(rebuild())
+    else:
+        counts = asyncio.run(run_alerts(args.shard))
+        print(f"[Scheduler] {'shard %d/%d ' % args.shard if args.shard else ''}{counts}")
@@ -0,0 +1,90 @@
+"""
+Shared fixtures. The app reads DATABASE_URL and the SendGrid settings at import
+time, so they are pointed at a scratch SQLite file and a local stub before any
+app module is imported.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="returnradar-tests-"), "test.db")
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["ANTHROPIC_API_KEY"] = ""  # never call Claude from tests
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db():
+    """A freshly migrated database; yields an open session."""
+    from database import engine, init_db, SessionLocal
+
+    await engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+    await init_db()
+    async with SessionLocal() as session:
+        yield session
+
+
+class StubSendGrid:
+    """
+    A local /v3/mail/send that records every payload. `status` is the response
+    code to return, or a callable(payload) -> code.
+    """
+
+    def __init__(self):
+        self.payloads: list[dict] = []
+        self.status = 202
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub._lock:
+                    stub.payloads.append(payload)
+                status = stub.status(payload) if callable(stub.status) else stub.status
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v3/mail/send"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def recipients(self) -> list[str]:
+        """Every address mailed, once per personalization."""
+        return [to["email"] for p in self.payloads for pers in p["personalizations"] for to in pers["to"]]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def sendgrid(monkeypatch):
+    import scheduler
+
+    stub = StubSendGrid()
+    monkeypatch.setattr(scheduler, "SENDGRID_URL", stub.url)
+    monkeypatch.setattr(scheduler, "SENDGRID_API_KEY", "test-key")
+    monkeypatch.setattr(scheduler, "SENDGRID_BACKOFF_BASE", 0.0)
+    yield stub
+    stub.close()
@@ -0,0 +1,69 @@
+import json
+
+import httpx
+import pytest
+from sqlalchemy import select
+
+from database import Purchase, User
+
+pytestmark = pytest.mark.anyio
+
+RECEIPT = """From: Mug Shop <orders@mugs{n}.example>
+To: u1@in.example.com
+Subject: Your order confirmation
+Message-ID: <order-{n}@mugs.example>
+Date: Tue, 03 Mar 2026 10:00:00 +0000
+Content-Type: text/plain; charset=utf-8
+
+Thank you for your order! Order number A-{n}. Items: ceramic mugs.
+We will let you know when your order ships.
+"""
+
+
+class StubClaude:
+    """Message Batches endpoints answering every request with the same extraction."""
+
+    def __init__(self):
+        self.batches: list[list[dict]] = []
+        self.single_requests = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path == "/v1/messages/batches" and request.method == "POST":
+            self.batches.append(json.loads(request.content)["requests"])
+            return httpx.Response(200, json={
+                "id": "batch_1", "processing_status": "ended", "results_url": "https://claude.test/v1/messages/batches/batch_1/results",
+            })
+        if path == "/v1/messages/batches/batch_1/results":
+            lines = [
+                json.dumps({"custom_id": r["custom_id"], "result": {"type": "succeeded", "message": {
+                    "content": [{"type": "text", "text": json.dumps({"order_date": "2026-03-02", "total_amount": 24.5, "confidence": 0.9})}],
+                    "usage": {"input_tokens": 100, "output_tokens": 20},
+                }}})
+                for r in self.batches[-1]
+            ]
+            return httpx.Response(200, text="\n".join(lines))
+        self.single_requests += 1
+        return httpx.Response(500)
+
+
+async def test_llm_batch_backfill_uses_one_batch_job(db, tmp_path, monkeypatch):
+    import parser
+    from backfill import import_mailbox
+
+    stub = StubClaude()
+    monkeypatch.setattr(parser, "CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr(parser, "CLAUDE_API_URL", "https://claude.test/v1/messages")
+    monkeypatch.setattr(parser.claude_coalescer, "_client", httpx.AsyncClient(transport=httpx.MockTransport(stub.handler)))
+    for n in range(3):
+        (tmp_path / f"{n}.eml").write_text(RECEIPT.format(n=n))
+    db.add(User(id=1, email="user@example.com", inbound_address="u1@in.example.com"))
+    await db.commit()
+
+    totals = await import_mailbox(1, str(tmp_path), checkpoint_path=str(tmp_path / "checkpoint.json"), llm_batch=True)
+
+    assert totals["purchases"] == 3
+    assert len(stub.batches) == 1 and len(stub.batches[0]) == 3
+    assert stub.single_requests == 0
+    purchases = (await db.scalars(select(Purchase))).all()
+    assert {(p.total_amount, str(p.order_date)) for p in purchases} == {(24.5, "2026-03-02")}
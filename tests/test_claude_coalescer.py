@@ -0,0 +1,75 @@
+import json
+import re
+
+import httpx
+import pytest
+
+from parser import ClaudeCoalescer
+
+pytestmark = pytest.mark.anyio
+
+EXCERPTS = [f"Receipt from user {n}. Order number ORD-{n}. Total: ${n}0.00" for n in range(1, 5)]
+
+
+class StubMessages:
+    """Messages endpoint extracting the order number from each email, replying in a scrambled order."""
+
+    def __init__(self, echo_index: bool = True):
+        self.echo_index = echo_index
+        self.prompts: list[str] = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        prompt = json.loads(request.content)["messages"][0]["content"]
+        self.prompts.append(prompt)
+        sections = re.split(r"=== EMAIL (\d+) ===\n", prompt)[1:]
+        if sections:
+            reply = []
+            for n, body in zip(sections[::2], sections[1::2]):
+                item = {"order_id": re.search(r"ORD-\d+", body).group(), "confidence": 0.9}
+                if self.echo_index:
+                    item["email"] = int(n)
+                reply.append(item)
+            reply = reply[1::2] + reply[::2]  # out of order
+        else:
+            reply = {"order_id": re.search(r"ORD-\d+", prompt).group(), "confidence": 0.9}
+        return httpx.Response(200, json={"content": [{"type": "text", "text": json.dumps(reply)}], "usage": {}})
+
+
+def make_coalescer(stub: StubMessages) -> ClaudeCoalescer:
+    coalescer = ClaudeCoalescer(batch_size=4, requests_per_minute=6000)
+    coalescer._client = httpx.AsyncClient(transport=httpx.MockTransport(stub.handler))
+    return coalescer
+
+
+async def test_out_of_order_batch_reply_is_matched_by_echoed_index():
+    stub = StubMessages()
+    coalescer = make_coalescer(stub)
+    results = await coalescer._extract_batch(EXCERPTS)
+    await coalescer.close()
+
+    assert [r["order_id"] for r in results] == ["ORD-1", "ORD-2", "ORD-3", "ORD-4"]
+    assert all("email" not in r for r in results)
+    assert len(stub.prompts) == 1
+
+
+async def test_batch_reply_without_indices_falls_back_to_single_calls():
+    stub = StubMessages(echo_index=False)
+    coalescer = make_coalescer(stub)
+    results = await coalescer._extract_batch(EXCERPTS)
+    await coalescer.close()
+
+    assert [r["order_id"] for r in results] == ["ORD-1", "ORD-2", "ORD-3", "ORD-4"]
+    assert len(stub.prompts) == 1 + len(EXCERPTS)
+
+
+@pytest.mark.parametrize("reply", [
+    [{"email": 1}, {"email": 1}],  # one email answered twice, the other dropped
+    [{"email": 1}, {"email": 3}],  # out of range
+    [{"email": 1}],  # merged
+    [{"email": "1"}, {"email": 2}],
+    {"email": 1},
+])
+def test_mismatched_batch_replies_are_rejected(reply):
+    from parser import _match_batch_reply
+
+    assert _match_batch_reply(reply, 2) is None
@@ -0,0 +1,131 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import select, text
+
+from database import (
+    POOL_CHECKOUT_SECONDS, Email, Purchase, PurchaseStats, User, UserVersion, bulk_insert_parsed, insert_purchases, make_engine,
+)
+
+pytestmark = pytest.mark.anyio
+
+WRITERS = 32
+TRANSACTIONS = 20
+
+
+async def test_concurrent_writers_do_not_hit_lock_errors(tmp_path):
+    """32 writers committing small transactions against one SQLite file through make_engine."""
+    engine = make_engine(f"sqlite+aiosqlite:///{tmp_path / 'stress.db'}")
+    checkouts_before = POOL_CHECKOUT_SECONDS._default.count
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text("CREATE TABLE writes (writer INTEGER, n INTEGER, payload TEXT)"))
+            assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+
+        errors = []
+
+        async def writer(i: int):
+            for n in range(TRANSACTIONS):
+                try:
+                    async with engine.begin() as conn:
+                        await conn.execute(text("INSERT INTO writes VALUES (:w, :n, :p)"), {"w": i, "n": n, "p": "x" * 200})
+                        await conn.execute(text("SELECT count(*) FROM writes WHERE writer = :w"), {"w": i})
+                except Exception as e:
+                    errors.append(e)
+
+        await asyncio.gather(*(writer(i) for i in range(WRITERS)))
+
+        assert errors == []
+        async with engine.connect() as conn:
+            assert (await conn.execute(text("SELECT count(*) FROM writes"))).scalar() == WRITERS * TRANSACTIONS
+        assert POOL_CHECKOUT_SECONDS._default.count - checkouts_before >= WRITERS * TRANSACTIONS
+    finally:
+        await engine.dispose()
+
+
+def email(message_id: str, user_id: int = 1, status: str = "success") -> dict:
+    return {"user_id": user_id, "provider_message_id": message_id, "subject": "Order", "parsed_status": status}
+
+
+def purchase(order_id, user_id: int = 1, amount: float = 10.0, domain: str = "shop.example") -> dict:
+    return {
+        "user_id": user_id,
+        "order_id": order_id,
+        "merchant_domain": domain,
+        "total_amount": amount,
+        "status": "active",
+        "return_deadline": date.today() + timedelta(days=30),
+    }
+
+
+@pytest.fixture
+async def users(db):
+    db.add_all(User(id=i, email=f"user{i}@example.com", inbound_address=f"u{i}@in.example.com") for i in (1, 2))
+    await db.commit()
+    return db
+
+
+async def test_insert_purchases_skips_stored_and_repeated_orders(users):
+    db = users
+    assert len(await insert_purchases(db, [purchase("A-1")])) == 1
+    await db.commit()
+
+    inserted = await insert_purchases(db, [
+        purchase("A-1"),  # already stored
+        purchase("A-2"),
+        purchase("A-2", amount=99.0),  # repeated within the batch; the first wins
+        purchase("A-1", domain="other.example"),  # same order ID at another merchant
+        purchase("A-1", user_id=2),  # same order for another user
+    ])
+    await db.commit()
+
+    assert sorted((p.user_id, p.order_id, p.merchant_domain, p.total_amount) for p in inserted) == [
+        (1, "A-1", "other.example", 10.0), (1, "A-2", "shop.example", 10.0), (2, "A-1", "shop.example", 10.0),
+    ]
+    assert len((await db.scalars(select(Purchase))).all()) == 4
+    # Only inserted rows count toward the aggregates and versions
+    assert (await db.get(PurchaseStats, 1)).active_count == 3
+    assert (await db.get(UserVersion, 2)).version == 1
+    assert await insert_purchases(db, []) == []
+
+
+async def test_bulk_insert_parsed_dedupes_emails_and_purchases(users):
+    db = users
+    await bulk_insert_parsed(db, [(email("m-stored"), purchase("A-1"))])
+    await db.commit()
+
+    result = await bulk_insert_parsed(db, [
+        (email("m-stored"), purchase("A-9")),  # email already stored: its purchase is dropped too
+        (email("m-1"), purchase("A-1")),  # purchase already stored
+        (email("m-2", status="skipped"), None),  # not a receipt
+        (email("m-3"), purchase("A-3")),
+        (email("m-3"), purchase("A-3")),  # redelivered within the batch
+        (email("m-4"), purchase("A-3")),  # another email for the same order
+        (email("m-5", user_id=2), purchase("A-1", user_id=2)),
+    ])
+    await db.commit()
+
+    assert result.email_ids[0] is None and result.email_ids[4] is None
+    assert all(email_id is not None for i, email_id in enumerate(result.email_ids) if i not in (0, 4))
+    assert (result.duplicate_emails, result.duplicate_purchases) == (2, 2)
+    assert sorted((p.user_id, p.order_id) for p in result.purchases) == [(1, "A-3"), (2, "A-1")]
+
+    statuses = {e.provider_message_id: e.parsed_status for e in (await db.scalars(select(Email))).all()}
+    assert statuses == {
+        "m-stored": "success", "m-1": "skipped", "m-2": "skipped", "m-3": "success", "m-4": "skipped", "m-5": "success",
+    }
+    purchases = (await db.scalars(select(Purchase))).all()
+    assert sorted((p.user_id, p.order_id) for p in purchases) == [(1, "A-1"), (1, "A-3"), (2, "A-1")]
+    by_email = {e.id: e.provider_message_id for e in (await db.scalars(select(Email))).all()}
+    assert {by_email[p.source_email_id] for p in result.purchases} == {"m-3", "m-5"}
+
+
+async def test_bulk_insert_parsed_with_only_skipped_emails(users):
+    db = users
+    result = await bulk_insert_parsed(db, [(email(f"m-{i}", status="skipped"), None) for i in range(3)])
+    await db.commit()
+    assert (result.purchases, result.duplicate_emails, result.duplicate_purchases) == ([], 0, 0)
+    assert len(result.email_ids) == 3 and None not in result.email_ids
+    assert (await db.scalars(select(Purchase))).all() == []
+    assert await bulk_insert_parsed(db, []) == ([], [], 0, 0)
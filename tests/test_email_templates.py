@@ -0,0 +1,38 @@
+from datetime import date
+
+from database import Purchase
+from scheduler import DueAlert, build_digest_email
+
+
+def due(purchase_id: int, days_left: int, locale: str, merchant: str) -> DueAlert:
+    purchase = Purchase(id=purchase_id, merchant_name=merchant, total_amount=25.0, return_deadline=date(2026, 3, days_left))
+    return DueAlert(purchase, "user@example.com", f"deadline_{days_left}d", days_left, True, locale, purchase_id)
+
+
+def test_digest_subject_singular_and_plural():
+    subject, _, _ = build_digest_email([due(1, 3, "en", "Nike")], "en")
+    assert subject == "🔔 1 return deadline coming up — 3 days left"
+    subject, _, _ = build_digest_email([due(1, 3, "en", "Nike"), due(2, 1, "en", "Zara")], "en")
+    assert subject == "⚠️ URGENT 2 return deadlines coming up — soonest in 1 day"
+
+
+def test_digest_is_localized():
+    subject, html, text = build_digest_email([due(1, 10, "es", "Nike"), due(2, 3, "es", "Zara")], "es")
+    assert subject == "🔔 2 plazos de devolución por vencer — el primero en 3 días"
+    assert "Resumen diario de plazos de devolución" in html and "VER EN RETURNRADAR" in html
+    # Soonest first
+    assert text.index("Zara: 3 días (vence el 3 de marzo de 2026, $25.00)") < text.index("Nike: 10 días")
+    assert "Daily" not in html + text
+
+
+def test_template_cache_is_keyed_by_supported_locale():
+    import email_templates
+
+    email_templates._alert_templates.cache_clear()
+    email_templates._digest_templates.cache_clear()
+    for locale in ("en", "es", "fr", "xx-unknown", "", "EN-gb"):
+        email_templates.alert_templates(locale, "https://app.example")
+        email_templates.digest_templates(locale, "https://app.example")
+    assert email_templates._alert_templates.cache_info().currsize == 2
+    assert email_templates._digest_templates.cache_info().currsize == 2
+    assert email_templates.alert_templates("fr", "https://app.example") is email_templates.alert_templates("en", "https://app.example")
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from event_bus import EventBus
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_publish_reaches_only_the_users_subscribers():
+    bus = EventBus(queue_size=4)
+    first, second, other = bus.subscribe(1), bus.subscribe(1), bus.subscribe(2)
+    bus.publish(1, "purchase.created", {"id": 7, "total_amount": 12.5})
+    bus.publish(3, "purchase.created", {"id": 8})  # nobody listening
+
+    for subscription in (first, second):
+        event, data = subscription.queue.get_nowait()
+        assert (event, json.loads(data)) == ("purchase.created", {"id": 7, "total_amount": 12.5})
+    assert other.queue.empty()
+    assert (bus.published, bus.subscriber_count()) == (1, 3)
+
+    bus.unsubscribe(first)
+    bus.unsubscribe(second)
+    bus.unsubscribe(second)  # already gone
+    assert bus.subscriber_count() == 1 and 1 not in bus._subscribers
+
+
+async def test_a_full_queue_drops_only_that_subscriber():
+    bus = EventBus(queue_size=2)
+    slow, fast = bus.subscribe(1), bus.subscribe(1)
+    for i in range(2):
+        bus.publish(1, "alert.sent", {"id": i})
+        fast.queue.get_nowait()
+    bus.publish(1, "alert.sent", {"id": 2})
+
+    # The backlog is replaced by the end marker so the stream stops at once
+    assert slow.dropped and slow.queue.get_nowait() is None and slow.queue.empty()
+    assert not fast.dropped and json.loads(fast.queue.get_nowait()[1]) == {"id": 2}
+    assert (bus.dropped, bus.subscriber_count()) == (1, 1)
+    bus.publish(1, "alert.sent", {"id": 3})
+    assert slow.queue.empty()
+
+
+async def test_stream_sends_retry_events_heartbeats_and_ends_when_dropped(monkeypatch):
+    import events
+
+    bus = EventBus(queue_size=2)
+    monkeypatch.setattr(events, "event_bus", bus)
+    monkeypatch.setattr(events, "EVENT_HEARTBEAT_SECONDS", 0.01)
+
+    response = await events.stream_events(5)
+    assert response.media_type == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache" and response.headers["X-Accel-Buffering"] == "no"
+
+    stream = events._stream(5)
+    assert await stream.__anext__() == f"retry: {events.EVENT_RETRY_MS}\n\n"
+    assert bus.subscriber_count() == 1
+    bus.publish(5, "purchase.updated", {"id": 1, "status": "kept", "return_deadline": None})
+    assert await stream.__anext__() == 'event: purchase.updated\ndata: {"id": 1, "status": "kept", "return_deadline": null}\n\n'
+    assert await stream.__anext__() == ": ping\n\n"
+
+    for i in range(3):  # one more than the queue holds
+        bus.publish(5, "alert.sent", {"id": i})
+    assert await stream.__anext__() == "event: dropped\ndata: {}\n\n"
+    with pytest.raises(StopAsyncIteration):
+        await stream.__anext__()
+    assert bus.subscriber_count() == 0
+
+
+async def test_closing_the_stream_unsubscribes(monkeypatch):
+    import events
+
+    bus = EventBus()
+    monkeypatch.setattr(events, "event_bus", bus)
+    stream = events._stream(5)
+    await stream.__anext__()
+    assert bus.subscriber_count() == 1
+    await stream.aclose()  # the client went away
+    assert bus.subscriber_count() == 0
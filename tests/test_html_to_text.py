@@ -0,0 +1,114 @@
+import hashlib
+import random
+
+import pytest
+
+from parser import TEXT_LIMIT, html_to_text
+
+# ---------------------------------------------------------------------------
+# html_to_text before the streaming extractor, kept frozen. BeautifulSoup is
+# no longer a runtime dependency; without it the outputs are checked against
+# REFERENCE_DIGEST, recorded from this function over CASES.
+# ---------------------------------------------------------------------------
+
+
+def reference_html_to_text(html: str) -> str:
+    from bs4 import BeautifulSoup
+
+    try:
+        soup = BeautifulSoup(html, "html.parser")
+        for tag in soup(["script", "style", "head"]):
+            tag.decompose()
+        return soup.get_text(separator=" ", strip=True)
+    except Exception:
+        return html
+
+
+EDGE_CASES = [
+    "",
+    "plain text, no markup",
+    "<p>one</p><p>two</p>",
+    "a<b>b</b>c",
+    "  <div>\n\t spaced \n</div>  ",
+    "<html><head><title>Receipt</title><style>p {color: red}</style></head><body>Total: $5.00</body></html>",
+    "<script>var x = '<p>not text</p>';</script>after",
+    "<style>.a{}</style><p>kept</p><script>dropped()</script>",
+    "<p>unclosed <b>bold <i>italic",
+    "<p>Fish &amp; Chips &lt;3 &#36;12.50 &euro;4 &nbsp;&nbsp; done</p>",
+    "<p>caf&eacute; na&iuml;ve &#x1F600;</p>",
+    "<!-- a comment --><p>visible</p><!-- another -->",
+    "text<!-- mid -->more",
+    "<table><tr><td>Item</td><td>$1.00</td></tr><tr><td>Total</td><td>$1.00</td></tr></table>",
+    "<br>line<br/>line<hr>",
+    "<p>Order #A-123</p>\n\n<p>   </p><p>Return within 30 days</p>",
+    "<div<p>broken</p>",
+    "<p attr='>'>quoted angle</p>",
+    "< p>not a tag</p>",
+    "<ul><li>Mugs</li><li>Plates</li></ul>",
+    "<head><title>only head</title></head>",
+    "<p>Ünïcödé — “quotes” ¥100</p>",
+    "<SCRIPT>upper()</SCRIPT><P>Upper</P>",
+    "<p>" + "x" * 9000 + "</p><p>tail</p>",  # one text node across feed() chunks
+    "<p>" + "word " * 3000 + "</p>",
+]
+
+
+def _receipt(rng: random.Random) -> str:
+    rows = "".join(
+        f"<tr><td>{rng.choice(['Mug', 'Plate', 'Socks &amp; shoes', 'Café set'])}</td>"
+        f"<td>${rng.randint(1, 300)}.{rng.randint(0, 99):02d}</td></tr>"
+        for _ in range(rng.randint(0, 40))
+    )
+    filler = "".join(
+        rng.choice([
+            "<p>Thanks for shopping with us!</p>",
+            "<!-- tracking pixel -->",
+            "<script>track({id: 1})</script>",
+            "<style>td { padding: 4px }</style>",
+            f"<p>Order number: {rng.randint(10000, 99999999)}</p>",
+            f"<div><span>Total:</span> <b>${rng.randint(1, 999)}.{rng.randint(0, 99):02d}</b></div>",
+            "<p>Returns accepted within 30 days&nbsp;of delivery.</p>",
+            "<a href='https://shop.example/unsubscribe?a=1&b=2'>Unsubscribe</a>",
+            "<img src='x.png' alt='logo'>",
+        ])
+        for _ in range(rng.randint(0, 300))
+    )
+    head = "<head><title>Your order</title><style>body{}</style></head>" if rng.random() < 0.7 else ""
+    return f"<html>{head}<body>{filler}<table>{rows}</table>{filler[:rng.randint(0, len(filler))]}</body></html>"
+
+
+def _corpus(size: int = 300, seed: int = 20260311):
+    rng = random.Random(seed)
+    return [_receipt(rng) for _ in range(size)]
+
+
+CASES = EDGE_CASES + _corpus()
+
+# sha256 over reference_html_to_text(case) for every case, NUL-separated
+REFERENCE_DIGEST = "0fad42663bcae161c7251a5fc04a0ad12a32b84fe2a05e71fa68f9fab171d8c4"
+
+
+def _digest(outputs) -> str:
+    return hashlib.sha256("\0".join(outputs).encode()).hexdigest()
+
+
+def test_full_text_matches_reference():
+    outputs = [html_to_text(case, limit=None) for case in CASES]
+    try:
+        import bs4  # noqa: F401
+    except ImportError:
+        assert _digest(outputs) == REFERENCE_DIGEST
+        return
+    expected = [reference_html_to_text(case) for case in CASES]
+    assert _digest(expected) == REFERENCE_DIGEST
+    mismatches = [case for case, got, want in zip(CASES, outputs, expected) if got != want]
+    assert mismatches == []
+
+
+def test_capped_text_is_a_prefix_covering_the_limit():
+    """What consumers read, the first TEXT_LIMIT chars, is the same as from the full text."""
+    for case in CASES:
+        full = html_to_text(case, limit=None)
+        capped = html_to_text(case)
+        assert full.startswith(capped)
+        assert capped[:TEXT_LIMIT] == full[:TEXT_LIMIT]
@@ -0,0 +1,191 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import select, update
+
+from database import Email, Purchase, User
+
+pytestmark = pytest.mark.anyio
+
+RECEIPT = {
+    "recipient": "u1@in.example.com",
+    "sender": "orders@mugs.example",
+    "subject": "Your order confirmation",
+    "body-plain": "Thank you for your order! Order number A-12345. Order total: $24.50. Items: ceramic mugs.",
+    "Message-Id": "<order-1@mugs.example>",
+}
+
+
+@pytest.fixture
+async def user(db, monkeypatch):
+    from parse_executor import parse_executor
+    from recipients import recipient_cache
+
+    monkeypatch.setattr(parse_executor, "mode", "inline")
+    recipient_cache.clear()
+    db.add(User(id=1, email="user@example.com", inbound_address="u1@in.example.com", inbound_local_part="u1"))
+    await db.commit()
+    yield db
+    recipient_cache.clear()
+
+
+async def post_inbound(form: dict) -> httpx.Response:
+    import emails
+
+    app = FastAPI()
+    app.include_router(emails.router, prefix="/api/emails")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post("/api/emails/inbound", data=form)
+
+
+async def add_pending(db, count: int) -> list[int]:
+    db.add_all(
+        Email(user_id=1, provider_message_id=f"m{i}", subject="Hello", body_text="Just saying hi.", parsed_status="pending")
+        for i in range(count)
+    )
+    await db.commit()
+    return list((await db.scalars(select(Email.id).order_by(Email.id))).all())
+
+
+async def test_webhook_queues_and_workers_parse(user, monkeypatch):
+    import emails
+    from ingest import IngestWorkers
+
+    workers = IngestWorkers(concurrency=2)
+    monkeypatch.setattr(emails, "ingest_workers", workers)
+    response = await post_inbound(RECEIPT)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "queued"
+    assert (await user.get(Email, body["email_id"])).parsed_status == "pending"
+
+    workers.start()
+    try:
+        for _ in range(200):
+            user.expire_all()
+            if (await user.get(Email, body["email_id"])).parsed_status not in ("pending", "processing"):
+                break
+            await asyncio.sleep(0.02)
+    finally:
+        await workers.stop()
+
+    email = await user.get(Email, body["email_id"])
+    assert (email.parsed_status, email.classification, email.attempts) == ("success", "receipt", 1)
+    purchase = (await user.scalars(select(Purchase))).one()
+    assert (purchase.order_id, purchase.total_amount) == ("A-12345", 24.5)
+
+
+async def test_redelivered_message_id_is_a_duplicate(user, monkeypatch):
+    import emails
+    from ingest import IngestWorkers
+
+    monkeypatch.setattr(emails, "ingest_workers", IngestWorkers())
+    assert (await post_inbound(RECEIPT)).json()["status"] == "queued"
+    assert (await post_inbound(RECEIPT)).json() == {"status": "duplicate"}
+    assert len((await user.scalars(select(Email))).all()) == 1
+
+
+async def test_unknown_recipient_is_ignored(user, monkeypatch):
+    import emails
+    from ingest import IngestWorkers
+
+    monkeypatch.setattr(emails, "ingest_workers", IngestWorkers())
+    response = await post_inbound(dict(RECEIPT, recipient="nobody@in.example.com"))
+    assert response.json()["status"] == "ignored"
+    assert (await user.scalars(select(Email))).all() == []
+
+
+async def test_full_backlog_answers_503_with_retry_after(user, monkeypatch):
+    import emails
+    import ingest
+
+    monkeypatch.setattr(ingest, "INGEST_MAX_PENDING", 3)
+    monkeypatch.setattr(emails, "ingest_workers", ingest.IngestWorkers())
+    await add_pending(user, 3)
+
+    response = await post_inbound(RECEIPT)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "60"
+    assert len((await user.scalars(select(Email))).all()) == 3
+
+
+async def test_claim_takes_oldest_pending_and_recovers_stale_claims(user, monkeypatch):
+    import ingest
+    from database import SessionLocal
+
+    monkeypatch.setattr(ingest, "INGEST_STALE_SECONDS", 300)
+    first, second, third = await add_pending(user, 3)
+    now = datetime.utcnow()
+    await user.execute(update(Email).where(Email.id == first).values(
+        parsed_status="processing", processing_started_at=now - timedelta(seconds=10), attempts=1,
+    ))
+    await user.execute(update(Email).where(Email.id == second).values(
+        parsed_status="processing", processing_started_at=now - timedelta(seconds=600), attempts=1,
+    ))
+    await user.commit()
+
+    async with SessionLocal() as session:
+        claimed = [await ingest.claim_email(session) for _ in range(3)]
+    # The live claim on `first` is left alone; the stale one is taken back
+    assert claimed == [second, third, None]
+    user.expire_all()
+    rows = {e.id: (e.parsed_status, e.attempts) for e in (await user.scalars(select(Email))).all()}
+    assert rows == {first: ("processing", 1), second: ("processing", 2), third: ("processing", 1)}
+
+
+async def test_failing_email_is_retried_then_marked_failed(user, monkeypatch):
+    import ingest
+    from database import SessionLocal
+
+    calls = []
+
+    async def broken(db, email_record):
+        calls.append(email_record.id)
+        raise RuntimeError("parser blew up")
+
+    monkeypatch.setattr(ingest, "ingest_email", broken)
+    monkeypatch.setattr(ingest, "INGEST_MAX_ATTEMPTS", 3)
+    (email_id,) = await add_pending(user, 1)
+
+    statuses = []
+    for _ in range(4):
+        async with SessionLocal() as session:
+            claimed = await ingest.claim_email(session)
+        if claimed is None:
+            break
+        assert await ingest.process_claimed_email(claimed) is None
+        user.expire_all()
+        statuses.append((await user.get(Email, email_id)).parsed_status)
+
+    assert calls == [email_id] * 3
+    assert statuses == ["pending", "pending", "failed"]
+    assert (await user.get(Email, email_id)).attempts == 3
+
+
+async def test_worker_survives_an_error_outside_the_pipeline(user, monkeypatch):
+    import ingest
+
+    seen = []
+
+    async def explode(email_id):
+        seen.append(email_id)
+        raise RuntimeError("session factory down")
+
+    monkeypatch.setattr(ingest, "process_claimed_email", explode)
+    monkeypatch.setattr(ingest, "INGEST_POLL_SECONDS", 0.05)
+    await add_pending(user, 2)
+
+    workers = ingest.IngestWorkers(concurrency=1)
+    workers.start()
+    try:
+        for _ in range(100):
+            if len(seen) == 2:
+                break
+            await asyncio.sleep(0.02)
+        assert not workers._tasks[0].done()
+    finally:
+        await workers.stop()
+    assert len(seen) == 2
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, func, select, update
+
+import database
+from database import LLMCacheEntry
+from llm_cache import LLMCache
+
+pytestmark = pytest.mark.anyio
+
+NAMESPACE = "test-model:0"
+
+
+@pytest.fixture
+def statements():
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement.split(None, 1)[0].upper())
+
+    event.listen(database.engine.sync_engine, "before_cursor_execute", record)
+    yield seen
+    event.remove(database.engine.sync_engine, "before_cursor_execute", record)
+
+
+async def test_recent_hits_do_not_write(db, statements):
+    cache = LLMCache(touch_seconds=3600)
+    await cache.put(NAMESPACE, "Order 1 from shop", {"merchant_name": "Shop"})
+
+    statements.clear()
+    for _ in range(5):
+        assert await cache.get(NAMESPACE, "Order 1  from shop") == {"merchant_name": "Shop"}
+    assert cache.hits == 5
+    assert statements == ["SELECT"] * 5
+
+    stale = datetime.utcnow() - timedelta(hours=2)
+    await db.execute(update(LLMCacheEntry).values(last_used_at=stale))
+    await db.commit()
+    assert await cache.get(NAMESPACE, "Order 1 from shop") == {"merchant_name": "Shop"}
+    assert "UPDATE" in statements
+    db.expire_all()
+    assert (await db.scalar(select(LLMCacheEntry.last_used_at))) > stale
+
+
+async def test_trim_runs_per_batch_of_inserts(db, statements):
+    cache = LLMCache(max_entries=5, trim_every=4)
+    trimmed, counts = [], []
+    for i in range(20):
+        statements.clear()
+        await cache.put(NAMESPACE, f"receipt {i}", {"order_id": str(i)})
+        if "SELECT" in statements:
+            trimmed.append(i)
+        counts.append(await db.scalar(select(func.count()).select_from(LLMCacheEntry)))
+
+    # Counted on the first store, then once per 4 inserted rows
+    assert trimmed == [0, 4, 8, 12, 16]
+    assert max(counts) <= 5 + 3
+    # A redelivery inserts nothing and doesn't bring the next trim closer
+    statements.clear()
+    for _ in range(8):
+        await cache.put(NAMESPACE, "receipt 19", {"order_id": "19"})
+    assert "SELECT" not in statements
+
+
+async def test_trim_evicts_least_recently_used(db):
+    cache = LLMCache(max_entries=3, trim_every=100)
+    for i in range(6):
+        await cache.put(NAMESPACE, f"receipt {i}", {"order_id": str(i)})
+    old = datetime.utcnow() - timedelta(days=1)
+    await db.execute(update(LLMCacheEntry).values(last_used_at=old))
+    await db.commit()
+    for i in (0, 2, 4):
+        await cache.get(NAMESPACE, f"receipt {i}")
+
+    await cache.trim()
+    assert [await cache.get(NAMESPACE, f"receipt {i}") is not None for i in range(6)] == [True, False, True, False, True, False]
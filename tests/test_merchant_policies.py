@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import pytest
+
+from database import MerchantPolicy
+from merchant_policies import MerchantPolicyIndex
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def index(db):
+    """An index over the seeded merchant_policies table."""
+    index = MerchantPolicyIndex()
+    await index.refresh(force=True)
+    return index
+
+
+@pytest.mark.parametrize("domain, merchant", [
+    ("amazon.com", "amazon.com"),
+    ("mail.amazon.com", "amazon.com"),
+    ("orders.store.nike.com", "nike.com"),
+    ("AMAZON.COM", "amazon.com"),
+    ("amazon.com.", "amazon.com"),
+    ("email.apple.com>", "apple.com"),
+])
+async def test_subdomains_match_their_merchant(index, domain, merchant):
+    assert (await index.lookup(domain)).merchant_domain == merchant
+
+
+@pytest.mark.parametrize("domain", [
+    "notamazon.com",
+    "amazon.co",
+    "amazon.com.evil.example",
+    "amazon",
+    "com",
+    "",
+])
+async def test_lookalikes_and_bare_tlds_do_not_match(index, domain):
+    assert await index.lookup(domain) is None
+
+
+async def test_resolve_policy_uses_parent_domain(index, monkeypatch):
+    import parser
+
+    monkeypatch.setattr(parser, "policy_index", index)
+    assert await parser.resolve_policy("mail.amazon.com", None) == {
+        "return_window_days": 30, "policy_source": "merchant_table", "confidence_boost": 0.0,
+    }
+    assert (await parser.resolve_policy("notamazon.com", None))["policy_source"] == "fallback"
+    assert (await parser.resolve_policy("mail.amazon.com", 45))["policy_source"] == "email"
+
+
+async def test_new_policy_is_picked_up_on_refresh(db, index):
+    assert await index.lookup("shop.example.org") is None
+    db.add(MerchantPolicy(merchant_domain="example.org", merchant_name="Example", default_return_window_days=21,
+                          last_updated_at=datetime.utcnow()))
+    await db.commit()
+    await index.refresh()  # within POLICY_REFRESH_SECONDS: not reloaded yet
+    assert await index.lookup("shop.example.org") is None
+    await index.refresh(force=True)
+    assert (await index.lookup("shop.example.org")).default_return_window_days == 21
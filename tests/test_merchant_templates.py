@@ -0,0 +1,45 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+
+from database import MerchantTemplate
+from merchant_templates import MerchantTemplates
+
+pytestmark = pytest.mark.anyio
+
+RECEIPT = "Thanks for shopping. Order placed: March 3, 2026. Items: socks. Grand total: $45.00"
+
+
+async def test_record_buffers_until_flush(db, monkeypatch):
+    import merchant_templates
+
+    monkeypatch.setattr(merchant_templates, "TEMPLATE_FLUSH_SECONDS", 3600)
+    templates = MerchantTemplates()
+    for i in range(4):
+        await templates.record("shop.example", RECEIPT, date(2026, 3, 3), 45.0, used_llm=i == 0, learn=True)
+    await templates.record("other.example", "no anchors", None, None, used_llm=True, learn=False)
+    assert (await db.scalars(select(MerchantTemplate))).all() == []
+
+    await templates.flush()
+    await templates.record("shop.example", RECEIPT, date(2026, 3, 3), 45.0, used_llm=False, learn=True)
+    await templates.flush()
+
+    rows = {t.merchant_domain: t for t in (await db.scalars(select(MerchantTemplate))).all()}
+    shop = rows["shop.example"]
+    assert (shop.emails, shop.llm_fallbacks, shop.samples) == (5, 1, 5)
+    assert shop.rules["total_amount"]["grand total"] == 5
+    assert shop.rules["order_date"]["order placed"] == 5
+    other = rows["other.example"]
+    assert (other.emails, other.llm_fallbacks, other.samples, other.rules) == (1, 1, 0, {})
+
+
+async def test_flush_when_enough_merchants_are_pending(db, monkeypatch):
+    import merchant_templates
+
+    monkeypatch.setattr(merchant_templates, "TEMPLATE_FLUSH_SECONDS", 3600)
+    monkeypatch.setattr(merchant_templates, "TEMPLATE_FLUSH_DOMAINS", 3)
+    templates = MerchantTemplates()
+    for domain in ("a.example", "b.example", "c.example"):
+        await templates.record(domain, "", None, None, used_llm=False, learn=False)
+    assert len((await db.scalars(select(MerchantTemplate))).all()) == 3
@@ -0,0 +1,122 @@
+import re
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+import metrics
+from metrics import Counter, Gauge, Histogram
+
+pytestmark = pytest.mark.anyio
+
+SAMPLE_LINE = re.compile(
+    r'^[a-zA-Z_:][a-zA-Z0-9_:]*'
+    r'(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*"(,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*")*\})?'
+    r' (-?[0-9.e+-]+|\+Inf|NaN)$'
+)
+
+
+@pytest.fixture
+def registry():
+    """Families created in a test are removed from the process-wide registry afterwards."""
+    before = list(metrics.REGISTRY)
+    yield
+    metrics.REGISTRY[:] = before
+
+
+def samples(family) -> dict[str, str]:
+    return dict(line.rsplit(" ", 1) for line in family.render().splitlines() if not line.startswith("#"))
+
+
+def test_counter_and_gauge_exposition(registry):
+    requests = Counter("test_requests_total", "Requests, by route.", ["route", "code"])
+    requests.labels("/api/purchases", 200).inc()
+    requests.labels("/api/purchases", 200).inc(2)
+    requests.labels("/api/alerts", 304).inc(0.5)
+    depth = Gauge("test_queue_depth", "Queue depth.")
+    depth.set(3)
+    depth.set(1.25)
+
+    assert requests.render().splitlines()[:2] == [
+        "# HELP test_requests_total Requests, by route.",
+        "# TYPE test_requests_total counter",
+    ]
+    assert samples(requests) == {
+        'test_requests_total{route="/api/purchases",code="200"}': "3",
+        'test_requests_total{route="/api/alerts",code="304"}': "0.5",
+    }
+    assert depth.render().splitlines() == ["# HELP test_queue_depth Queue depth.", "# TYPE test_queue_depth gauge", "test_queue_depth 1.25"]
+    # An unlabelled family reports 0 before its first update
+    assert samples(Counter("test_unused_total", "Never incremented.")) == {"test_unused_total": "0"}
+
+
+def test_label_values_are_escaped(registry):
+    family = Counter("test_escaped_total", "Escaping.", ["value"])
+    family.labels('back\\slash "quoted"\nnewline').inc()
+    (line,) = [l for l in family.render().splitlines() if not l.startswith("#")]
+    assert line == r'test_escaped_total{value="back\\slash \"quoted\"\nnewline"} 1'
+    assert SAMPLE_LINE.match(line)
+
+
+def test_callback_values_are_read_at_scrape_time(registry):
+    state = {"hits": 1}
+    labelled = Counter("test_cache_total", "Cache lookups.", ["result"], callback=lambda: {("hit",): state["hits"], ("miss",): 2})
+    plain = Gauge("test_subscribers", "Subscribers.", callback=lambda: state["hits"] * 10)
+    state["hits"] = 4
+    assert samples(labelled) == {'test_cache_total{result="hit"}': "4", 'test_cache_total{result="miss"}': "2"}
+    assert samples(plain) == {"test_subscribers": "40"}
+
+    broken = Gauge("test_broken", "Callback raises.", callback=lambda: 1 / 0)
+    assert broken.render().splitlines() == ["# HELP test_broken Callback raises.", "# TYPE test_broken gauge"]
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    latency = Histogram("test_latency_seconds", "Latency.", ["stage"], buckets=(1.0, 0.1, 0.5))
+    stage = latency.labels("parse")
+    for value in (0.05, 0.1, 0.3, 0.5, 0.7, 2.0, 2.0):
+        stage.observe(value)
+
+    assert samples(latency) == {
+        # Bounds are sorted, and a value equal to a bound counts in that bucket (le)
+        'test_latency_seconds_bucket{stage="parse",le="0.1"}': "2",
+        'test_latency_seconds_bucket{stage="parse",le="0.5"}': "4",
+        'test_latency_seconds_bucket{stage="parse",le="1"}': "5",
+        'test_latency_seconds_bucket{stage="parse",le="+Inf"}': "7",
+        'test_latency_seconds_sum{stage="parse"}': "5.65",
+        'test_latency_seconds_count{stage="parse"}': "7",
+    }
+    unlabelled = Histogram("test_run_seconds", "Runs.", buckets=(1.0,))
+    unlabelled.observe(0.5)
+    assert samples(unlabelled) == {
+        'test_run_seconds_bucket{le="1"}': "1", 'test_run_seconds_bucket{le="+Inf"}': "1",
+        "test_run_seconds_sum": "0.5", "test_run_seconds_count": "1",
+    }
+
+
+async def test_metrics_endpoint_scrape(registry):
+    # The same handler as main.py's GET /metrics; main.py itself imports the routers package
+    app = FastAPI()
+    app.get("/metrics", response_class=PlainTextResponse)(
+        lambda: PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+    )
+    Counter("test_scraped_total", "Scraped.", ["path"]).labels('a"b').inc(7)
+    Histogram("test_scraped_seconds", "Scraped latency.").observe(0.002)
+    import parser, scheduler, llm_cache  # noqa: F401  register the app's own families
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert body.endswith("\n")
+    lines = body.splitlines()
+    helps = [l.split()[2] for l in lines if l.startswith("# HELP ")]
+    types = [l.split()[2] for l in lines if l.startswith("# TYPE ")]
+    assert helps == types and len(helps) == len(set(helps)) == len(metrics.REGISTRY)
+    bad = [l for l in lines if not l.startswith("#") and not SAMPLE_LINE.match(l)]
+    assert bad == []
+    assert 'test_scraped_total{path="a\\"b"} 7' in lines
+    assert 'test_scraped_seconds_bucket{le="0.0025"} 1' in lines
+    assert {"llm_cache_lookups_total", "alerts_processed_total"} <= set(helps)
@@ -0,0 +1,145 @@
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import event, inspect, text
+
+from database import Alert, Email, Purchase, User, engine
+
+pytestmark = pytest.mark.anyio
+
+
+@contextmanager
+def captured_statements():
+    """Collects (sql, parameters) for every statement run inside the block."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+
+async def query_plans(statements, table: str) -> list[str]:
+    """EXPLAIN QUERY PLAN for each captured SELECT/UPDATE that reads `table`."""
+    plans = []
+    async with engine.connect() as conn:
+        for statement, parameters in statements:
+            if f"FROM {table}" not in statement or not statement.lstrip().startswith(("SELECT", "UPDATE")):
+                continue
+            rows = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            plans.append(" | ".join(row[-1] for row in rows))
+    return plans
+
+
+@pytest.fixture
+async def seeded(db):
+    today = date.today()
+    db.add_all(User(id=i, email=f"user{i}@example.com", inbound_address=f"u{i}@in.example.com", inbound_local_part=f"u{i}")
+               for i in (1, 2))
+    db.add_all(Purchase(id=i, user_id=1 + i % 2, status="active", return_deadline=today + timedelta(days=i)) for i in range(1, 21))
+    db.add_all(Alert(purchase_id=i, user_id=1 + i % 2, alert_type="deadline_1d", scheduled_for=today, status="pending")
+               for i in range(1, 21))
+    db.add_all(Email(user_id=1, provider_message_id=f"m{i}") for i in range(5))
+    await db.commit()
+    return db
+
+
+async def api_get(path: str):
+    import alerts, purchases
+
+    app = FastAPI()
+    app.include_router(purchases.router, prefix="/api/purchases")
+    app.include_router(alerts.router, prefix="/api/alerts")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get(path)
+    assert response.status_code == 200
+
+
+def uses(plans: list[str], index: str) -> bool:
+    return any(f"USING INDEX {index}" in plan or f"USING COVERING INDEX {index}" in plan for plan in plans)
+
+
+async def test_purchase_listing_uses_its_index(seeded):
+    with captured_statements() as statements:
+        await api_get("/api/purchases/1?limit=5")
+    assert uses(await query_plans(statements, "purchases"), "ix_purchases_user_deadline")
+
+
+async def test_alert_listing_uses_its_index(seeded):
+    with captured_statements() as statements:
+        await api_get("/api/alerts/1?limit=5")
+    assert uses(await query_plans(statements, "alerts"), "ix_alerts_user_scheduled")
+
+
+async def test_scheduler_claim_uses_its_index(seeded):
+    from scheduler import claim_due_alerts
+
+    with captured_statements() as statements:
+        await claim_due_alerts(seeded, date.today())
+    assert uses(await query_plans(statements, "alerts"), "ix_alerts_status_scheduled")
+
+
+async def test_ingest_claim_uses_its_index(seeded):
+    from ingest import claim_email
+
+    with captured_statements() as statements:
+        await claim_email(seeded)
+    assert uses(await query_plans(statements, "emails"), "ix_emails_status")
+
+
+async def test_recipient_lookup_uses_its_index(seeded):
+    from recipients import recipient_cache, resolve_recipient
+
+    recipient_cache.clear()
+    with captured_statements() as statements:
+        assert await resolve_recipient(seeded, "U2@in.example.com") == 2
+    # Fresh databases get the column's UNIQUE autoindex, upgraded ones uq_users_inbound_local_part
+    plans = await query_plans(statements, "users")
+    assert any("INDEX" in plan and "(inbound_local_part=?)" in plan for plan in plans)
+
+
+async def test_upgrade_keeps_shipped_index_definitions(db):
+    """Migration 3 creates the indexes it shipped with; later migrations reshape them."""
+    from migrations import HOT_PATH_INDEXES, _hot_path_indexes
+
+    async with engine.begin() as conn:
+        for name, table_name, _ in HOT_PATH_INDEXES:
+            await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        await conn.run_sync(_hot_path_indexes)
+        indexes = await conn.run_sync(
+            lambda sync_conn: {ix["name"]: ix["column_names"] for t in ("purchases", "alerts") for ix in inspect(sync_conn).get_indexes(t)}
+        )
+    assert indexes["ix_purchases_user_deadline"] == ["user_id", "return_deadline"]
+    assert indexes["ix_alerts_user_scheduled"] == ["user_id", "scheduled_for"]
+    assert indexes["ix_purchases_user_order"] == ["user_id", "order_id", "merchant_domain"]
+
+
+async def test_alert_backfill_honours_empty_offsets(db):
+    """Migration 12 gives defaults only to users without offsets; [] opts out of reminders."""
+    from database import UserPreferences
+    from migrations import _alert_schedule
+
+    deadline = date.today() + timedelta(days=20)
+    db.add_all(User(id=i, email=f"user{i}@example.com", inbound_address=f"u{i}@in.example.com") for i in (1, 2))
+    db.add(UserPreferences(user_id=1, alert_offsets_days=[]))
+    db.add_all(
+        Purchase(id=i, user_id=i, merchant_name="Shop", total_amount=20.0, status="active", return_deadline=deadline)
+        for i in (1, 2)
+    )
+    await db.commit()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(_alert_schedule)
+        rows = (await conn.execute(text("SELECT purchase_id, alert_type FROM alerts"))).all()
+    types = {}
+    for purchase_id, alert_type in rows:
+        types.setdefault(purchase_id, set()).add(alert_type)
+    assert types == {1: {"expired"}, 2: {"deadline_10d", "deadline_3d", "deadline_1d", "expired"}}
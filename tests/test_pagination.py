@@ -0,0 +1,226 @@
+from datetime import date, timedelta
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import select
+
+from database import Alert, Email, Purchase, User, insert_purchases
+
+pytestmark = pytest.mark.anyio
+
+TODAY = date.today()
+
+
+@pytest.fixture
+async def client(db):
+    import alerts, purchases, users
+
+    db.add_all(User(id=i, email=f"user{i}@example.com", inbound_address=f"u{i}@in.example.com", inbound_local_part=f"u{i}")
+               for i in (1, 2))
+    await db.commit()
+    app = FastAPI()
+    app.include_router(purchases.router, prefix="/api/purchases")
+    app.include_router(alerts.router, prefix="/api/alerts")
+    app.include_router(users.router, prefix="/api/users")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+def purchase_row(user_id: int, order_id: str, deadline_days: int = 20, **values) -> dict:
+    return dict({
+        "user_id": user_id,
+        "order_id": order_id,
+        "merchant_domain": "shop.example",
+        "merchant_name": "Shop",
+        "total_amount": 30.0,
+        "order_date": TODAY,
+        "return_window_days": deadline_days,
+        "return_deadline": TODAY + timedelta(days=deadline_days),
+        "status": "active",
+    }, **values)
+
+
+class Listings:
+    """Polls both listings of a user with If-None-Match, like the dashboard does."""
+
+    def __init__(self, client: httpx.AsyncClient, user_id: int = 1):
+        self.client = client
+        self.user_id = user_id
+        self.etags: dict[str, str] = {}
+
+    async def poll(self) -> dict[str, int]:
+        statuses = {}
+        for listing in ("purchases", "alerts"):
+            headers = {"If-None-Match": self.etags[listing]} if listing in self.etags else {}
+            response = await self.client.get(f"/api/{listing}/{self.user_id}", headers=headers)
+            statuses[listing] = response.status_code
+            assert response.headers["ETag"].startswith('W/"')
+            self.etags[listing] = response.headers["ETag"]
+        return statuses
+
+    async def assert_changed(self):
+        assert await self.poll() == {"purchases": 200, "alerts": 200}
+        assert await self.poll() == {"purchases": 304, "alerts": 304}
+
+
+async def test_if_none_match_gets_304_until_a_write(client, db):
+    listings = Listings(client)
+    first = await client.get("/api/purchases/1")
+    assert first.status_code == 200 and first.headers["Cache-Control"] == "no-cache"
+    etag = first.headers["ETag"]
+
+    unchanged = await client.get("/api/purchases/1", headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304 and unchanged.content == b""
+    assert unchanged.headers["ETag"] == etag
+
+    # Weak comparison: the strong form of the tag, lists and * all match
+    for header in (etag.removeprefix("W/"), f'"nope", {etag}', "*"):
+        assert (await client.get("/api/purchases/1", headers={"If-None-Match": header})).status_code == 304
+    assert (await client.get("/api/purchases/1", headers={"If-None-Match": '"1-999"'})).status_code == 200
+
+    await listings.poll()
+    await insert_purchases(db, [purchase_row(1, "A-1")])
+    await db.commit()
+    await listings.assert_changed()
+    changed = await client.get("/api/purchases/1", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and "Last-Modified" in changed.headers
+
+
+async def test_other_users_writes_keep_the_etag(client, db):
+    listings = Listings(client)
+    await listings.poll()
+    await insert_purchases(db, [purchase_row(2, "B-1")])
+    await db.commit()
+    assert await listings.poll() == {"purchases": 304, "alerts": 304}
+
+
+async def test_every_write_path_changes_the_etag(client, db, sendgrid, monkeypatch):
+    import ingest
+    import scheduler
+    from parse_executor import parse_executor
+
+    monkeypatch.setattr(parse_executor, "mode", "inline")
+    listings = Listings(client)
+    await listings.poll()
+
+    # Ingest insert
+    db.add(Email(user_id=1, provider_message_id="m1", from_address="orders@mugs.example", from_domain="mugs.example",
+                 subject="Your order confirmation", parsed_status="processing",
+                 body_text="Thank you for your order! Order number A-12345. Order total: $24.50. Items: mugs."))
+    await db.commit()
+    email_id = await db.scalar(select(Email.id))
+    assert (await ingest.process_claimed_email(email_id))["status"] == "ok"
+    await listings.assert_changed()
+    purchase_id = await db.scalar(select(Purchase.id))
+
+    # PATCH status, then return window
+    assert (await client.patch(f"/api/purchases/{purchase_id}", json={"return_window_days": 2})).status_code == 200
+    await listings.assert_changed()
+    assert (await client.patch(f"/api/purchases/{purchase_id}", json={"status": "kept"})).status_code == 200
+    await listings.assert_changed()
+    assert (await client.patch(f"/api/purchases/{purchase_id}", json={"status": "active"})).status_code == 200
+    await listings.assert_changed()
+
+    # Preference change rebuilding the schedule
+    assert (await client.patch("/api/users/1/preferences", json={"alert_offsets_days": [2, 1]})).status_code == 200
+    await listings.assert_changed()
+
+    # Alert claim, then its delivery result
+    await db.execute(Alert.__table__.update().values(scheduled_for=TODAY))
+    await db.commit()
+    due, _, _ = await scheduler.claim_due_alerts(db, TODAY, worker_id="w1")
+    assert due
+    await listings.assert_changed()
+    sent, _ = await scheduler.deliver_alerts(db, due, worker_id="w1")
+    assert sent == len(due)
+    await listings.assert_changed()
+
+    # DELETE
+    assert (await client.delete(f"/api/purchases/{purchase_id}")).status_code == 200
+    await listings.assert_changed()
+
+
+async def page_through(client, path: str, limit: int, params: dict = None) -> list[dict]:
+    items, cursor = [], None
+    for _ in range(1000):
+        query = dict(params or {}, limit=limit)
+        if cursor:
+            query["cursor"] = cursor
+        response = await client.get(path, params=query)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) <= limit
+        items += page["items"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items
+    raise AssertionError("pagination did not terminate")
+
+
+@pytest.fixture
+async def mixed_purchases(client, db):
+    """Dated purchases with ties on the deadline, then undated ones, for user 1; a little noise for user 2."""
+    statuses = ["active", "kept", "returned"]
+    rows = []
+    for i in range(1, 31):
+        deadline = TODAY + timedelta(days=i % 4) if i % 3 else None
+        rows.append(Purchase(id=i, user_id=1, status=statuses[i % 3], return_deadline=deadline))
+    rows += [Purchase(id=100 + i, user_id=2, status="active", return_deadline=TODAY) for i in range(3)]
+    db.add_all(rows)
+    await db.commit()
+    return [r for r in rows if r.user_id == 1]
+
+
+def purchase_order(rows) -> list[int]:
+    dated = sorted((r for r in rows if r.return_deadline), key=lambda r: (r.return_deadline, r.id))
+    undated = sorted((r for r in rows if not r.return_deadline), key=lambda r: r.id)
+    return [r.id for r in dated + undated]
+
+
+async def test_purchase_pages_cover_dated_then_undated_rows(client, mixed_purchases):
+    expected = purchase_order(mixed_purchases)
+    dated = sum(1 for r in mixed_purchases if r.return_deadline)
+    # 1 and dated put a page boundary exactly where the undated rows begin
+    for limit in (1, 3, 4, 7, dated, dated + 1, 100):
+        assert [p["id"] for p in await page_through(client, "/api/purchases/1", limit)] == expected
+
+
+async def test_purchase_pages_with_status_filter(client, mixed_purchases):
+    wanted = [r for r in mixed_purchases if r.status in ("active", "kept")]
+    for limit in (2, 5):
+        items = await page_through(client, "/api/purchases/1", limit, {"status": ["active", "kept"]})
+        assert [p["id"] for p in items] == purchase_order(wanted)
+        assert {p["status"] for p in items} == {"active", "kept"}
+
+
+async def test_alert_pages_are_latest_first_with_ties_by_id(client, db, mixed_purchases):
+    db.add_all(
+        Alert(purchase_id=1 + i % 5, user_id=1, alert_type=f"deadline_{i}d", scheduled_for=TODAY - timedelta(days=i % 3),
+              status="sent" if i % 2 else "pending")
+        for i in range(17)
+    )
+    await db.commit()
+    alerts = (await db.scalars(select(Alert))).all()
+    expected = [a.id for a in sorted(alerts, key=lambda a: (a.scheduled_for, a.id), reverse=True)]
+    for limit in (1, 4, 6, 17, 50):
+        assert [a["id"] for a in await page_through(client, "/api/alerts/1", limit)] == expected
+
+    sent = await page_through(client, "/api/alerts/1", 3, {"status": "sent"})
+    assert [a["id"] for a in sent] == [i for i in expected if next(a for a in alerts if a.id == i).status == "sent"]
+
+
+@pytest.mark.parametrize("cursor", ["!!!", "bm90LWEtY3Vyc29y", "MjAyNi0xMy0wMTox", "OmFiYw", "w4k"])
+async def test_malformed_cursor_is_a_400(client, cursor):
+    for path in ("/api/purchases/1", "/api/alerts/1"):
+        response = await client.get(path, params={"cursor": cursor})
+        assert response.status_code == 400
+        assert response.json() == {"detail": "invalid cursor"}
+
+
+async def test_alert_cursor_without_a_date_is_a_400(client):
+    # Valid for purchases (the undated part of the listing); alerts always have a date
+    undated = "OjU"  # ":5"
+    assert (await client.get("/api/purchases/1", params={"cursor": undated})).status_code == 200
+    response = await client.get("/api/alerts/1", params={"cursor": undated})
+    assert response.status_code == 400
@@ -0,0 +1,129 @@
+import random
+from datetime import date, timedelta
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import select
+
+from database import Purchase, PurchaseDeadlineBucket, PurchaseStats, User, insert_purchases
+from purchase_stats import reconcile_purchase_stats
+
+pytestmark = pytest.mark.anyio
+
+TODAY = date.today()
+
+
+async def aggregates(session) -> tuple[dict, dict]:
+    """The two tables as plain dicts; a stats row left at zero is the same as no row."""
+    stats = {
+        row.user_id: (row.active_count, round(row.active_amount, 2))
+        for row in (await session.scalars(select(PurchaseStats))).all()
+        if (row.active_count, round(row.active_amount, 2)) != (0, 0.0)
+    }
+    buckets = {
+        (row.user_id, row.day): (row.count, round(row.amount, 2))
+        for row in (await session.scalars(select(PurchaseDeadlineBucket))).all()
+    }
+    return stats, buckets
+
+
+async def assert_matches_reconcile(session):
+    session.expire_all()
+    incremental = await aggregates(session)
+    await reconcile_purchase_stats(session)
+    rebuilt = await aggregates(session)
+    await session.rollback()
+    assert incremental == rebuilt
+
+
+@pytest.fixture
+async def client(db):
+    import purchases
+
+    db.add_all(User(id=i, email=f"user{i}@example.com", inbound_address=f"u{i}@in.example.com") for i in (1, 2))
+    await db.commit()
+    app = FastAPI()
+    app.include_router(purchases.router, prefix="/api/purchases")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+def purchase_row(user_id: int, order_id: str, amount: float, window: int = 30, status: str = "active") -> dict:
+    order_date = TODAY - timedelta(days=5)
+    return {
+        "user_id": user_id,
+        "order_id": order_id,
+        "merchant_domain": "shop.example",
+        "merchant_name": "Shop",
+        "order_date": order_date,
+        "total_amount": amount,
+        "return_window_days": window,
+        "return_deadline": order_date + timedelta(days=window) if window else None,
+        "status": status,
+    }
+
+
+async def insert(db, rows: list[dict]) -> list[int]:
+    inserted = await insert_purchases(db, rows)
+    await db.commit()
+    return [p.id for p in inserted]
+
+
+async def test_each_write_path_keeps_aggregates_exact(db, client):
+    a, b, c = await insert(db, [
+        purchase_row(1, "A-1", 19.99),
+        purchase_row(1, "A-2", 5.01),  # same deadline day as A-1
+        purchase_row(1, "A-3", 42.0, window=0),  # no deadline
+    ])
+    (d,) = await insert(db, [purchase_row(2, "B-1", 100.0, window=10)])
+    await assert_matches_reconcile(db)
+
+    # A duplicate order inserts nothing and changes nothing
+    assert await insert(db, [purchase_row(1, "A-1", 19.99)]) == []
+    await assert_matches_reconcile(db)
+
+    # An inactive purchase is stored but not counted
+    (e,) = await insert(db, [purchase_row(1, "A-4", 7.5, status="returned")])
+    await assert_matches_reconcile(db)
+
+    for patch_id, body in [
+        (a, {"status": "returned"}),
+        (a, {"status": "active"}),
+        (b, {"return_window_days": 60}),  # moves to another deadline bucket
+        (e, {"status": "active"}),
+        (e, {"return_window_days": 60}),  # joins b's bucket
+        (d, {"status": "kept"}),
+    ]:
+        assert (await client.patch(f"/api/purchases/{patch_id}", json=body)).status_code == 200
+        await assert_matches_reconcile(db)
+
+    for delete_id in (b, c, d):
+        assert (await client.delete(f"/api/purchases/{delete_id}")).status_code == 200
+        await assert_matches_reconcile(db)
+
+    summary = (await client.get("/api/purchases/1/summary")).json()
+    assert (summary["active_count"], summary["active_amount"]) == (2, 27.49)
+
+
+async def test_random_write_sequence_matches_reconcile(db, client):
+    rng = random.Random(7)
+    ids: list[int] = []
+    for step in range(60):
+        action = rng.choice(["insert", "insert", "status", "window", "delete"]) if ids else "insert"
+        if action == "insert":
+            ids += await insert(db, [
+                purchase_row(rng.choice((1, 2)), f"R-{rng.randrange(40)}", round(rng.uniform(1, 300), 2),
+                             window=rng.choice((0, 14, 30)), status=rng.choice(("active", "active", "returned")))
+            ])
+        elif action == "status":
+            body = {"status": rng.choice(("active", "returned", "kept"))}
+            assert (await client.patch(f"/api/purchases/{rng.choice(ids)}", json=body)).status_code == 200
+        elif action == "window":
+            body = {"return_window_days": rng.choice((7, 14, 30, 90))}
+            assert (await client.patch(f"/api/purchases/{rng.choice(ids)}", json=body)).status_code == 200
+        else:
+            purchase_id = ids.pop(rng.randrange(len(ids)))
+            assert (await client.delete(f"/api/purchases/{purchase_id}")).status_code == 200
+        await assert_matches_reconcile(db)
+    assert len((await db.scalars(select(Purchase))).all()) == len(ids)
@@ -0,0 +1,26 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from database import Alert, Purchase, User
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_delete_purchase_removes_delivered_alerts(db):
+    from purchases import delete_purchase
+
+    today = date.today()
+    db.add(User(id=1, email="user@example.com", inbound_address="u1@in.example.com"))
+    db.add(Purchase(id=1, user_id=1, status="active", total_amount=30.0, return_deadline=today + timedelta(days=2)))
+    db.add_all([
+        Alert(purchase_id=1, user_id=1, alert_type="deadline_10d", scheduled_for=today - timedelta(days=8), status="sent"),
+        Alert(purchase_id=1, user_id=1, alert_type="deadline_3d", scheduled_for=today - timedelta(days=1), status="failed"),
+        Alert(purchase_id=1, user_id=1, alert_type="deadline_1d", scheduled_for=today + timedelta(days=1), status="pending"),
+    ])
+    await db.commit()
+
+    assert await delete_purchase(1, db) == {"status": "deleted"}
+    assert await db.scalar(select(func.count()).select_from(Alert)) == 0
+    assert await db.get(Purchase, 1) is None
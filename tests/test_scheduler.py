@@ -0,0 +1,225 @@
+import asyncio
+import os
+import subprocess
+import sys
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from conftest import ROOT
+from database import Alert, Purchase, User
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_due_alerts(session, users: int, alerts_per_user: int = 1) -> list[int]:
+    """`users` users with one active purchase each and alerts_per_user alerts due today."""
+    today = date.today()
+    session.add_all(User(id=i, email=f"user{i}@example.com", inbound_address=f"u{i}@in.example.com") for i in range(1, users + 1))
+    session.add_all(
+        Purchase(id=i, user_id=i, merchant_name=f"Shop {i}", total_amount=20.0, status="active", return_deadline=today + timedelta(days=3))
+        for i in range(1, users + 1)
+    )
+    session.add_all(
+        Alert(purchase_id=i, user_id=i, alert_type=f"deadline_{n}d", scheduled_for=today, status="pending")
+        for i in range(1, users + 1) for n in range(alerts_per_user)
+    )
+    await session.commit()
+    return list((await session.scalars(select(Alert.id))).all())
+
+
+async def test_concurrent_runs_send_each_alert_once(db, sendgrid):
+    """Several scheduler processes racing over the same due alerts, in small chunks."""
+    await add_due_alerts(db, users=300)
+    env = dict(
+        os.environ,
+        SENDGRID_API_KEY="test-key",
+        SENDGRID_URL=sendgrid.url,
+        ALERT_WRITE_BATCH="25",
+        ALERT_SEND_CONCURRENCY="5",
+    )
+    workers = [
+        await asyncio.create_subprocess_exec(sys.executable, "scheduler.py", cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+        for _ in range(4)
+    ]
+    assert [await w.wait() for w in workers] == [0, 0, 0, 0]
+
+    sends = Counter(sendgrid.recipients())
+    assert len(sends) == 300
+    assert set(sends.values()) == {1}
+    statuses = (await db.scalars(select(Alert.status))).all()
+    assert set(statuses) == {"sent"}
+
+
+async def test_chunks_keep_a_users_alerts_together(db, sendgrid, monkeypatch):
+    import scheduler
+
+    monkeypatch.setattr(scheduler, "ALERT_WRITE_BATCH", 4)
+    await add_due_alerts(db, users=5, alerts_per_user=3)
+    chunks = []
+    after = 0
+    while after is not None:
+        due, _, after = await scheduler.claim_due_alerts(db, date.today(), after_user_id=after)
+        chunks.append(sorted({item.purchase.user_id for item in due}))
+    # The 4th claimable alert belongs to user 2, so the first chunk takes all of user 2's
+    assert chunks == [[1, 2], [3, 4], [5]]
+
+
+async def test_results_need_a_live_claim(db, sendgrid):
+    """A worker whose lease expired and was reclaimed must not record its results."""
+    import scheduler
+
+    await add_due_alerts(db, users=2)
+    due, _, _ = await scheduler.claim_due_alerts(db, date.today(), worker_id="slow-worker")
+    await db.execute(update(Alert).values(lease_expires_at=datetime.utcnow() - timedelta(seconds=1)))
+    await db.commit()
+    reclaimed, _, _ = await scheduler.claim_due_alerts(db, date.today(), worker_id="other-worker")
+    assert len(reclaimed) == 2
+
+    sent, failed = await scheduler.deliver_alerts(db, due, worker_id="slow-worker")
+    assert (sent, failed) == (0, 0)
+    rows = (await db.execute(select(Alert.status, Alert.claimed_by))).all()
+    assert set(rows) == {("sending", "other-worker")}
+
+    sent, failed = await scheduler.deliver_alerts(db, reclaimed, worker_id="other-worker")
+    assert (sent, failed) == (2, 0)
+    assert set((await db.scalars(select(Alert.status))).all()) == {"sent"}
+
+
+async def test_delivery_retries_bounds_concurrency_and_records_outcomes(db, sendgrid, monkeypatch):
+    """Single mode against a stub SendGrid: 429/5xx are retried, 4xx fails at once."""
+    import threading
+    import time
+    import scheduler
+
+    monkeypatch.setattr(scheduler, "ALERT_SEND_CONCURRENCY", 4)
+    monkeypatch.setattr(scheduler, "ALERT_DELIVERY_MODE", "single")
+    attempts = Counter()
+    in_flight = [0, 0]  # current, peak
+    lock = threading.Lock()
+
+    def respond(payload):
+        to = payload["personalizations"][0]["to"][0]["email"]
+        with lock:
+            attempts[to] += 1
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+            n = attempts[to]
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        if to == "user1@example.com":
+            return 429 if n == 1 else 202  # throttled once, then accepted
+        if to == "user2@example.com":
+            return 503  # never recovers
+        if to == "user3@example.com":
+            return 400  # rejected, not retried
+        return 202
+
+    sendgrid.status = respond
+    await add_due_alerts(db, users=20)
+    counts = await scheduler.run_alerts()
+
+    assert (counts["sent"], counts["failed"]) == (18, 2)
+    assert attempts["user1@example.com"] == 2
+    assert attempts["user2@example.com"] == scheduler.SENDGRID_MAX_RETRIES + 1
+    assert attempts["user3@example.com"] == 1
+    assert in_flight[1] <= 4
+    statuses = dict((await db.execute(select(Alert.user_id, Alert.status))).all())
+    assert statuses[2] == statuses[3] == "failed"
+    assert sum(status == "sent" for status in statuses.values()) == 18
+
+
+async def test_batch_mode_sends_personalizations_and_falls_back(db, sendgrid, monkeypatch):
+    """Batch mode: one request per SENDGRID_BATCH_SIZE alerts; a rejected batch is resent per recipient."""
+    import scheduler
+
+    monkeypatch.setattr(scheduler, "ALERT_DELIVERY_MODE", "batch")
+    monkeypatch.setattr(scheduler, "SENDGRID_BATCH_SIZE", 10)
+    rejected = {"done": False}
+
+    def respond(payload):
+        if len(payload["personalizations"]) > 1 and not rejected["done"]:
+            rejected["done"] = True
+            return 400
+        return 202
+
+    sendgrid.status = respond
+    await add_due_alerts(db, users=25)
+    counts = await scheduler.run_alerts()
+
+    assert (counts["sent"], counts["failed"]) == (25, 0)
+    batch_sizes = sorted(len(p["personalizations"]) for p in sendgrid.payloads)
+    # Batches of 10, 10 and 5; the one rejected batch of 10 went again as 10 single sends
+    assert batch_sizes == [1] * 10 + [5, 10, 10]
+    assert Counter(sendgrid.recipients()).most_common(1)[0][1] <= 2
+    first = next(p for p in sendgrid.payloads if len(p["personalizations"]) > 1)
+    assert {"purchase_id", "alert_type"} <= set(first["personalizations"][0]["custom_args"])
+    assert set((await db.scalars(select(Alert.status))).all()) == {"sent"}
+
+
+async def test_late_run_skips_stale_and_superseded_reminders(db, sendgrid):
+    """The job running days late sends only the nearest reminder and never one for a passed deadline."""
+    import scheduler
+
+    today = date.today()
+    db.add_all([
+        User(id=1, email="soon@example.com", inbound_address="u1@in.example.com"),
+        User(id=2, email="past@example.com", inbound_address="u2@in.example.com"),
+    ])
+    db.add_all([
+        Purchase(id=1, user_id=1, merchant_name="Shop", total_amount=20.0, status="active", return_deadline=today + timedelta(days=1)),
+        Purchase(id=2, user_id=2, merchant_name="Shop", total_amount=20.0, status="active", return_deadline=today - timedelta(days=2)),
+    ])
+    for purchase_id, deadline in ((1, today + timedelta(days=1)), (2, today - timedelta(days=2))):
+        db.add_all(
+            Alert(purchase_id=purchase_id, user_id=purchase_id, alert_type=alert_type, scheduled_for=scheduled_for, status="pending")
+            for alert_type, scheduled_for in scheduler.alert_schedule(
+                Purchase(status="active", return_deadline=deadline, total_amount=20.0), [10, 3, 1], None
+            )
+            if scheduled_for <= today
+        )
+    await db.commit()
+
+    counts = await scheduler.run_alerts()
+
+    statuses = {(a.purchase_id, a.alert_type): a.status for a in (await db.scalars(select(Alert))).all()}
+    assert statuses == {
+        (1, "deadline_10d"): "skipped",
+        (1, "deadline_3d"): "skipped",
+        (1, "deadline_1d"): "sent",
+        (2, "deadline_10d"): "skipped",
+        (2, "deadline_3d"): "skipped",
+        (2, "deadline_1d"): "skipped",
+        (2, "expired"): "sent",
+    }
+    assert (counts["sent"], counts["skipped"]) == (2, 5)
+    assert sorted(sendgrid.recipients()) == ["past@example.com", "soon@example.com"]
+
+
+async def test_empty_offsets_mean_no_deadline_reminders(db):
+    import scheduler
+    from database import UserPreferences
+
+    today = date.today()
+    db.add_all(User(id=i, email=f"user{i}@example.com", inbound_address=f"u{i}@in.example.com") for i in (1, 2, 3))
+    db.add_all([
+        UserPreferences(user_id=1, alert_offsets_days=[]),
+        UserPreferences(user_id=2, alert_offsets_days=None),
+    ])
+    purchases = [
+        Purchase(id=i, user_id=i, merchant_name="Shop", total_amount=20.0, status="active", return_deadline=today + timedelta(days=20))
+        for i in (1, 2, 3)
+    ]
+    db.add_all(purchases)
+    await db.flush()
+    await scheduler.schedule_alerts(db, purchases, today)
+    await db.commit()
+
+    types = {}
+    for purchase_id, alert_type in (await db.execute(select(Alert.purchase_id, Alert.alert_type))).all():
+        types.setdefault(purchase_id, set()).add(alert_type)
+    assert types[1] == {"expired"}
+    assert types[2] == types[3] == {"deadline_10d", "deadline_3d", "deadline_1d", "expired"}
@@ -2,6 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from database import get_db, User, UserPreferences, Alert
+from scheduler import rebuild_alert_schedule
+from recipients import invalidate_recipient
 from pydantic import BaseModel
 from typing import Optional
 import uuid
@@ -15,6 +17,8 @@ class UpdatePreferences(BaseModel):
     min_purchase_amount: Optional[float] = None
     alert_offsets_days: Optional[list[int]] = None
     timezone: Optional[str] = None
+    alert_digest: Optional[bool] = None
+    locale: Optional[str] = None
 
 @router.post("/")
 async def create_user(body: CreateUser, db: AsyncSession = Depends(get_db)):
@@ -25,15 +29,17 @@ async def create_user(body: CreateUser, db: AsyncSession = Depends(get_db)):
     # Generate unique inbound address
     slug = body.email.split("@")[0].lower().replace(".", "")[:12]
     unique_id = str(uuid.uuid4())[:8]
-    inbound = f"{slug}{unique_id}@inbox.returnradar.app"
+    local_part = f"{slug}{unique_id}"
+    inbound = f"{local_part}@inbox.returnradar.app"
 
-    user = User(email=body.email, inbound_address=inbound)
+    user = User(email=body.email, inbound_address=inbound, inbound_local_part=local_part)
     db.add(user)
     await db.flush()
 
     prefs = UserPreferences(user_id=user.id)
     db.add(prefs)
     await db.commit()
+    invalidate_recipient(local_part)
 
     return {"id": user.id, "email": user.email, "inbound_address": inbound}
 
@@ -59,6 +65,12 @@ async def update_preferences(user_id: int, body: UpdatePreferences, db: AsyncSes
         prefs.alert_offsets_days = body.alert_offsets_days
     if body.timezone is not None:
         prefs.timezone = body.timezone
+    if body.alert_digest is not None:
+        prefs.alert_digest = body.alert_digest
+    if body.locale is not None:
+        prefs.locale = body.locale
 
     await db.commit()
+    if body.alert_offsets_days is not None or body.min_purchase_amount is not None:
+        await rebuild_alert_schedule(db, user_id=user_id)
     return {"status": "ok"}